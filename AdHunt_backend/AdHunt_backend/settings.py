@@ -16,12 +16,43 @@ ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "*").split(",")
 
 # Оптимизация производительности
 CONN_MAX_AGE = 60  # Время жизни соединения с базой данных в секундах
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Общий кеш для всех воркеров и инстансов: CACHE_URL=redis://host:6379/0
+# (fakeredis:// поднимает Redis внутри процесса для тестов). Без CACHE_URL кеш локальный.
+CACHE_URL = os.getenv("CACHE_URL", "")
+CACHE_COMPRESS_MIN_SIZE = int(os.getenv("CACHE_COMPRESS_MIN_SIZE", "1024"))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", "6"))
+if CACHE_URL.startswith(('redis://', 'rediss://', 'unix://', 'fakeredis://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'api.cache_backends.FallbackRedisCache',
+            'LOCATION': CACHE_URL,
+            'KEY_PREFIX': os.getenv("CACHE_KEY_PREFIX", "adhunt"),
+            'OPTIONS': {
+                'pool_class': (
+                    'api.cache_backends.FakeRedisConnectionPool'
+                    if CACHE_URL.startswith('fakeredis://')
+                    else 'redis.BlockingConnectionPool'
+                ),
+                'max_connections': int(os.getenv("CACHE_MAX_CONNECTIONS", "20")),
+                'timeout': float(os.getenv("CACHE_POOL_TIMEOUT", "1")),
+                'socket_connect_timeout': float(os.getenv("CACHE_SOCKET_TIMEOUT", "0.5")),
+                'socket_timeout': float(os.getenv("CACHE_SOCKET_TIMEOUT", "0.5")),
+                'serializer': (
+                    'api.cache_backends.CompressedRedisSerializer'
+                    if os.getenv("CACHE_COMPRESS", "True") == "True"
+                    else 'django.core.cache.backends.redis.RedisSerializer'
+                ),
+                'FALLBACK_RETRY_INTERVAL': int(os.getenv("CACHE_FALLBACK_RETRY_INTERVAL", "30")),
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
     }
-}
 
 # Отключение логирования
 LOGGING = {
@@ -84,6 +115,14 @@ if not DATABASE_URL:
 DATABASES = {
     'default': dj_database_url.parse(DATABASE_URL)
 }
+USE_POSTGRES = DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql'
+
+# Поиск объявлений: postgres (tsvector + триграммы) или icontains для SQLite
+ADVERTISEMENT_SEARCH_BACKEND = os.getenv(
+    "ADVERTISEMENT_SEARCH_BACKEND", "postgres" if USE_POSTGRES else "icontains"
+)
+if USE_POSTGRES:
+    INSTALLED_APPS.append('django.contrib.postgres')
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -105,6 +144,14 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Число потоков для параллельной загрузки изображений объявления
+IMAGE_UPLOAD_WORKERS = int(os.getenv("IMAGE_UPLOAD_WORKERS", "8"))
+
+# Уменьшенные копии изображений: имя -> наибольшая сторона в пикселях
+IMAGE_VARIANTS = {'thumb': 200, 'card': 480, 'full': 1280}
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2560"))
+IMAGE_PROCESSING_WORKERS = int(os.getenv("IMAGE_PROCESSING_WORKERS", "2"))
+
 # S3-compatible object storage
 if os.getenv("USE_S3", "False") == "True":
     AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
@@ -119,16 +166,91 @@ if os.getenv("USE_S3", "False") == "True":
     STATICFILES_STORAGE = 'storages.backends.s3boto3.S3StaticStorage'
     MEDIA_URL = f"{AWS_S3_ENDPOINT_URL}/{AWS_STORAGE_BUCKET_NAME}/media/"
 
+# Очередь модерации (Yandex Message Queue, SQS-совместимый API)
+USE_YMQ = os.getenv("USE_YMQ", "False") == "True"
+YMQ_ADS_QUEUE_URL = os.getenv("YMQ_ADS_QUEUE_URL")
+YMQ_ENDPOINT_URL = os.getenv("YMQ_ENDPOINT_URL", "https://message-queue.api.cloud.yandex.net")
+YMQ_REGION = os.getenv("YMQ_REGION", "ru-central1")
+YMQ_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+YMQ_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+YMQ_MAX_POOL_CONNECTIONS = int(os.getenv("YMQ_MAX_POOL_CONNECTIONS", "10"))
+YMQ_BUFFER_SIZE = int(os.getenv("YMQ_BUFFER_SIZE", "1000"))
+YMQ_BATCH_LINGER = float(os.getenv("YMQ_BATCH_LINGER", "0.05"))
+YMQ_MAX_RETRIES = int(os.getenv("YMQ_MAX_RETRIES", "5"))
+YMQ_RETRY_BASE_DELAY = float(os.getenv("YMQ_RETRY_BASE_DELAY", "0.2"))
+YMQ_RETRY_MAX_DELAY = float(os.getenv("YMQ_RETRY_MAX_DELAY", "5"))
+# После стольких неудачных отправок событие помечается failed_at и ждёт relay_outbox --requeue-failed
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+# Срок, на который релей берёт события; должен перекрывать все повторы send_with_retry
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+
+if USE_YMQ and not all([YMQ_ADS_QUEUE_URL, YMQ_ACCESS_KEY_ID, YMQ_SECRET_ACCESS_KEY]):
+    raise Exception("One or more YMQ environment variables are missing.")
+
 # Auth user
 AUTH_USER_MODEL = 'api.CustomUser'
 
 # REST and JWT
+# По умолчанию пользователь собирается из claims токена без запроса к БД;
+# JWT_STATELESS_AUTH=False возвращает загрузку CustomUser на каждый запрос
+JWT_STATELESS_AUTH = os.getenv("JWT_STATELESS_AUTH", "True") == "True"
+# Сколько секунд кешируется is_active пользователя для проверки блокировки
+AUTH_ACTIVE_CACHE_TIMEOUT = int(os.getenv("AUTH_ACTIVE_CACHE_TIMEOUT", "60"))
+
+# JSON через orjson (api.renderers); без установленного orjson работает стандартный json
+FAST_JSON = os.getenv("FAST_JSON", "True") == "True"
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.ClaimsJWTAuthentication'
+        if JWT_STATELESS_AUTH
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
 }
 
+if FAST_JSON:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    )
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'] = (
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    )
+
+# Время жизни закешированных ответов ленты и карточки объявления (секунды)
+ADVERTISEMENTS_CACHE_TIMEOUT = int(os.getenv("ADVERTISEMENTS_CACHE_TIMEOUT", "300"))
+
+# Время жизни закешированного множества id избранного пользователя (секунды)
+# и сколько id можно проверить одним запросом к /api/advertisements/favorites/status/
+FAVORITES_CACHE_TIMEOUT = int(os.getenv("FAVORITES_CACHE_TIMEOUT", "600"))
+FAVORITES_STATUS_MAX_IDS = int(os.getenv("FAVORITES_STATUS_MAX_IDS", "500"))
+
+# Границы корзин гистограммы цен в /api/advertisements/facets/ по умолчанию и их максимальное число
+FACETS_PRICE_EDGES = os.getenv("FACETS_PRICE_EDGES", "1000,5000,10000,50000,100000")
+FACETS_MAX_PRICE_EDGES = int(os.getenv("FACETS_MAX_PRICE_EDGES", "50"))
+
+# X-Total-Count: до порога число точное, выше - оценка планировщика PostgreSQL;
+# точный счёт по ?exact_count=true ограничен statement_timeout (миллисекунды)
+COUNT_EXACT_THRESHOLD = int(os.getenv("COUNT_EXACT_THRESHOLD", "1000"))
+COUNT_EXACT_TIMEOUT_MS = int(os.getenv("COUNT_EXACT_TIMEOUT_MS", "1000"))
+
+# Курсорная пагинация списков объявлений
+ADVERTISEMENTS_PAGE_SIZE = int(os.getenv("ADVERTISEMENTS_PAGE_SIZE", "20"))
+ADVERTISEMENTS_MAX_PAGE_SIZE = int(os.getenv("ADVERTISEMENTS_MAX_PAGE_SIZE", "100"))
+
+# Максимум решений в одном запросе массовой модерации
+MODERATION_BULK_MAX_SIZE = int(os.getenv("MODERATION_BULK_MAX_SIZE", "500"))
+
+# Аренда объявлений на модерацию: длительность (секунды) и сколько объявлений берётся за раз
+MODERATION_LEASE_SECONDS = int(os.getenv("MODERATION_LEASE_SECONDS", "600"))
+MODERATION_CLAIM_SIZE = int(os.getenv("MODERATION_CLAIM_SIZE", "10"))
+MODERATION_CLAIM_MAX_SIZE = int(os.getenv("MODERATION_CLAIM_MAX_SIZE", "100"))
+
+# Сколько строк за раз читается из БД и сериализуется при потоковой выгрузке (?stream=1)
+ADVERTISEMENTS_STREAM_CHUNK_SIZE = int(os.getenv("ADVERTISEMENTS_STREAM_CHUNK_SIZE", "1000"))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'ROTATE_REFRESH_TOKENS': False,
@@ -138,7 +260,7 @@ SIMPLE_JWT = {
     'USER_AUTHENTICATION_RULE': 'rest_framework_simplejwt.authentication.default_user_authentication_rule',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
-    'TOKEN_USER_CLASS': 'rest_framework_simplejwt.models.TokenUser',
+    'TOKEN_USER_CLASS': 'api.authentication.ClaimsUser',
     'JTI_CLAIM': 'jti',
     'TOKEN_OBTAIN_SERIALIZER': 'api.views.CustomTokenObtainPairSerializer',
 }
@@ -179,6 +301,8 @@ SWAGGER_SETTINGS = {
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
+# Браузерные клиенты видят только перечисленные заголовки ответа
+CORS_EXPOSE_HEADERS = ['X-Total-Count', 'X-Total-Count-Exact', 'ETag', 'Last-Modified']
 
 # Default PK
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -19,10 +19,12 @@ from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from api.views import (
     RegisterView, CustomTokenObtainPairView,
-    AdvertisementListView, AdvertisementCreateView, AdvertisementDetailView,
-    UserAdvertisementsView, ModeratorAdvertisementsView, FavoriteAdvertisementView,
+    AdvertisementListView, AdvertisementFacetsView, AdvertisementCreateView, AdvertisementDetailView,
+    UserAdvertisementsView, ModeratorAdvertisementsView, BulkModerationView, ModeratorClaimView,
+    FavoriteAdvertisementView, FavoriteView, FavoriteStatusView,
     UserProfileView, ChangePasswordView
 )
+from api.async_views import AsyncAdvertisementListView, AsyncAdvertisementDetailView
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
@@ -52,13 +54,22 @@ urlpatterns = [
     
     # Advertisement URLs
     path('api/advertisements/', AdvertisementListView.as_view(), name='advertisement-list'),
+    path('api/advertisements/facets/', AdvertisementFacetsView.as_view(), name='advertisement-facets'),
     path('api/advertisements/create/', AdvertisementCreateView.as_view(), name='advertisement-create'),
     path('api/advertisements/<int:pk>/', AdvertisementDetailView.as_view(), name='advertisement-detail'),
+    path('api/advertisements/<int:pk>/favorite/', FavoriteView.as_view(), name='advertisement-favorite'),
     path('api/advertisements/my/', UserAdvertisementsView.as_view(), name='user-advertisements'),
     path('api/advertisements/moderate/', ModeratorAdvertisementsView.as_view(), name='moderator-advertisements'),
     path('api/advertisements/moderate/<int:pk>/', ModeratorAdvertisementsView.as_view(), name='moderator-advertisement-detail'),
+    path('api/advertisements/moderate/bulk/', BulkModerationView.as_view(), name='moderator-advertisements-bulk'),
+    path('api/advertisements/moderate/claim/', ModeratorClaimView.as_view(), name='moderator-advertisements-claim'),
     path('api/advertisements/favorites/', FavoriteAdvertisementView.as_view(), name='favorite-advertisements'),
+    path('api/advertisements/favorites/status/', FavoriteStatusView.as_view(), name='favorite-advertisements-status'),
     path('api/advertisements/favorites/<int:pk>/', FavoriteAdvertisementView.as_view(), name='favorite-advertisement-detail'),
+
+    # Async (ASGI) Advertisement URLs
+    path('api/async/advertisements/', AsyncAdvertisementListView.as_view(), name='async-advertisement-list'),
+    path('api/async/advertisements/<int:pk>/', AsyncAdvertisementDetailView.as_view(), name='async-advertisement-detail'),
     
     # Swagger URLs
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
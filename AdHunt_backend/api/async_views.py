@@ -0,0 +1,127 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .cache import adetail_cache_key, afeed_cache_key, aget_or_build, aget_or_build_with_validators, aget_validators
+from .conditional import aadvertisement_metadata, make_etag, not_modified, set_validators
+from .counting import count_advertisements
+from .fast_serializers import AdvertisementRowSerializer, advertisement_rows
+from .favorites import aget_user_favorite_ids
+from .models import Advertisement
+from .renderers import FastJSONRenderer
+from .views import feed_count_params, feed_item_ids, feed_query, set_total_count, wants_exact_count
+
+
+async def aget_favorite_ids(request, ids):
+    if not request.user.is_authenticated or not ids:
+        return set()
+    return (await aget_user_favorite_ids(request.user.id)).intersection(ids)
+
+
+async def aoverlay_favorites(request, items):
+    favorite_ids = await aget_favorite_ids(request, [item['id'] for item in items])
+    for item in items:
+        item['is_favorite'] = item['id'] in favorite_ids
+
+
+async def afeed_validators(request, validators):
+    digest, built_at, ids = validators
+    return make_etag(digest, sorted(await aget_favorite_ids(request, ids))), built_at
+
+
+async def abuild_advertisements_data(request, advertisements, paginator):
+    # Тело для общего кеша: is_favorite всегда false, как в build_advertisements_data
+    serializer = AdvertisementRowSerializer(request, set())
+    rows = advertisement_rows(advertisements, paginator.field, paginator.pk_field)
+    page = await paginator.apaginate_queryset(rows, request)
+    if page is not None:
+        return paginator.get_paginated_data(await serializer.aserialize(page))
+    return await serializer.aserialize([row async for row in rows])
+
+
+class AsyncAPIView(View):
+    """
+    Асинхронное представление только для чтения.
+
+    DRF 3.15 не умеет async-обработчики, поэтому аутентификация, формат
+    ответа и ошибок повторяют APIView вручную: запрос оборачивается в
+    Request из DRF, пользователь определяется DEFAULT_AUTHENTICATION_CLASSES
+    в потоке (simplejwt синхронный), ответ рендерится FastJSONRenderer.
+    Тела ответов и ключи кеша общие с синхронными представлениями.
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    def render(self, data, status=200):
+        return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+    def handle_exception(self, request, exc):
+        if isinstance(exc, Http404):
+            exc = NotFound()
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = self.render(data, status=exc.status_code)
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)) and request.authenticators:
+            response['WWW-Authenticate'] = request.authenticators[0].authenticate_header(request)
+        return response
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(
+            request, authenticators=[authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        )
+        try:
+            await sync_to_async(lambda: request.user)()
+            return await super().dispatch(request, *args, **kwargs)
+        except (APIException, Http404) as exc:
+            return self.handle_exception(request, exc)
+
+
+class AsyncAdvertisementListView(AsyncAPIView):
+    # Аналог AdvertisementListView.get на async ORM и асинхронном кеше
+    async def get(self, request):
+        advertisements, paginator, params = feed_query(request)
+        paginated = params['paginated']
+        cache_key = await afeed_cache_key(request, params)
+        validators = await aget_validators(cache_key)
+        if validators is not None:
+            response = not_modified(request, *await afeed_validators(request, validators))
+            if response is not None:
+                return response
+
+        data, validators = await aget_or_build_with_validators(
+            cache_key,
+            lambda: abuild_advertisements_data(request, advertisements, paginator),
+            feed_item_ids,
+        )
+        await aoverlay_favorites(request, data['results'] if paginated else data)
+        response = set_validators(self.render(data), *await afeed_validators(request, validators))
+        if paginated:
+            # Оценка планировщика и statement_timeout - через курсор, в потоке
+            count, exact = await aget_or_build(
+                await afeed_cache_key(request, feed_count_params(request, params)),
+                sync_to_async(lambda: count_advertisements(advertisements, exact=wants_exact_count(request))),
+            )
+        else:
+            count, exact = len(data), True
+        return set_total_count(response, count, exact)
+
+
+class AsyncAdvertisementDetailView(AsyncAPIView):
+    # Аналог AdvertisementDetailView.get; карточку собирает быстрый сериализатор, JSON совпадает
+    async def get(self, request, pk):
+        metadata_etag, last_modified = await aadvertisement_metadata(pk)
+        etag = make_etag(metadata_etag, request.build_absolute_uri('/'), bool(await aget_favorite_ids(request, [pk])))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        async def build():
+            rows = [row async for row in advertisement_rows(Advertisement.objects.filter(pk=pk))]
+            if not rows:
+                raise Http404
+            return (await AdvertisementRowSerializer(request, set()).aserialize(rows))[0]
+
+        data = await aget_or_build(await adetail_cache_key(request, pk, metadata_etag), build)
+        await aoverlay_favorites(request, [data])
+        return set_validators(self.render(data), etag, last_modified)
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import CustomUser
+
+
+class ClaimsUser(TokenUser):
+    """
+    Пользователь, собранный из claims токена (id, role) без запроса к БД.
+
+    Остальные поля модели (email, имя, телефон и т.д.) загружаются из БД при
+    первом обращении, один раз на запрос. Поля, которые пользователь меняет
+    в профиле, из claims не берутся: токен хранил бы старое значение до
+    истечения срока.
+    """
+    # Только то, что нужно для проверки прав и не меняется через профиль
+    claim_fields = frozenset({'role'})
+
+    @cached_property
+    def db_user(self):
+        return CustomUser.objects.get(pk=self.id)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_') or attr == 'token':
+            raise AttributeError(attr)
+        if attr in self.claim_fields and attr in self.token:
+            return self.token[attr]
+        return getattr(self.db_user, attr)
+
+    def __str__(self):
+        return str(self.email)
+
+    def save(self, *args, **kwargs):
+        self.db_user.save(*args, **kwargs)
+
+    def set_password(self, raw_password):
+        self.db_user.set_password(raw_password)
+
+    def check_password(self, raw_password):
+        return self.db_user.check_password(raw_password)
+
+
+def get_db_user(user):
+    # Для изменения профиля нужен настоящий экземпляр модели
+    return user.db_user if isinstance(user, ClaimsUser) else user
+
+
+def active_cache_key(user_id):
+    return f'auth:active:{user_id}'
+
+
+def is_user_active(user_id):
+    key = active_cache_key(user_id)
+    is_active = cache.get(key)
+    if is_active is None:
+        # Удалённый пользователь считается неактивным
+        is_active = bool(CustomUser.objects.filter(pk=user_id).values_list('is_active', flat=True).first())
+        cache.set(key, is_active, settings.AUTH_ACTIVE_CACHE_TIMEOUT)
+    return is_active
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    # Как JWTAuthentication, но без SELECT пользователя на каждый запрос: блокировка
+    # проверяется по is_active, который кешируется на AUTH_ACTIVE_CACHE_TIMEOUT секунд
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if not is_user_active(validated_token[api_settings.USER_ID_CLAIM]):
+            raise AuthenticationFailed('Пользователь неактивен', code='user_inactive')
+        return user
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'advertisements:version'
+
+
+def get_advertisements_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # После вытеснения ключа счётчик начинается с текущего времени,
+        # чтобы не совпасть с версиями уже лежащих в кеше ответов
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def aget_advertisements_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def _bump_advertisements_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        get_advertisements_version()
+
+
+def bump_advertisements_version():
+    # Версия меняется после коммита, иначе параллельный запрос закеширует старые данные под новой версией
+    transaction.on_commit(_bump_advertisements_version)
+
+
+def _make_key(kind, version, request, params):
+    # Абсолютные ссылки на изображения зависят от хоста запроса
+    payload = json.dumps([request.build_absolute_uri('/'), params], sort_keys=True, default=str)
+    digest = hashlib.sha1(payload.encode()).hexdigest()
+    return f'advertisements:{kind}:{version}:{digest}'
+
+
+def feed_cache_key(request, params):
+    return _make_key('feed', get_advertisements_version(), request, params)
+
+
+async def afeed_cache_key(request, params):
+    return _make_key('feed', await aget_advertisements_version(), request, params)
+
+
+def detail_cache_key(request, pk, etag=None):
+    # etag - хеш метаданных объявления: новая версия карточки не совпадёт со старой записью в кеше
+    return _make_key('detail', get_advertisements_version(), request, {'pk': pk, 'etag': etag})
+
+
+async def adetail_cache_key(request, pk, etag=None):
+    return _make_key('detail', await aget_advertisements_version(), request, {'pk': pk, 'etag': etag})
+
+
+def get_or_build(key, build):
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.ADVERTISEMENTS_CACHE_TIMEOUT)
+    return data
+
+
+async def aget_or_build(key, abuild):
+    data = await cache.aget(key)
+    if data is None:
+        data = await abuild()
+        await cache.aset(key, data, settings.ADVERTISEMENTS_CACHE_TIMEOUT)
+    return data
+
+
+def _validators_key(key):
+    return f'{key}:validators'
+
+
+def _make_validators(data, get_ids):
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest(), int(time.time()), get_ids(data)
+
+
+def get_validators(key):
+    return cache.get(_validators_key(key))
+
+
+async def aget_validators(key):
+    return await cache.aget(_validators_key(key))
+
+
+def get_or_build_with_validators(key, build, get_ids):
+    """
+    Как get_or_build, но рядом с данными хранит валидаторы для условного GET:
+    (хеш данных, время сборки, id объявлений в ответе). Валидаторы лежат
+    отдельным маленьким ключом, чтобы ответ 304 не читал из кеша сами данные.
+    """
+    data = cache.get(key)
+    validators = get_validators(key) if data is not None else None
+    if data is None:
+        data = build()
+    if validators is None:
+        validators = _make_validators(data, get_ids)
+        cache.set_many({key: data, _validators_key(key): validators}, settings.ADVERTISEMENTS_CACHE_TIMEOUT)
+    return data, validators
+
+
+async def aget_or_build_with_validators(key, abuild, get_ids):
+    data = await cache.aget(key)
+    validators = await aget_validators(key) if data is not None else None
+    if data is None:
+        data = await abuild()
+    if validators is None:
+        validators = _make_validators(data, get_ids)
+        await cache.aset_many(
+            {key: data, _validators_key(key): validators}, settings.ADVERTISEMENTS_CACHE_TIMEOUT
+        )
+    return data, validators
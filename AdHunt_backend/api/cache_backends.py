@@ -0,0 +1,123 @@
+import logging
+import pickle
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache, RedisSerializer
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+
+class CompressedRedisSerializer(RedisSerializer):
+    # Первый байт значения помечает, сжат ли pickle: b'z' - zlib, b'p' - как есть
+    def __init__(self, protocol=None):
+        super().__init__(protocol)
+        self.min_size = settings.CACHE_COMPRESS_MIN_SIZE
+        self.level = settings.CACHE_COMPRESS_LEVEL
+
+    def dumps(self, obj):
+        if type(obj) is int:
+            return obj
+        data = pickle.dumps(obj, self.protocol)
+        if len(data) >= self.min_size:
+            return b'z' + zlib.compress(data, self.level)
+        return b'p' + data
+
+    def loads(self, data):
+        try:
+            return int(data)
+        except ValueError:
+            pass
+        marker, payload = data[:1], data[1:]
+        if marker == b'z':
+            payload = zlib.decompress(payload)
+        return pickle.loads(payload)
+
+
+class FakeRedisConnectionPool:
+    # Redis внутри процесса для тестов и локального запуска без сервера: CACHE_URL=fakeredis://
+    server = None
+
+    @classmethod
+    def from_url(cls, url, **options):
+        try:
+            import fakeredis
+        except ImportError:
+            raise ImproperlyConfigured(
+                'CACHE_URL=fakeredis:// нужен пакет fakeredis из requirements-dev.txt, в production укажите redis://'
+            )
+        import redis
+
+        if cls.server is None:
+            cls.server = fakeredis.FakeServer()
+        options.pop('timeout', None)
+        return redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=cls.server, **options)
+
+
+class FallbackRedisCache(RedisCache):
+    """
+    Redis-кеш, который при недоступности сервера временно работает
+    с локальным LocMemCache процесса, а через FALLBACK_RETRY_INTERVAL
+    секунд снова пробует Redis.
+    """
+
+    def __init__(self, server, params):
+        import redis
+
+        options = dict(params.get('OPTIONS', {}))
+        self._retry_interval = options.pop('FALLBACK_RETRY_INTERVAL', 30)
+        super().__init__(server, {**params, 'OPTIONS': options})
+
+        self._errors = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+        self._down_until = 0
+        fallback_params = {key: value for key, value in params.items() if key != 'OPTIONS'}
+        self._fallback = LocMemCache(f'fallback-{id(self)}', fallback_params)
+
+    @property
+    def is_degraded(self):
+        return time.monotonic() < self._down_until
+
+    def _call(self, name, *args, **kwargs):
+        if not self.is_degraded:
+            try:
+                return getattr(super(), name)(*args, **kwargs)
+            except self._errors as e:
+                logger.warning('Redis недоступен, используется локальный кеш: %s', e)
+                self._down_until = time.monotonic() + self._retry_interval
+        return getattr(self._fallback, name)(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        return self._call('add', *args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._call('get', *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._call('set', *args, **kwargs)
+
+    def touch(self, *args, **kwargs):
+        return self._call('touch', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call('delete', *args, **kwargs)
+
+    def get_many(self, *args, **kwargs):
+        return self._call('get_many', *args, **kwargs)
+
+    def has_key(self, *args, **kwargs):
+        return self._call('has_key', *args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        return self._call('incr', *args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        return self._call('set_many', *args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        return self._call('delete_many', *args, **kwargs)
+
+    def clear(self):
+        return self._call('clear')
@@ -0,0 +1,69 @@
+import hashlib
+import json
+
+from django.db.models import Count, Max, Q
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+
+from .fast_serializers import AUTHOR_LOOKUPS
+from .models import Advertisement
+
+
+def make_etag(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return quote_etag(hashlib.sha1(payload.encode()).hexdigest())
+
+
+def _metadata_queryset(pk):
+    return (
+        Advertisement.objects.filter(pk=pk)
+        .values('updated_at', 'status', 'favorites_count', *AUTHOR_LOOKUPS)
+        .annotate(
+            image_count=Count('images'),
+            last_image_id=Max('images__id'),
+            last_image_at=Max('images__created_at'),
+            processed_images=Count('images', filter=~Q(images__variants={})),
+        )
+        .order_by()[:1]
+    )
+
+
+def _metadata_validators(rows):
+    if not rows:
+        raise Http404
+    (metadata,) = rows
+    last_modified = max(filter(None, (metadata['updated_at'], metadata['last_image_at'])))
+    return make_etag(metadata), int(last_modified.timestamp())
+
+
+def advertisement_metadata(pk):
+    """
+    Всё, от чего зависит карточка объявления, одним запросом без сериализации:
+    updated_at, статус и счётчик (массовая модерация и избранное не трогают
+    updated_at), поля автора и состояние набора изображений.
+    Возвращает (хеш метаданных, время последнего изменения).
+    """
+    return _metadata_validators(list(_metadata_queryset(pk)))
+
+
+async def aadvertisement_metadata(pk):
+    return _metadata_validators([row async for row in _metadata_queryset(pk)])
+
+
+def not_modified(request, etag, last_modified):
+    """304 по If-None-Match/If-Modified-Since или None, если клиенту нужен полный ответ."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # is_favorite зависит от пользователя: общий кеш не должен отдавать чужой ответ,
+    # а клиент перепроверяет ответ условным запросом
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
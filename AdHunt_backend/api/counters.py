@@ -0,0 +1,134 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Advertisement, AdvertisementStatus, CustomUser, FavoriteAdvertisement
+
+STATUS_COUNTERS = {
+    AdvertisementStatus.PENDING: 'pending_advertisements_count',
+    AdvertisementStatus.ACTIVE: 'active_advertisements_count',
+    AdvertisementStatus.REJECTED: 'rejected_advertisements_count',
+}
+
+
+def _shifted(field, delta):
+    # Счётчики беззнаковые: расхождение не должно ронять запрос, его исправит reconcile_counters
+    return Greatest(F(field) + delta, Value(0))
+
+
+def adjust_favorites_count(advertisement_id, delta):
+    return Advertisement.objects.filter(id=advertisement_id).update(
+        favorites_count=_shifted('favorites_count', delta)
+    )
+
+
+def lock_current(advertisement, *fields):
+    """
+    Блокирует строку объявления до конца транзакции и перечитывает в объект status,
+    favorites_count и fields.
+
+    Переход для adjust_status_counters считается от статуса под блокировкой:
+    объект, прочитанный до транзакции, мог устареть из-за параллельной
+    модерации или правки, и тогда один и тот же переход применился бы дважды.
+    favorites_count перечитывается для ответа; сохранять его из объекта нельзя,
+    счётчик меняется только через F(). Возвращает False, если объявление уже удалено.
+    """
+    fields = ('status', 'favorites_count', *fields)
+    row = Advertisement.objects.select_for_update().filter(pk=advertisement.pk).values(*fields).first()
+    if row is None:
+        return False
+    for field, value in row.items():
+        setattr(advertisement, field, value)
+    return True
+
+
+def adjust_status_counters(changes):
+    """
+    Переносит объявления между счётчиками авторов одним UPDATE.
+
+    changes - [(author_id, старый статус или None, новый статус или None), ...]:
+    None вместо старого статуса - объявление создано, вместо нового - удалено.
+    """
+    deltas = defaultdict(Counter)
+    for author_id, old_status, new_status in changes:
+        if old_status == new_status:
+            continue
+        if old_status is not None:
+            deltas[STATUS_COUNTERS[old_status]][author_id] -= 1
+        if new_status is not None:
+            deltas[STATUS_COUNTERS[new_status]][author_id] += 1
+
+    deltas = {
+        field: {author_id: delta for author_id, delta in by_author.items() if delta}
+        for field, by_author in deltas.items()
+    }
+    deltas = {field: by_author for field, by_author in deltas.items() if by_author}
+    authors = {author_id for by_author in deltas.values() for author_id in by_author}
+    if not authors:
+        return 0
+
+    updates = {}
+    for field, by_author in deltas.items():
+        if len(authors) == 1:
+            (delta,) = by_author.values()
+            updates[field] = _shifted(field, delta)
+        else:
+            # Разные авторы получают разные сдвиги в одном UPDATE через CASE по id
+            updates[field] = Case(
+                *[When(id=author_id, then=_shifted(field, delta)) for author_id, delta in by_author.items()],
+                default=F(field),
+                output_field=CustomUser._meta.get_field(field),
+            )
+    return CustomUser.objects.filter(id__in=authors).update(**updates)
+
+
+def reconcile_favorites_counts(start_id, end_id):
+    """Пересчитывает favorites_count у объявлений с id в [start_id, end_id). Возвращает число исправленных."""
+    actual = Coalesce(
+        Subquery(
+            FavoriteAdvertisement.objects.filter(advertisement=OuterRef('pk'))
+            .order_by()
+            .values('advertisement')
+            .annotate(count=Count('id'))
+            .values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+    with transaction.atomic():
+        return (
+            Advertisement.objects.filter(id__gte=start_id, id__lt=end_id)
+            .annotate(actual=actual)
+            .exclude(favorites_count=F('actual'))
+            .update(favorites_count=actual)
+        )
+
+
+def reconcile_status_counters(start_id, end_id):
+    """Пересчитывает счётчики объявлений у пользователей с id в [start_id, end_id). Возвращает число исправленных."""
+    actual = {
+        field: Coalesce(
+            Subquery(
+                Advertisement.objects.filter(author=OuterRef('pk'), status=status)
+                .order_by()
+                .values('author')
+                .annotate(count=Count('id'))
+                .values('count'),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+        for status, field in STATUS_COUNTERS.items()
+    }
+    drift = Q()
+    for field in STATUS_COUNTERS.values():
+        drift |= ~Q(**{field: F(f'actual_{field}')})
+    with transaction.atomic():
+        return (
+            CustomUser.objects.filter(id__gte=start_id, id__lt=end_id)
+            .annotate(**{f'actual_{field}': expression for field, expression in actual.items()})
+            .filter(drift)
+            .update(**actual)
+        )
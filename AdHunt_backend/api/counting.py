@@ -0,0 +1,64 @@
+import json
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+
+def estimate_count(queryset):
+    """Оценка числа строк планировщиком PostgreSQL (EXPLAIN) или None на других БД."""
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def bounded_count(queryset, timeout_ms):
+    """Точный COUNT(*) не дольше timeout_ms (только PostgreSQL). None, если не уложился."""
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SHOW statement_timeout')
+            (previous,) = cursor.fetchone()
+            # set_config(..., true) действует до конца транзакции, поэтому старое значение возвращается вручную
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", [f'{timeout_ms}ms'])
+            count = queryset.count()
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", [previous])
+            return count
+    except OperationalError:
+        # Запрос отменён по statement_timeout, откат точки сохранения вернул и настройку
+        return None
+
+
+def count_advertisements(queryset, exact=False):
+    """
+    Общее число строк для заголовка X-Total-Count: (число, точное ли оно).
+
+    До COUNT_EXACT_THRESHOLD строк счёт точный: COUNT идёт по подзапросу
+    с LIMIT и читает не больше порога строк. Выше порога в PostgreSQL
+    берётся оценка планировщика (EXPLAIN, по статистике pg_class/pg_stats),
+    такое число помечается неточным. exact=True просит точный счёт,
+    ограниченный по времени COUNT_EXACT_TIMEOUT_MS; если он не уложился,
+    ответ тот же, что и без exact.
+    """
+    queryset = queryset.order_by()
+    if exact:
+        count = bounded_count(queryset, settings.COUNT_EXACT_TIMEOUT_MS)
+        if count is not None:
+            return count, True
+
+    threshold = settings.COUNT_EXACT_THRESHOLD
+    count = queryset[:threshold + 1].count()
+    if count <= threshold:
+        return count, True
+    estimate = estimate_count(queryset)
+    if estimate is None:
+        # Оценщика нет (SQLite в разработке и тестах): обычный COUNT
+        return queryset.count(), True
+    # Планировщик может ошибиться вниз, но порог уже точно превышен
+    return max(estimate, threshold + 1), False
@@ -0,0 +1,40 @@
+from django.db.models import Count, Q
+
+from .models import AdvertisementStatus
+
+
+def price_buckets(edges):
+    # [None, e1), [e1, e2), ..., [en, None): нижняя граница включительно, верхняя нет
+    bounds = [None, *edges, None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def facet_counts(queryset, edges, with_status=False):
+    """
+    Гистограмма цен активных объявлений и, при with_status, число объявлений
+    в каждом статусе - одним агрегатным запросом: каждый счётчик это
+    COUNT(*) FILTER (WHERE ...) в PostgreSQL и COUNT(CASE WHEN ...) в остальных БД.
+    """
+    active = Q(status=AdvertisementStatus.ACTIVE)
+    aggregates = {'total': Count('id', filter=active)}
+    for i, (low, high) in enumerate(price_buckets(edges)):
+        condition = active
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'price_{i}'] = Count('id', filter=condition)
+    if with_status:
+        for value in AdvertisementStatus.values:
+            aggregates[f'status_{value}'] = Count('id', filter=Q(status=value))
+
+    counts = queryset.order_by().aggregate(**aggregates)
+    result = {
+        'total': counts['total'],
+        'price': [
+            (low, high, counts[f'price_{i}']) for i, (low, high) in enumerate(price_buckets(edges))
+        ],
+    }
+    if with_status:
+        result['status'] = {value: counts[f'status_{value}'] for value in AdvertisementStatus.values}
+    return result
@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .counters import adjust_favorites_count
+from .models import Advertisement, FavoriteAdvertisement
+
+
+def favorite_ids_cache_key(user_id):
+    return f'favorites:ids:{user_id}'
+
+
+def get_user_favorite_ids(user_id):
+    """Множество id избранных объявлений пользователя; из БД читается одним запросом по индексу (user, advertisement)."""
+    key = favorite_ids_cache_key(user_id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(
+            FavoriteAdvertisement.objects.filter(user_id=user_id).values_list('advertisement_id', flat=True)
+        )
+        cache.set(key, ids, settings.FAVORITES_CACHE_TIMEOUT)
+    return ids
+
+
+async def aget_user_favorite_ids(user_id):
+    key = favorite_ids_cache_key(user_id)
+    ids = await cache.aget(key)
+    if ids is None:
+        ids = frozenset([
+            advertisement_id async for advertisement_id in
+            FavoriteAdvertisement.objects.filter(user_id=user_id).values_list('advertisement_id', flat=True)
+        ])
+        await cache.aset(key, ids, settings.FAVORITES_CACHE_TIMEOUT)
+    return ids
+
+
+def invalidate_favorite_ids(user_ids):
+    keys = [favorite_ids_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    # Второе удаление после коммита убирает множество, которое параллельный запрос
+    # успел прочитать из БД до коммита и положить в кеш
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _tables():
+    quote = connection.ops.quote_name
+    return quote(FavoriteAdvertisement._meta.db_table), quote(Advertisement._meta.db_table)
+
+
+def add_favorite(user_id, advertisement_id):
+    """
+    Добавляет объявление в избранное без проверки exists() перед вставкой.
+
+    Возвращает True, если запись добавлена, False, если она уже была,
+    и None, если объявления нет. Повторный вызов безопасен: дубликат
+    отбрасывает ON CONFLICT DO NOTHING, а не IntegrityError.
+    """
+    favorites, advertisements = _tables()
+    created_at = FavoriteAdvertisement._meta.get_field('created_at').get_db_prep_value(timezone.now(), connection)
+    insert = f'''
+        INSERT INTO {favorites} (user_id, advertisement_id, created_at)
+        SELECT %s, id, %s FROM {advertisements} WHERE id = %s
+        ON CONFLICT (user_id, advertisement_id) DO NOTHING
+        RETURNING advertisement_id
+    '''
+    params = [user_id, created_at, advertisement_id]
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Вставка и счётчик одним запросом
+            cursor.execute(f'''
+                WITH inserted AS ({insert})
+                UPDATE {advertisements} SET favorites_count = favorites_count + 1
+                WHERE id IN (SELECT advertisement_id FROM inserted)
+                RETURNING id
+            ''', params)
+            added = cursor.fetchone() is not None
+        else:
+            cursor.execute(insert, params)
+            added = cursor.fetchone() is not None
+            if added:
+                adjust_favorites_count(advertisement_id, 1)
+    if added:
+        invalidate_favorite_ids([user_id])
+        return True
+    # Ничего не вставлено: либо запись уже есть, либо нет объявления
+    if Advertisement.objects.filter(id=advertisement_id).exists():
+        return False
+    return None
+
+
+def remove_favorite(user_id, advertisement_id):
+    """Удаляет объявление из избранного одним DELETE. Возвращает True, если запись была."""
+    favorites, advertisements = _tables()
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'''
+                    WITH deleted AS (
+                        DELETE FROM {favorites} WHERE user_id = %s AND advertisement_id = %s
+                        RETURNING advertisement_id
+                    )
+                    UPDATE {advertisements} SET favorites_count = GREATEST(favorites_count - 1, 0)
+                    WHERE id IN (SELECT advertisement_id FROM deleted)
+                    RETURNING id
+                ''', [user_id, advertisement_id])
+                deleted = cursor.fetchone() is not None
+        else:
+            deleted, _ = FavoriteAdvertisement.objects.filter(
+                user_id=user_id, advertisement_id=advertisement_id
+            ).delete()
+            if deleted:
+                adjust_favorites_count(advertisement_id, -1)
+        if deleted:
+            invalidate_favorite_ids([user_id])
+    return bool(deleted)
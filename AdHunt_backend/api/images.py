@@ -0,0 +1,263 @@
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .cache import bump_advertisements_version
+from .models import Advertisement, AdvertisementImage
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+# Форматы уменьшенных копий: расширение -> (формат Pillow, параметры сохранения)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+ORIGINAL_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+def get_executor(name, max_workers):
+    if name not in _executors:
+        with _executors_lock:
+            if name not in _executors:
+                _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+    return _executors[name]
+
+
+def get_upload_executor():
+    return get_executor('image-upload', settings.IMAGE_UPLOAD_WORKERS)
+
+
+def upload_images(files):
+    # Все потоки работают через один экземпляр хранилища; S3Boto3Storage сам держит соединение на поток
+    field = AdvertisementImage._meta.get_field('image')
+    storage = field.storage
+
+    def upload(file):
+        name = field.generate_filename(None, file.name)
+        return storage.save(name, file, max_length=field.max_length)
+
+    futures = [get_upload_executor().submit(upload, file) for file in files]
+    names, errors = [], []
+    for future in futures:
+        try:
+            names.append(future.result())
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        delete_images(names)
+        raise errors[0]
+    return names
+
+
+def delete_images(names):
+    storage = AdvertisementImage._meta.get_field('image').storage
+    for name in names:
+        storage.delete(name)
+
+
+@contextmanager
+def uploaded_images(files):
+    """
+    Загружает файлы параллельно до записи в БД. Если код внутри блока
+    (транзакция с объявлением и изображениями) упал, загруженные файлы удаляются.
+    """
+    names = upload_images(files)
+    try:
+        yield names
+    except BaseException:
+        delete_images(names)
+        raise
+
+
+def create_advertisement_images(advertisement, names):
+    return AdvertisementImage.objects.bulk_create(
+        [AdvertisementImage(advertisement=advertisement, image=name) for name in names]
+    )
+
+
+def _encode(image, image_format, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **params)
+    return buffer.getvalue()
+
+
+def _resized(image, max_side):
+    if max(image.size) <= max_side:
+        return image
+    copy = image.copy()
+    copy.thumbnail((max_side, max_side), Image.LANCZOS)
+    return copy
+
+
+def render_variants(data):
+    """
+    Готовит уменьшенные копии из байтов исходного изображения.
+
+    Возвращает (original, variants): original - (байты, расширение) очищенного
+    от EXIF и ограниченного по размеру оригинала или None, если он не менялся;
+    variants - {'thumb': {'webp': байты, 'jpeg': байты}, ...}.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source_format = source.format
+        has_exif = bool(source.getexif()) or 'exif' in source.info
+        # Поворот из EXIF применяется до того, как метаданные будут отброшены
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    if image.mode not in ('RGB', 'L'):
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+        image = background
+    elif image.mode == 'L':
+        image = image.convert('RGB')
+
+    original = None
+    max_side = settings.IMAGE_MAX_DIMENSION
+    if has_exif or max(image.size) > max_side or source_format not in ORIGINAL_FORMATS:
+        image_format = source_format if source_format in ORIGINAL_FORMATS else 'JPEG'
+        params = VARIANT_FORMATS['jpeg'][1] if image_format == 'JPEG' else {}
+        original = (_encode(_resized(image, max_side), image_format, **params), ORIGINAL_FORMATS[image_format])
+
+    variants = {}
+    for name, side in settings.IMAGE_VARIANTS.items():
+        resized = _resized(image, side)
+        variants[name] = {
+            extension: _encode(resized, image_format, **params)
+            for extension, (image_format, params) in VARIANT_FORMATS.items()
+        }
+    return original, variants
+
+
+def process_image(image_id, bump=True):
+    """
+    Создаёт уменьшенные копии изображения. bump=False оставляет сброс кеша ленты
+    вызывающему, чтобы загрузка из нескольких фотографий сбрасывала его один раз.
+    """
+    image = AdvertisementImage.objects.filter(id=image_id).first()
+    if image is None:
+        return None
+    storage = image.image.storage
+    old_name = image.image.name
+    with storage.open(old_name, 'rb') as file:
+        original, rendered = render_variants(file.read())
+
+    stem, _ = posixpath.splitext(old_name)
+    directory, basename = posixpath.split(stem)
+    variants = {}
+    for name, files in rendered.items():
+        variants[name] = {
+            extension: storage.save(
+                posixpath.join(directory, 'variants', f'{basename}_{name}.{extension}'), ContentFile(data)
+            )
+            for extension, data in files.items()
+        }
+
+    new_name = old_name
+    if original is not None:
+        data, extension = original
+        new_name = storage.save(f'{stem}.{extension}', ContentFile(data))
+
+    updated = AdvertisementImage.objects.filter(id=image_id, image=old_name).update(image=new_name, variants=variants)
+    if not updated:
+        # Изображение удалили или заменили, пока шла обработка
+        orphaned = [path for files in variants.values() for path in files.values()]
+        if new_name != old_name:
+            orphaned.append(new_name)
+        delete_images(orphaned)
+        return None
+    if new_name != old_name:
+        storage.delete(old_name)
+    # Ссылки на изображения в карточке изменились, Last-Modified объявления должен сдвинуться
+    Advertisement.objects.filter(id=image.advertisement_id).update(updated_at=timezone.now())
+    if bump:
+        bump_advertisements_version()
+    return variants
+
+
+class ProcessingBatch:
+    # Изображения одной загрузки: кеш ленты сбрасывает тот поток, который закончил последним
+    def __init__(self, count):
+        self.remaining = count
+        self.processed = False
+        self.lock = threading.Lock()
+
+    def done(self, processed):
+        """Отмечает изображение обработанным; True - пора сбросить кеш."""
+        with self.lock:
+            self.remaining -= 1
+            self.processed = self.processed or processed
+            return self.remaining == 0 and self.processed
+
+
+def _process_image_in_worker(image_id, batch):
+    variants = None
+    try:
+        variants = process_image(image_id, bump=False)
+    except Exception as e:
+        logger.warning('Не удалось обработать изображение %s: %s', image_id, e)
+    finally:
+        try:
+            if batch.done(variants is not None):
+                bump_advertisements_version()
+        finally:
+            close_old_connections()
+
+
+def process_pending_images(batch_size, min_age):
+    """
+    Обрабатывает изображения, у которых до сих пор нет уменьшенных копий.
+
+    Пул потоков воркера теряет работу при ошибке обработки и перезапуске,
+    а изображения до появления копий не обрабатывались вовсе; эта функция
+    догоняет их пачками по id. Изображения моложе min_age секунд ещё может
+    обработать пул. Возвращает (обработано, ошибок).
+    """
+    pending = AdvertisementImage.objects.filter(
+        variants={}, created_at__lte=timezone.now() - timedelta(seconds=min_age)
+    ).order_by('id')
+    processed = failed = last_id = 0
+    while True:
+        image_ids = list(pending.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+        if not image_ids:
+            return processed, failed
+        changed = False
+        for image_id in image_ids:
+            try:
+                changed = process_image(image_id, bump=False) is not None or changed
+                processed += 1
+            except Exception as e:
+                # Битый файл не должен останавливать проход, его покажет следующий запуск
+                logger.warning('Не удалось обработать изображение %s: %s', image_id, e)
+                failed += 1
+        # Кеш ленты сбрасывается раз на пачку, а не на каждое изображение
+        if changed:
+            bump_advertisements_version()
+        last_id = image_ids[-1]
+
+
+def schedule_image_processing(images):
+    # Обработка идёт вне запроса в пуле потоков и только после коммита, когда строки уже видны
+    image_ids = [image.id for image in images]
+    if not image_ids:
+        return
+
+    def submit():
+        executor = get_executor('image-processing', settings.IMAGE_PROCESSING_WORKERS)
+        batch = ProcessingBatch(len(image_ids))
+        for image_id in image_ids:
+            executor.submit(_process_image_in_worker, image_id, batch)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,74 @@
+import statistics
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from api.authentication import ClaimsJWTAuthentication
+from api.models import Advertisement, AdvertisementStatus, CustomUser
+from api.views import CustomTokenObtainPairSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает число запросов и задержку ленты с JWTAuthentication и ClaimsJWTAuthentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--advertisements', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Тестовые данные создаются в транзакции, которая откатывается в конце
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        user = CustomUser.objects.create_user(
+            email='benchmark-auth@example.com',
+            password='password',
+            first_name='Benchmark',
+            last_name='Benchmark',
+            phone_number='benchmark-auth',
+        )
+        Advertisement.objects.bulk_create(
+            Advertisement(
+                title=f'Benchmark {i}',
+                description='Benchmark',
+                price=100 + i,
+                status=AdvertisementStatus.ACTIVE,
+                author=user,
+            )
+            for i in range(options['advertisements'])
+        )
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        url = f'/api/advertisements/?page_size={options["advertisements"]}'
+
+        for authentication in (JWTAuthentication, ClaimsJWTAuthentication):
+            with mock.patch.object(APIView, 'authentication_classes', [authentication]):
+                # Прогрев: кеш ленты и is_active
+                client.get(url)
+                timings = []
+                with CaptureQueriesContext(connection) as queries:
+                    for _ in range(options['requests']):
+                        started = time.perf_counter()
+                        response = client.get(url)
+                        timings.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.status_code
+            self.stdout.write(
+                f'{authentication.__name__}: {len(queries) / options["requests"]:.1f} запросов к БД на запрос, '
+                f'p50 {statistics.median(timings) * 1000:.2f} мс'
+            )
@@ -0,0 +1,96 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from api.models import Advertisement, AdvertisementStatus, CustomUser, Role
+from api.moderation import claim_advertisements
+
+BENCHMARK_TITLE = 'benchmark-claims'
+
+
+class Command(BaseCommand):
+    help = 'Измеряет задержку взятия объявлений на модерацию при разном размере очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backlogs', default='1000,10000,100000,300000', help='Размеры очереди через запятую')
+        parser.add_argument('--claims', type=int, default=200, help='Запросов на каждого модератора')
+        parser.add_argument('--count', type=int, default=10, help='Объявлений за один запрос')
+        parser.add_argument('--moderators', type=int, default=1, help='Параллельных модераторов (нужен PostgreSQL при > 1)')
+
+    def fill_backlog(self, author, count):
+        # Одним INSERT ... SELECT, чтобы очередь в сотни тысяч строк создавалась за секунды
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                INSERT INTO {Advertisement._meta.db_table}
+                    (title, description, price, status, created_at, updated_at, author_id, favorites_count)
+                WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < %s)
+                SELECT %s, %s, i, %s, %s, %s, %s, 0 FROM seq
+                ''',
+                [count, BENCHMARK_TITLE, BENCHMARK_TITLE, AdvertisementStatus.PENDING, now, now, author.id],
+            )
+
+    def handle(self, *args, **options):
+        if options['moderators'] > 1 and connection.vendor != 'postgresql':
+            self.stderr.write('Параллельные модераторы поддерживаются только в PostgreSQL, используется один')
+            options['moderators'] = 1
+
+        moderators = [
+            CustomUser.objects.create_user(
+                email=f'{BENCHMARK_TITLE}-{i}@example.com',
+                password='password',
+                first_name='Benchmark',
+                last_name='Benchmark',
+                phone_number=f'{BENCHMARK_TITLE}-{i}',
+                role=Role.MODERATOR,
+            )
+            for i in range(options['moderators'])
+        ]
+        try:
+            for size in sorted(int(size) for size in options['backlogs'].split(',')):
+                pending = Advertisement.objects.filter(title=BENCHMARK_TITLE, status=AdvertisementStatus.PENDING)
+                missing = size - pending.count()
+                if missing > 0:
+                    self.fill_backlog(moderators[0], missing)
+                self.run(size, moderators, options)
+        finally:
+            Advertisement.objects.filter(title=BENCHMARK_TITLE).delete()
+            CustomUser.objects.filter(id__in=[moderator.id for moderator in moderators]).delete()
+
+    def run(self, backlog, moderators, options):
+        timings = []
+        lock = threading.Lock()
+
+        def moderate(moderator):
+            try:
+                for _ in range(options['claims']):
+                    started = time.perf_counter()
+                    ids, _ = claim_advertisements(moderator.id, options['count'])
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        timings.append(elapsed)
+                    # Модератор разбирает взятое, и очередь остаётся того же размера
+                    Advertisement.objects.filter(id__in=ids).update(
+                        status=AdvertisementStatus.REJECTED, lease_owner=None, lease_expires_at=None
+                    )
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=moderate, args=(moderator,)) for moderator in moderators]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Разобранные объявления возвращаются в очередь для следующего размера
+        Advertisement.objects.filter(title=BENCHMARK_TITLE).update(status=AdvertisementStatus.PENDING)
+        timings.sort()
+        self.stdout.write(
+            f'Очередь {backlog}: p50 {statistics.median(timings) * 1000:.2f} мс, '
+            f'p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} мс, запросов {len(timings)}'
+        )
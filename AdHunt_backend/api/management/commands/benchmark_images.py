@@ -0,0 +1,45 @@
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from api.images import render_variants
+
+
+def make_photo(width, height, seed):
+    # Градиент с шумом сжимается примерно как фотография, в отличие от однотонной заливки
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    image = Image.blend(image, Image.linear_gradient('L').resize((width, height)).convert('RGB'), 0.5 + seed % 5 / 10)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Измеряет скорость подготовки уменьшенных копий (изображений в секунду на ядро)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=40)
+        parser.add_argument('--size', default='4000x3000', help='Размер исходных изображений, ШИРИНАxВЫСОТА')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Число процессов')
+
+    def handle(self, *args, **options):
+        width, height = (int(value) for value in options['size'].split('x'))
+        photos = [make_photo(width, height, seed) for seed in range(options['images'])]
+
+        for workers in sorted({1, options['workers']}):
+            started = time.perf_counter()
+            if workers == 1:
+                for photo in photos:
+                    render_variants(photo)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(render_variants, photos))
+            elapsed = time.perf_counter() - started
+            rate = len(photos) / elapsed
+            self.stdout.write(
+                f'Процессов: {workers}, {options["size"]}: {rate:.1f} изобр./с, {rate / workers:.1f} изобр./с на ядро'
+            )
@@ -0,0 +1,139 @@
+import asyncio
+import resource
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+EXAMPLE = '''
+Серверы запускаются отдельно, из каталога AdHunt_backend, например:
+  gunicorn AdHunt_backend.wsgi:application --bind 127.0.0.1:8000 --workers 4 --threads 2 --worker-class gthread
+  gunicorn AdHunt_backend.asgi:application --bind 127.0.0.1:8001 --workers 4 -k uvicorn.workers.UvicornWorker
+и сравниваются так:
+  manage.py benchmark_load --target wsgi=http://127.0.0.1:8000/api/advertisements/?page_size=20 \\
+                           --target asgi=http://127.0.0.1:8001/api/async/advertisements/?page_size=20
+'''
+
+
+class HTTPConnection:
+    """Минимальный HTTP/1.1-клиент с keep-alive: тысяча соединений на asyncio без сторонних библиотек."""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.request = (
+            f'GET {parts.path or "/"}{"?" + parts.query if parts.query else ""} HTTP/1.1\r\n'
+            f'Host: {parts.netloc}\r\nAccept: application/json\r\n\r\n'
+        ).encode()
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def get(self):
+        return await asyncio.wait_for(self.request_response(), self.timeout)
+
+    async def request_response(self):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(self.request)
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await self.reader.read()
+            await self.close()
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочное сравнение развёртываний (WSGI и ASGI) при 100-1000 одновременных соединений' + EXAMPLE
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', action='append', default=[], metavar='NAME=URL', help='Имя и URL эндпоинта, можно несколько'
+        )
+        parser.add_argument('--concurrency', default='100,250,500,1000', help='Число соединений через запятую')
+        parser.add_argument('--duration', type=float, default=10, help='Длительность замера на каждый уровень, секунды')
+        parser.add_argument('--timeout', type=float, default=30, help='Таймаут ответа, секунды')
+
+    def handle(self, *args, **options):
+        targets = [target.partition('=')[::2] for target in options['target']]
+        if not targets or not all(name and url for name, url in targets):
+            raise CommandError('Нужен хотя бы один --target NAME=URL' + EXAMPLE)
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        # Каждое соединение - дескриптор файла
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = max(levels) + 64
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+        for name, url in targets:
+            for level in levels:
+                result = asyncio.run(self.run(url, level, options['duration'], options['timeout']))
+                self.report(name, level, result)
+
+    async def run(self, url, concurrency, duration, timeout):
+        latencies, errors = [], 0
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            connection = HTTPConnection(url, timeout)
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        status = await connection.get()
+                    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                        # Соединение отклонено, сброшено или не ответило вовремя
+                        errors += 1
+                        await connection.close()
+                        # Без паузы отказ в соединении превращается в холостой цикл
+                        await asyncio.sleep(0.05)
+                        continue
+                    if status >= 400:
+                        errors += 1
+                    else:
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                await connection.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    def report(self, name, concurrency, result):
+        latencies, errors, elapsed = result
+        if not latencies:
+            self.stdout.write(f'{name}, {concurrency} соединений: ни одного успешного ответа, ошибок {errors}')
+            return
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f'{name}, {concurrency} соединений: {len(latencies) / elapsed:.0f} запр/с, '
+            f'p50 {statistics.median(latencies) * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс, '
+            f'ошибок {errors}'
+        )
@@ -0,0 +1,88 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from api.models import OutboxEvent
+from api.publisher import BENCHMARK_EVENT_TYPE, relay_outbox_batch
+
+
+class NullSQSClient:
+    # Принимает всё без сети: измеряется только стоимость работы с outbox
+    def send_message_batch(self, QueueUrl, Entries):
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+
+class Command(BaseCommand):
+    help = 'Измеряет пропускную способность relay_outbox (событий в секунду)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10000)
+        parser.add_argument('--advertisements', type=int, default=1000, help='Число объявлений, по которым распределены события')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--relays', type=int, default=1, help='Параллельных релеев (нужен PostgreSQL при > 1)')
+
+    def handle(self, *args, **options):
+        # Рядом с настоящей очередью события пишутся в общий outbox - не рискуем
+        if settings.USE_YMQ:
+            raise CommandError('Бенчмарк не запускается при USE_YMQ=True')
+        if options['relays'] > 1 and connection.vendor != 'postgresql':
+            self.stderr.write('Параллельные релеи поддерживаются только в PostgreSQL, используется один')
+            options['relays'] = 1
+
+        try:
+            # Отрицательные id не совпадают с настоящими объявлениями и не задерживают их события
+            OutboxEvent.objects.bulk_create(
+                [
+                    OutboxEvent(
+                        event_type=BENCHMARK_EVENT_TYPE,
+                        advertisement_id=-(i % options['advertisements']) - 1,
+                        payload={'id': i % options['advertisements'], 'title': 'benchmark'},
+                    )
+                    for i in range(options['events'])
+                ],
+                batch_size=1000,
+            )
+            total, elapsed = self.run(options)
+        finally:
+            OutboxEvent.objects.filter(event_type=BENCHMARK_EVENT_TYPE).delete()
+
+        self.stdout.write(
+            f'Релеев: {options["relays"]}, событий: {total}, время: {elapsed:.2f} с, '
+            f'{total / elapsed:.0f} событий/с'
+        )
+
+    def run(self, options):
+        client = NullSQSClient()
+        counts = []
+
+        def relay():
+            sent_total = 0
+            try:
+                while True:
+                    sent, failed = relay_outbox_batch(client, options['batch_size'], grace=0, benchmark=True)
+                    if not sent and not failed:
+                        break
+                    sent_total += sent
+            finally:
+                counts.append(sent_total)
+
+        def relay_in_thread():
+            try:
+                relay()
+            finally:
+                close_old_connections()
+
+        started = time.perf_counter()
+        if options['relays'] == 1:
+            # Один релей - в текущем потоке: его ошибка не теряется в потоке и прерывает команду
+            relay()
+        else:
+            threads = [threading.Thread(target=relay_in_thread) for _ in range(options['relays'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return sum(counts), time.perf_counter() - started
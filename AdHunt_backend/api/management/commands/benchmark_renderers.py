@@ -0,0 +1,86 @@
+import datetime
+import decimal
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.fast_serializers import AdvertisementRowSerializer
+from api.renderers import FastJSONRenderer, orjson
+
+
+def make_rows(count):
+    # Строки в формате advertisement_rows(): рендерер измеряется без базы данных
+    created_at = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+    return [
+        {
+            'id': i,
+            'title': f'Объявление {i}',
+            'description': 'Описание объявления ' * 10,
+            'price': decimal.Decimal(100 + i).quantize(decimal.Decimal('0.01')),
+            'status': 'active',
+            'created_at': created_at,
+            'updated_at': created_at,
+            'favorites_count': i % 7,
+            'author__id': 1,
+            'author__email': 'user@example.com',
+            'author__last_name': 'Иванов',
+            'author__first_name': 'Иван',
+            'author__middle_name': None,
+            'author__phone_number': '+79990000000',
+            'author__role': 'user',
+        }
+        for i in range(count)
+    ]
+
+
+def make_images(rows, per_advertisement):
+    variants = {
+        name: {extension: f'advertisements/variants/photo_{name}.{extension}' for extension in ('webp', 'jpeg')}
+        for name in ('thumb', 'card', 'full')
+    }
+    return {
+        row['id']: [(row['id'] * 10 + j, f'advertisements/photo_{j}.jpg', variants) for j in range(per_advertisement)]
+        for row in rows
+    }
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость JSONRenderer и FastJSONRenderer на ленте объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000', help='Размеры выдачи через запятую')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов на каждый размер, берётся лучший')
+
+    def measure(self, renderer, data, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            content = renderer.render(data)
+            timings.append(time.perf_counter() - started)
+        return min(timings), content
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write('orjson не установлен, FastJSONRenderer работает как JSONRenderer')
+
+        request = APIRequestFactory().get('/api/advertisements/')
+        for size in (int(size) for size in options['sizes'].split(',')):
+            rows = make_rows(size)
+            serializer = AdvertisementRowSerializer(request, set())
+            images = make_images(rows, 2)
+            payloads = {
+                'лента': [serializer.to_representation(row, images) for row in rows],
+                # Decimal и datetime без сериализатора кодируются через default
+                'строки values()': rows,
+            }
+            for name, data in payloads.items():
+                stdlib_time, expected = self.measure(JSONRenderer(), data, options['repeat'])
+                fast_time, actual = self.measure(FastJSONRenderer(), data, options['repeat'])
+                if actual != expected:
+                    self.stderr.write(f'{size}, {name}: ответы рендереров различаются')
+                self.stdout.write(
+                    f'{size} строк, {name}: json {stdlib_time * 1000:.1f} мс, '
+                    f'orjson {fast_time * 1000:.1f} мс (x{stdlib_time / fast_time:.1f}), {len(actual)} байт'
+                )
@@ -0,0 +1,91 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.fast_serializers import AdvertisementRowSerializer, advertisement_rows
+from api.models import Advertisement, AdvertisementImage, AdvertisementStatus, CustomUser
+from api.views import AdvertisementSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость AdvertisementSerializer и быстрого сериализатора (строк в секунду)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000', help='Размеры выдачи через запятую')
+        parser.add_argument('--images', type=int, default=2, help='Изображений на объявление')
+
+    def handle(self, *args, **options):
+        # Тестовые данные создаются в транзакции, которая откатывается в конце
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        author = CustomUser.objects.create_user(
+            email='benchmark-serializers@example.com',
+            password='password',
+            first_name='Benchmark',
+            last_name='Benchmark',
+            phone_number='benchmark-serializers',
+        )
+        advertisements = Advertisement.objects.bulk_create(
+            [
+                Advertisement(
+                    title=f'Benchmark {i}',
+                    description='Benchmark ' * 20,
+                    price=100 + i,
+                    status=AdvertisementStatus.ACTIVE,
+                    author=author,
+                )
+                for i in range(max(sizes))
+            ],
+            batch_size=1000,
+        )
+        variants = {
+            name: {extension: f'advertisements/variants/benchmark_{name}.{extension}' for extension in ('webp', 'jpeg')}
+            for name in ('thumb', 'card', 'full')
+        }
+        AdvertisementImage.objects.bulk_create(
+            [
+                AdvertisementImage(advertisement=advertisement, image=f'advertisements/benchmark_{j}.jpg', variants=variants)
+                for advertisement in advertisements
+                for j in range(options['images'])
+            ],
+            batch_size=1000,
+        )
+
+        request = APIRequestFactory().get('/api/advertisements/')
+        renderer = JSONRenderer()
+        queryset = Advertisement.objects.filter(author=author).order_by('-created_at', '-id')
+        for size in sizes:
+            # Объявления загружаются заранее; время быстрого пути включает его запрос изображений
+            instances = list(queryset.with_related()[:size])
+            rows = list(advertisement_rows(queryset)[:size])
+
+            started = time.perf_counter()
+            expected = AdvertisementSerializer(
+                instances, many=True, context={'request': request, 'favorite_ids': set()}
+            ).data
+            drf_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            actual = AdvertisementRowSerializer(request, set()).serialize(rows)
+            fast_elapsed = time.perf_counter() - started
+
+            if renderer.render(actual) != renderer.render(expected):
+                self.stderr.write(f'{size}: ответы сериализаторов различаются')
+            self.stdout.write(
+                f'{size} строк: DRF {size / drf_elapsed:.0f} строк/с, '
+                f'быстрый {size / fast_elapsed:.0f} строк/с (x{drf_elapsed / fast_elapsed:.1f})'
+            )
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.images import process_pending_images
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии для изображений, которые не обработал пул потоков воркера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Изображений за один запрос к БД')
+        parser.add_argument('--min-age', type=float, default=300, help='Не трогать изображения моложе N секунд')
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно')
+        parser.add_argument('--interval', type=float, default=300, help='Пауза между проходами в режиме --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            processed, failed = process_pending_images(options['batch_size'], options['min_age'])
+            if processed or failed:
+                self.stdout.write(f'Обработано: {processed}, ошибок: {failed}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from api.counters import reconcile_favorites_counts, reconcile_status_counters
+from api.models import Advertisement, CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики избранного у объявлений и счётчики объявлений у пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Строк за одну транзакцию')
+
+    def reconcile(self, model, reconcile, batch_size):
+        # Пачками по диапазону id, чтобы не держать блокировку на всю таблицу
+        last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        fixed = 0
+        for start_id in range(1, last_id + 1, batch_size):
+            fixed += reconcile(start_id, start_id + batch_size)
+        return fixed
+
+    def handle(self, *args, **options):
+        favorites = self.reconcile(Advertisement, reconcile_favorites_counts, options['batch_size'])
+        users = self.reconcile(CustomUser, reconcile_status_counters, options['batch_size'])
+        self.stdout.write(f'Исправлено объявлений: {favorites}, пользователей: {users}')
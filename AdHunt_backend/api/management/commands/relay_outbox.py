@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.publisher import get_sqs_client, relay_outbox_batch, requeue_failed_events
+
+
+class Command(BaseCommand):
+    help = 'Отправляет в очередь события из outbox, которые не отправил фоновый поток воркера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Событий за одну транзакцию')
+        parser.add_argument('--grace', type=float, default=30, help='Не трогать события моложе N секунд')
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно')
+        parser.add_argument('--interval', type=float, default=1, help='Пауза между проходами в режиме --loop')
+        parser.add_argument(
+            '--requeue-failed', action='store_true', help='Вернуть в отправку события, отложенные после OUTBOX_MAX_ATTEMPTS'
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue_failed']:
+            self.stdout.write(f'Возвращено в отправку: {requeue_failed_events()}')
+        client = get_sqs_client()
+        while True:
+            total_sent = total_failed = 0
+            while True:
+                sent, failed = relay_outbox_batch(client, options['batch_size'], options['grace'])
+                total_sent += sent
+                total_failed += failed
+                # Пачка с ошибками не повторяется сразу, чтобы не крутиться на недоступной очереди
+                if sent + failed < options['batch_size'] or failed:
+                    break
+            if total_sent or total_failed:
+                self.stdout.write(f'Отправлено: {total_sent}, ошибок: {total_failed}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.moderation import release_expired_leases
+
+
+class Command(BaseCommand):
+    help = 'Возвращает в очередь модерации объявления с истёкшей арендой'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно')
+        parser.add_argument('--interval', type=float, default=60, help='Пауза между проходами в режиме --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_leases()
+            if released:
+                self.stdout.write(f'Возвращено в очередь: {released}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
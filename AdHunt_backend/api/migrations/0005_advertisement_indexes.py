@@ -0,0 +1,29 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_customuser_date_joined'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='ad_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(fields=['status', 'price', 'id'], name='ad_status_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='ad_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-created_at', '-id'], name='ad_pending_created_idx'),
+        ),
+    ]
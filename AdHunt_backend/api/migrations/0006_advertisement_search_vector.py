@@ -0,0 +1,79 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:58
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Заголовок весит больше описания, каждое поле индексируется русской и английской конфигурацией
+def search_vector_sql(prefix=''):
+    parts = []
+    for column, weight in (('title', 'A'), ('description', 'B')):
+        for config in ('russian', 'english'):
+            parts.append(
+                f"setweight(to_tsvector('{config}', coalesce({prefix}{column}, '')), '{weight}')"
+            )
+    return ' || '.join(parts)
+
+
+FORWARD_SQL = [
+    f"""
+    CREATE OR REPLACE FUNCTION api_advertisement_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {search_vector_sql('NEW.')};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER api_advertisement_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON api_advertisement
+    FOR EACH ROW EXECUTE FUNCTION api_advertisement_search_vector_update()
+    """,
+    f'UPDATE api_advertisement SET search_vector = {search_vector_sql()}',
+    'CREATE INDEX ad_search_vector_idx ON api_advertisement USING gin (search_vector)',
+    'CREATE INDEX ad_title_trgm_idx ON api_advertisement USING gin (title gin_trgm_ops)',
+]
+
+BACKWARD_SQL = [
+    'DROP INDEX IF EXISTS ad_title_trgm_idx',
+    'DROP INDEX IF EXISTS ad_search_vector_idx',
+    'DROP TRIGGER IF EXISTS api_advertisement_search_vector_trigger ON api_advertisement',
+    'DROP FUNCTION IF EXISTS api_advertisement_search_vector_update()',
+]
+
+
+def ensure_pg_trgm(schema_editor):
+    # В Managed PostgreSQL расширение включается в настройках базы (infrastructure/main.tf),
+    # пользователь приложения не может выполнить CREATE EXTENSION; создаём его только локально
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            cursor.execute('CREATE EXTENSION pg_trgm')
+
+
+def run_postgres_sql(statements, forward=False):
+    def run(apps, schema_editor):
+        # На SQLite поиск работает через icontains, триггер и GIN-индексы не нужны
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        if forward:
+            ensure_pg_trgm(schema_editor)
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_advertisement_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advertisement',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_postgres_sql(FORWARD_SQL, forward=True), run_postgres_sql(BACKWARD_SQL)),
+    ]
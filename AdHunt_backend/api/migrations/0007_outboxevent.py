@@ -0,0 +1,31 @@
+# Generated by Django 4.2.21 on 2026-10-17 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_advertisement_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=50, verbose_name='Тип события')),
+                ('advertisement_id', models.BigIntegerField(verbose_name='Объявление')),
+                ('payload', models.JSONField(verbose_name='Сообщение')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попытки отправки')),
+            ],
+            options={
+                'verbose_name': 'Событие для очереди',
+                'verbose_name_plural': 'События для очереди',
+                'ordering': ['id'],
+                'indexes': [models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['id'], name='outbox_unsent_idx')],
+            },
+        ),
+    ]
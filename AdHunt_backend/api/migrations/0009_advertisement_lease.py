@@ -0,0 +1,29 @@
+# Generated by Django 4.2.21 on 2026-10-17 23:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_advertisementimage_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advertisement',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Аренда до'),
+        ),
+        migrations.AddField(
+            model_name='advertisement',
+            name='lease_owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leased_advertisements', to=settings.AUTH_USER_MODEL, verbose_name='Модератор'),
+        ),
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(condition=models.Q(('lease_expires_at__isnull', False)), fields=['lease_expires_at'], name='ad_lease_expires_idx'),
+        ),
+    ]
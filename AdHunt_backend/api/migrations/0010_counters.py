@@ -0,0 +1,63 @@
+# Generated by Django 4.2.21 on 2026-10-17 23:25
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(queryset, group_by):
+    return Coalesce(
+        Subquery(
+            queryset.order_by().values(group_by).annotate(count=Count('id')).values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+# Начальные значения счётчиков для уже существующих данных
+def fill_counters(apps, schema_editor):
+    Advertisement = apps.get_model('api', 'Advertisement')
+    CustomUser = apps.get_model('api', 'CustomUser')
+    FavoriteAdvertisement = apps.get_model('api', 'FavoriteAdvertisement')
+
+    Advertisement.objects.update(
+        favorites_count=count_of(FavoriteAdvertisement.objects.filter(advertisement=OuterRef('pk')), 'advertisement')
+    )
+    CustomUser.objects.update(**{
+        f'{status}_advertisements_count': count_of(
+            Advertisement.objects.filter(author=OuterRef('pk'), status=status), 'author'
+        )
+        for status in ('pending', 'active', 'rejected')
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_advertisement_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advertisement',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='active_advertisements_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Активных объявлений'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='pending_advertisements_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Объявлений на модерации'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='rejected_advertisements_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Отклонённых объявлений'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
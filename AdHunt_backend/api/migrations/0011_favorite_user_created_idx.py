@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-17 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='favoriteadvertisement',
+            index=models.Index(fields=['user', '-created_at', '-advertisement'], name='fav_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-17 23:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_favorite_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(fields=['author', 'status', 'price', 'id'], name='ad_author_price_idx'),
+        ),
+    ]
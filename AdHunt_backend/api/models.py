@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 
@@ -34,6 +35,10 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         verbose_name='Роль'
     )
     date_joined = models.DateTimeField(auto_now_add=True, verbose_name='Дата регистрации')
+    # Счётчики объявлений по статусам, обновляются в api/counters.py
+    pending_advertisements_count = models.PositiveIntegerField(default=0, verbose_name='Объявлений на модерации')
+    active_advertisements_count = models.PositiveIntegerField(default=0, verbose_name='Активных объявлений')
+    rejected_advertisements_count = models.PositiveIntegerField(default=0, verbose_name='Отклонённых объявлений')
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -52,6 +57,11 @@ class AdvertisementStatus(models.TextChoices):
     ACTIVE = 'active', 'Активное'
     REJECTED = 'rejected', 'Отклонено'
 
+class AdvertisementQuerySet(models.QuerySet):
+    def with_related(self):
+        # Автор и изображения подгружаются заранее, чтобы список не делал запросы на каждую строку
+        return self.select_related('author').prefetch_related('images')
+
 class Advertisement(models.Model):
     title = models.CharField(max_length=200, verbose_name='Название')
     description = models.TextField(verbose_name='Описание')
@@ -70,11 +80,46 @@ class Advertisement(models.Model):
         related_name='advertisements',
         verbose_name='Автор'
     )
+    # Сколько раз объявление добавили в избранное, обновляется в api/counters.py
+    favorites_count = models.PositiveIntegerField(default=0, verbose_name='В избранном')
+    # Заполняется триггером в PostgreSQL, см. миграцию 0006
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Аренда на модерацию: объявление взято модератором до lease_expires_at
+    lease_owner = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='leased_advertisements',
+        verbose_name='Модератор'
+    )
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name='Аренда до')
+
+    objects = AdvertisementQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Объявление'
         verbose_name_plural = 'Объявления'
         ordering = ['-created_at']
+        # id в конце индексов совпадает с порядком курсорной пагинации
+        indexes = [
+            models.Index(fields=['status', '-created_at', '-id'], name='ad_status_created_idx'),
+            models.Index(fields=['status', 'price', 'id'], name='ad_status_price_idx'),
+            models.Index(fields=['author', '-created_at', '-id'], name='ad_author_created_idx'),
+            # Лента с фильтром по автору и сортировкой по цене
+            models.Index(fields=['author', 'status', 'price', 'id'], name='ad_author_price_idx'),
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='ad_pending_created_idx',
+                condition=models.Q(status=AdvertisementStatus.PENDING),
+            ),
+            # Только строки с арендой, чтобы очистка просроченных не читала всю таблицу
+            models.Index(
+                fields=['lease_expires_at'],
+                name='ad_lease_expires_idx',
+                condition=models.Q(lease_expires_at__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return self.title
@@ -87,6 +132,8 @@ class AdvertisementImage(models.Model):
         verbose_name='Объявление'
     )
     image = models.ImageField(upload_to='advertisements/', verbose_name='Изображение')
+    # {'thumb': {'webp': путь, 'jpeg': путь}, ...}, заполняется после обработки изображения
+    variants = models.JSONField(default=dict, blank=True, verbose_name='Уменьшенные копии')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
 
     class Meta:
@@ -112,6 +159,36 @@ class FavoriteAdvertisement(models.Model):
         verbose_name = 'Избранное объявление'
         verbose_name_plural = 'Избранные объявления'
         unique_together = ['user', 'advertisement']
+        indexes = [
+            # Список избранного: новые сверху, advertisement разрешает равенство дат для курсора
+            models.Index(fields=['user', '-created_at', '-advertisement'], name='fav_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.advertisement.title}"
+
+class OutboxEvent(models.Model):
+    event_type = models.CharField(max_length=50, verbose_name='Тип события')
+    # Не внешний ключ: событие должно пережить удаление объявления
+    advertisement_id = models.BigIntegerField(verbose_name='Объявление')
+    payload = models.JSONField(verbose_name='Сообщение')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата отправки')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попытки отправки')
+    # Событие взято релеем и отправляется вне транзакции; после срока его может взять другой релей
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='Отправляется до')
+    # Исчерпаны OUTBOX_MAX_ATTEMPTS: событие больше не отправляется и не задерживает следующие
+    failed_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата отказа')
+
+    class Meta:
+        verbose_name = 'Событие для очереди'
+        verbose_name_plural = 'События для очереди'
+        ordering = ['id']
+        indexes = [
+            models.Index(
+                fields=['id'], name='outbox_unsent_idx', condition=models.Q(sent_at__isnull=True, failed_at__isnull=True)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.advertisement_id}"
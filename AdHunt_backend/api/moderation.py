@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Advertisement, AdvertisementStatus
+
+
+def claimable(now):
+    return Q(status=AdvertisementStatus.PENDING) & (Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+
+
+def is_leased_by_other(advertisement, user_id, now=None):
+    if advertisement.lease_owner_id in (None, user_id):
+        return False
+    return advertisement.lease_expires_at > (now or timezone.now())
+
+
+def claim_advertisements(user_id, count):
+    """
+    Берёт в аренду count самых старых свободных объявлений на модерации.
+    Возвращает (id, время окончания аренды).
+
+    SELECT ... FOR UPDATE SKIP LOCKED пропускает строки, которые прямо сейчас
+    берёт другой модератор, поэтому параллельные запросы не ждут друг друга
+    и не получают одни и те же объявления. Выборка идёт по частичному индексу
+    ad_pending_created_idx и не зависит от размера очереди.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.MODERATION_LEASE_SECONDS)
+    with transaction.atomic():
+        ids = list(
+            Advertisement.objects.select_for_update(skip_locked=True)
+            .filter(claimable(now))
+            .order_by('created_at', 'id')
+            .values_list('id', flat=True)[:count]
+        )
+        if ids:
+            Advertisement.objects.filter(id__in=ids).update(lease_owner_id=user_id, lease_expires_at=expires_at)
+    return ids, expires_at
+
+
+def release_leases(user_id, ids):
+    return Advertisement.objects.filter(id__in=ids, lease_owner_id=user_id).update(
+        lease_owner=None, lease_expires_at=None
+    )
+
+
+def release_expired_leases():
+    # Просроченную аренду claim и так не учитывает, очистка убирает её из выдачи и из индекса
+    return Advertisement.objects.filter(lease_expires_at__lte=timezone.now()).update(
+        lease_owner=None, lease_expires_at=None
+    )
@@ -0,0 +1,154 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination:
+    """
+    Курсорная пагинация по паре (поле сортировки, id).
+
+    pk_field - уникальное поле для разрешения равенств, по умолчанию id;
+    другое поле (например, аннотация из связанной таблицы) нужно, когда
+    сортировка целиком идёт по индексу другой таблицы.
+
+    Следующая страница выбирается условием по последней записи предыдущей,
+    поэтому стоимость запроса не зависит от глубины листания. Курсор
+    непрозрачен для клиента: это base64 от значения поля и id.
+
+    Если клиент не передал ни cursor, ни page_size, пагинация выключена
+    и представление отдаёт полный список, как раньше (режим совместимости).
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self, field='created_at', descending=True, pk_field='id'):
+        self.field = field
+        self.pk_field = pk_field
+        self.descending = descending
+        self.page_size = settings.ADVERTISEMENTS_PAGE_SIZE
+        self.max_page_size = settings.ADVERTISEMENTS_MAX_PAGE_SIZE
+        self.next_position = None
+
+    @property
+    def ordering(self):
+        prefix = '-' if self.descending else ''
+        return (f'{prefix}{self.field}', f'{prefix}{self.pk_field}')
+
+    def is_enabled(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, position):
+        # str() сохраняет микросекунды дат и точность Decimal
+        data = json.dumps([str(value) for value in position], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def get_field(self, queryset, name):
+        # Поле модели или аннотация (rank поиска, favorited_at избранного)
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, request, queryset):
+        """
+        Позиция курсора, приведённая к типам полей сортировки.
+
+        Курсор приходит от клиента: значение, не подходящее полю (строка
+        вместо цены, курсор другой сортировки, null), - это неверный курсор,
+        а не ошибка сервера.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            value = self.get_field(queryset, self.field).to_python(value)
+            pk = self.get_field(queryset, self.pk_field).to_python(pk)
+        except (TypeError, ValueError, binascii.Error, UnicodeDecodeError, FieldDoesNotExist, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None or pk is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def get_value(self, item):
+        if isinstance(item, dict):
+            return item[self.field]
+        return getattr(item, self.field)
+
+    def get_pk(self, item):
+        if isinstance(item, dict):
+            return item[self.pk_field]
+        return getattr(item, self.pk_field)
+
+    def get_page_queryset(self, queryset, request):
+        """Срез queryset для страницы или None, если пагинация выключена."""
+        if not self.is_enabled(request):
+            return None
+
+        self.request = request
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request, queryset)
+        if position is not None:
+            value, pk = position
+            lookup = 'lt' if self.descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'{self.pk_field}__{lookup}': pk})
+            )
+
+        # Лишняя запись показывает, есть ли следующая страница, без COUNT(*)
+        return queryset[:self.get_page_size(request) + 1]
+
+    def get_page(self, rows):
+        page_size = self.get_page_size(self.request)
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            self.next_position = (self.get_value(last), self.get_pk(last))
+        return rows
+
+    def paginate_queryset(self, queryset, request):
+        queryset = self.get_page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.get_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request):
+        queryset = self.get_page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.get_page([row async for row in queryset])
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
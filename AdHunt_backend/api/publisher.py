@@ -0,0 +1,314 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import timedelta
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Предел SendMessageBatch в SQS/YMQ
+MAX_BATCH_SIZE = 10
+
+# Тип искусственных событий benchmark_outbox: обычный релей их не отправляет
+BENCHMARK_EVENT_TYPE = 'benchmark'
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_sqs_client():
+    # Один клиент на процесс: boto3-клиент потокобезопасен и переиспользует HTTP-соединения
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = boto3.client(
+                    'sqs',
+                    region_name=settings.YMQ_REGION,
+                    endpoint_url=settings.YMQ_ENDPOINT_URL,
+                    aws_access_key_id=settings.YMQ_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.YMQ_SECRET_ACCESS_KEY,
+                    config=Config(
+                        max_pool_connections=settings.YMQ_MAX_POOL_CONNECTIONS,
+                        # Повторы делает send_with_retry, чтобы не умножать задержки
+                        retries={'mode': 'standard', 'max_attempts': 1},
+                    ),
+                )
+    return _client
+
+
+def build_entries(messages):
+    return [
+        {
+            'Id': str(event_id),
+            'MessageBody': json.dumps(payload),
+            'MessageAttributes': {'event': {'DataType': 'String', 'StringValue': event_type}},
+        }
+        for event_id, event_type, payload in messages
+    ]
+
+
+def send_with_retry(client, messages, sleep=time.sleep):
+    """
+    Отправляет сообщения пачками по MAX_BATCH_SIZE, повторяя неудачные
+    с экспоненциальной задержкой. Возвращает (отправленные id, неотправленные id).
+    """
+    sent, failed = [], []
+    for start in range(0, len(messages), MAX_BATCH_SIZE):
+        pending = messages[start:start + MAX_BATCH_SIZE]
+        for attempt in range(settings.YMQ_MAX_RETRIES + 1):
+            try:
+                response = client.send_message_batch(
+                    QueueUrl=settings.YMQ_ADS_QUEUE_URL,
+                    Entries=build_entries(pending),
+                )
+                failed_ids = {entry['Id'] for entry in response.get('Failed', [])}
+            except Exception as e:
+                logger.warning('Ошибка при отправке сообщений в очередь: %s', e)
+                failed_ids = {str(event_id) for event_id, _, _ in pending}
+
+            sent.extend(event_id for event_id, _, _ in pending if str(event_id) not in failed_ids)
+            pending = [message for message in pending if str(message[0]) in failed_ids]
+            if not pending or attempt == settings.YMQ_MAX_RETRIES:
+                break
+            delay = min(settings.YMQ_RETRY_MAX_DELAY, settings.YMQ_RETRY_BASE_DELAY * 2 ** attempt)
+            sleep(delay * random.uniform(0.5, 1))
+        failed.extend(event_id for event_id, _, _ in pending)
+    return sent, failed
+
+
+def mark_sent(sent, failed):
+    now = timezone.now()
+    if sent:
+        OutboxEvent.objects.filter(id__in=sent, sent_at__isnull=True).update(sent_at=now, locked_until=None)
+    if failed:
+        OutboxEvent.objects.filter(id__in=failed).update(attempts=F('attempts') + 1, locked_until=None)
+        # Событие, которое не уходит никогда, не должно вечно держать следующие события объявления
+        dead = OutboxEvent.objects.filter(
+            id__in=failed, attempts__gte=settings.OUTBOX_MAX_ATTEMPTS, failed_at__isnull=True
+        ).update(failed_at=now)
+        if dead:
+            logger.error('События outbox не отправлены за %s попыток и отложены: %s', settings.OUTBOX_MAX_ATTEMPTS, dead)
+
+
+def earlier_unsent_events():
+    # Неотправленные события того же объявления, записанные раньше (для Exists по OuterRef)
+    return OutboxEvent.objects.filter(
+        advertisement_id=OuterRef('advertisement_id'),
+        sent_at__isnull=True,
+        failed_at__isnull=True,
+        id__lt=OuterRef('id'),
+    )
+
+
+def claim_events(events, limit=None):
+    """
+    Берёт события в отправку и возвращает [(id, тип, сообщение), ...] по возрастанию id.
+
+    Строки выбираются через SELECT ... FOR UPDATE SKIP LOCKED и помечаются
+    locked_until на OUTBOX_LEASE_SECONDS, после чего транзакция сразу
+    коммитится: отправка с повторами идёт без блокировок и без открытой
+    транзакции, а другие релеи и буфер воркера пропускают взятые события.
+    Если отправитель упал, событие снова станет доступно после срока.
+
+    Берутся только события, перед которыми у объявления нет неотправленных
+    (в том числе взятых другим отправителем), так порядок по объявлению
+    сохраняется при любом числе отправителей.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = list(
+            events.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True, failed_at__isnull=True)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+            .exclude(Exists(earlier_unsent_events()))
+            .order_by('id')
+            .values_list('id', 'event_type', 'payload')[:limit]
+        )
+        if claimed:
+            OutboxEvent.objects.filter(id__in=[event_id for event_id, _, _ in claimed]).update(
+                locked_until=now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+            )
+    return claimed
+
+
+def requeue_failed_events():
+    """Возвращает отложенные события в отправку с новым счётчиком попыток. Возвращает их число."""
+    return OutboxEvent.objects.filter(sent_at__isnull=True, failed_at__isnull=False).update(
+        failed_at=None, attempts=0
+    )
+
+
+class MessagePublisher:
+    """
+    Ограниченный буфер сообщений, который фоновый поток отправляет пачками.
+
+    Буфер только ускоряет доставку: каждое сообщение уже записано в OutboxEvent,
+    поэтому при переполнении буфера или перезапуске воркера неотправленные
+    события дошлёт команда relay_outbox. Событие, перед которым у объявления
+    осталось неотправленное, буфер пропускает и тоже оставляет relay_outbox.
+    """
+
+    def __init__(self, client_factory=get_sqs_client, buffer_size=None, linger=None, autostart=True):
+        self.client_factory = client_factory
+        self.autostart = autostart
+        self.buffer = queue.Queue(maxsize=buffer_size or settings.YMQ_BUFFER_SIZE)
+        self.linger = settings.YMQ_BATCH_LINGER if linger is None else linger
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def enqueue(self, message):
+        try:
+            self.buffer.put_nowait(message)
+        except queue.Full:
+            logger.warning('Буфер очереди переполнен, событие %s останется в outbox', message[0])
+        if self.autostart:
+            self.start()
+
+    def start(self):
+        # После fork (gunicorn) поток нужно запускать заново в каждом воркере
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._stopped.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='outbox-publisher', daemon=True)
+                self._thread.start()
+
+    def take_batch(self, timeout):
+        try:
+            batch = [self.buffer.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        # Немного ждём остальные сообщения, чтобы заполнить пачку
+        deadline = time.monotonic() + self.linger
+        while len(batch) < MAX_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.buffer.get(timeout=remaining) if remaining > 0 else self.buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def send(self, batch):
+        # Событие, перед которым у объявления осталось неотправленное, ждёт relay_outbox
+        batch = claim_events(OutboxEvent.objects.filter(id__in=[event_id for event_id, _, _ in batch]))
+        if not batch:
+            return [], []
+        sent, failed = send_with_retry(self.client_factory(), batch)
+        mark_sent(sent, failed)
+        return sent, failed
+
+    def flush(self):
+        while True:
+            batch = self.take_batch(timeout=0)
+            if not batch:
+                return
+            self.send(batch)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self.take_batch(timeout=1)
+            if not batch:
+                continue
+            try:
+                self.send(batch)
+            except Exception as e:
+                logger.warning('Не удалось обработать пачку сообщений: %s', e)
+            finally:
+                close_old_connections()
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+
+publisher = MessagePublisher()
+atexit.register(publisher.stop)
+
+
+def publish_events(events):
+    """
+    Записывает события [(event_type, advertisement, payload), ...] в outbox одним INSERT.
+    """
+    if not settings.USE_YMQ or not events:
+        return []
+    # События пишутся в той же транзакции, что и изменение объявлений, а в буфер попадают только после коммита
+    outbox = OutboxEvent.objects.bulk_create([
+        OutboxEvent(event_type=event_type, advertisement_id=advertisement.id, payload=payload)
+        for event_type, advertisement, payload in events
+    ])
+    messages = [(event.id, event.event_type, event.payload) for event in outbox]
+
+    def enqueue():
+        for message in messages:
+            publisher.enqueue(message)
+
+    transaction.on_commit(enqueue)
+    return outbox
+
+
+def publish_event(event_type, advertisement, payload):
+    events = publish_events([(event_type, advertisement, payload)])
+    return events[0] if events else None
+
+
+def advertisement_message(advertisement):
+    return {
+        "id": advertisement.id,
+        "title": advertisement.title,
+        "author": advertisement.author.email,
+        "status": advertisement.status,
+    }
+
+
+def notify_queue(advertisement, event_type='advertisement.created'):
+    return publish_event(event_type, advertisement, advertisement_message(advertisement))
+
+
+def notify_queue_many(advertisements, event_type):
+    return publish_events([
+        (event_type, advertisement, advertisement_message(advertisement)) for advertisement in advertisements
+    ])
+
+
+def relay_outbox_batch(client, batch_size, grace, benchmark=False):
+    """
+    Отправляет одну пачку неотправленных событий. Возвращает (отправлено, не отправлено).
+
+    События берутся через claim_events, поэтому несколько релеев не отправляют
+    одно событие дважды, а следующее событие объявления становится доступно,
+    когда отправится (или будет отложено после OUTBOX_MAX_ATTEMPTS) предыдущее.
+
+    benchmark=True берёт только события benchmark_outbox, иначе они пропускаются.
+    """
+    # Свежие события ещё может отправить фоновый поток воркера
+    events = OutboxEvent.objects.filter(created_at__lte=timezone.now() - timedelta(seconds=grace))
+    if benchmark:
+        events = events.filter(event_type=BENCHMARK_EVENT_TYPE)
+    else:
+        events = events.exclude(event_type=BENCHMARK_EVENT_TYPE)
+    messages = claim_events(events, batch_size)
+    if not messages:
+        return 0, 0
+    sent, failed = send_with_retry(client, messages)
+    mark_sent(sent, failed)
+    return len(sent), len(failed)
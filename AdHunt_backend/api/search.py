@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import DecimalField, F, Q
+from django.db.models.functions import Cast
+
+SEARCH_CONFIGS = ('russian', 'english')
+
+
+def icontains_search(queryset, query):
+    return queryset.filter(Q(title__icontains=query) | Q(description__icontains=query))
+
+
+def postgres_search(queryset, query):
+    search_query = SearchQuery(query, config=SEARCH_CONFIGS[0], search_type='websearch')
+    for config in SEARCH_CONFIGS[1:]:
+        search_query |= SearchQuery(query, config=config, search_type='websearch')
+
+    # Триграммы по заголовку находят подстроки и опечатки, которые не ловит полнотекстовый поиск.
+    # rank - поле курсора: float4 не переживает str() и сравнение с float8-параметром,
+    # поэтому он округляется до numeric, который курсор передаёт без потерь
+    rank = SearchRank(F('search_vector'), search_query) + TrigramWordSimilarity(query, 'title')
+    return queryset.annotate(
+        rank=Cast(rank, DecimalField(max_digits=12, decimal_places=6)),
+    ).filter(
+        Q(search_vector=search_query) | Q(title__trigram_word_similar=query)
+    )
+
+
+SEARCH_BACKENDS = {
+    'icontains': icontains_search,
+    'postgres': postgres_search,
+}
+
+
+def supports_relevance():
+    return settings.ADVERTISEMENT_SEARCH_BACKEND == 'postgres'
+
+
+def search_advertisements(queryset, query):
+    return SEARCH_BACKENDS[settings.ADVERTISEMENT_SEARCH_BACKEND](queryset, query)
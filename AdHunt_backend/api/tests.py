@@ -1,3 +1,1851 @@
-from django.test import TestCase
+import base64
+import datetime
+import decimal
+import io
+import json
+import uuid
+import os
+import shutil
+import tempfile
+import tracemalloc
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from unittest import mock, skipUnless
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import (
+    CustomUser, Advertisement, AdvertisementImage, FavoriteAdvertisement, AdvertisementStatus, Role, OutboxEvent
+)
+from .pagination import KeysetPagination
+from .publisher import (
+    BENCHMARK_EVENT_TYPE, MessagePublisher, claim_events, publish_event, publish_events, relay_outbox_batch,
+    send_with_retry,
+)
+from .images import process_image, schedule_image_processing
+from .views import AdvertisementSerializer, CustomTokenObtainPairSerializer, filter_advertisements
+from .fast_serializers import AdvertisementRowSerializer, advertisement_rows
+from .renderers import FastJSONParser, FastJSONRenderer
+from .moderation import claimable, release_expired_leases
+from .counters import adjust_status_counters
+from .favorites import add_favorite
+from .cache import bump_advertisements_version
+from .cache_backends import FakeRedisConnectionPool
+from .counting import count_advertisements
+
+
+def create_user(email='user@example.com', role=Role.USER):
+    return CustomUser.objects.create_user(
+        email=email,
+        password='password',
+        first_name='Иван',
+        last_name='Иванов',
+        phone_number=email,
+        role=role,
+    )
+
+
+def create_advertisements(author, count, status=AdvertisementStatus.ACTIVE, images=2):
+    advertisements = []
+    for i in range(count):
+        advertisement = Advertisement.objects.create(
+            title=f'Объявление {i}',
+            description='Описание',
+            price=100 + i,
+            status=status,
+            author=author,
+        )
+        for j in range(images):
+            AdvertisementImage.objects.create(advertisement=advertisement, image=f'advertisements/{i}_{j}.jpg')
+        advertisements.append(advertisement)
+    return advertisements
+
+
+def make_image(name='photo.jpg', size=(64, 48), format='JPEG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{format.lower()}')
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+
+    def stored_files(self):
+        return [
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root) for name in names
+        ]
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+
+class AdvertisementQueryCountTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.moderator = create_user('moderator@example.com', Role.MODERATOR)
+
+    def assertConstantQueries(self, url, user, status=AdvertisementStatus.ACTIVE, favorites=False, queries=3):
+        self.client.force_authenticate(user)
+        # Число запросов не должно зависеть от размера выдачи
+        for batch in (3, 20):
+            advertisements = create_advertisements(self.user, batch, status=status)
+            if favorites:
+                for advertisement in advertisements:
+                    FavoriteAdvertisement.objects.create(user=user, advertisement=advertisement)
+            cache.clear()
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_feed(self):
+        advertisement = create_advertisements(self.user, 1)[0]
+        FavoriteAdvertisement.objects.create(user=self.user, advertisement=advertisement)
+        response = self.assertConstantQueries(reverse('advertisement-list'), self.user)
+        favorites = {item['id']: item['is_favorite'] for item in response.json()}
+        self.assertTrue(favorites[advertisement.id])
+        self.assertEqual(sum(favorites.values()), 1)
+
+    def test_feed_anonymous(self):
+        create_advertisements(self.user, 5)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('advertisement-list'))
+        self.assertEqual(len(response.json()), 5)
+
+    def test_user_advertisements(self):
+        self.assertConstantQueries(reverse('user-advertisements'), self.user)
+
+    def test_moderation_queue(self):
+        self.assertConstantQueries(
+            reverse('moderator-advertisements'), self.moderator, status=AdvertisementStatus.PENDING
+        )
+
+    def test_favorites(self):
+        response = self.assertConstantQueries(
+            reverse('favorite-advertisements'), self.user, favorites=True, queries=2
+        )
+        self.assertTrue(all(item['is_favorite'] for item in response.json()))
+
+
+class StatelessAuthenticationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        token = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_feed_without_user_query(self):
+        advertisement = create_advertisements(self.user, 3)[0]
+        FavoriteAdvertisement.objects.create(user=self.user, advertisement=advertisement)
+        # Первый запрос кеширует is_active, дальше пользователь не читается из БД
+        self.client.get(reverse('advertisement-list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('advertisement-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if 'api_customuser' in q['sql']])
+        favorites = {item['id']: item['is_favorite'] for item in response.json()}
+        self.assertTrue(favorites[advertisement.id])
+
+    def test_inactive_user_rejected(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.get(reverse('advertisement-list'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_token_without_email_claim(self):
+        # Токены, выданные до добавления claim email, продолжают работать
+        token = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = self.client.get(reverse('user-profile'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], self.user.email)
+
+    def test_profile_loads_user_once(self):
+        self.client.get(reverse('user-profile'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-profile'))
+        self.assertEqual(response.json()['first_name'], 'Иван')
+
+    def test_profile_reflects_update_before_token_expires(self):
+        response = self.client.put(reverse('user-profile'), {'email': 'new@example.com'}, format='json')
+        self.assertEqual(response.json()['email'], 'new@example.com')
+        # Токен выдан со старым email в claims
+        response = self.client.get(reverse('user-profile'))
+        self.assertEqual(response.json()['email'], 'new@example.com')
+
+    def test_profile_update_and_password_change(self):
+        response = self.client.put(reverse('user-profile'), {'first_name': 'Пётр'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['first_name'], 'Пётр')
+
+        response = self.client.post(reverse('change-password'), {
+            'old_password': 'password',
+            'new_password': 'N3w-secure-password',
+            'confirm_password': 'N3w-secure-password',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Пётр')
+        self.assertTrue(self.user.check_password('N3w-secure-password'))
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.advertisements = create_advertisements(self.user, 7, images=0)
+        # Одинаковые цены и даты проверяют разрешение равенств по id
+        created_at = self.advertisements[0].created_at
+        Advertisement.objects.update(created_at=created_at)
+        Advertisement.objects.filter(id__in=[ad.id for ad in self.advertisements[:4]]).update(price=50)
+
+    def walk(self, params):
+        url = reverse('advertisement-list')
+        ids = []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertLessEqual(len(body['results']), 3)
+            ids.extend(item['id'] for item in body['results'])
+            url, params = body['next'], None
+        return ids
+
+    def test_walks_every_ordering_without_gaps(self):
+        for sort_by in ('created_at', 'price'):
+            for order in ('asc', 'desc'):
+                expected = list(
+                    Advertisement.objects.order_by(
+                        *(f'{"-" if order == "desc" else ""}{field}' for field in (sort_by, 'id'))
+                    ).values_list('id', flat=True)
+                )
+                ids = self.walk({'sort_by': sort_by, 'order': order, 'page_size': 3})
+                self.assertEqual(ids, expected)
+
+    def test_compatibility_mode_returns_plain_list(self):
+        response = self.client.get(reverse('advertisement-list'))
+        self.assertEqual(len(response.json()), 7)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('advertisement-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_invalid_value(self):
+        def cursor(position):
+            # Корректный base64 и JSON, но значение не подходит полю сортировки
+            return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+        created_at = self.advertisements[0].created_at.isoformat()
+        for sort_by, position in (
+            ('price', ['abc', 1]),
+            ('price', [created_at, 1]),
+            ('created_at', ['не дата', 1]),
+            ('created_at', [None, 1]),
+            ('created_at', [created_at, None]),
+            ('created_at', [created_at, 'abc']),
+            ('created_at', [[1], 1]),
+        ):
+            response = self.client.get(reverse('advertisement-list'), {'sort_by': sort_by, 'cursor': cursor(position)})
+            self.assertEqual(response.status_code, 404, (sort_by, position))
+        response = self.client.get(reverse('advertisement-list'), {'sort_by': 'price', 'cursor': cursor(['50', 1])})
+        self.assertEqual(response.status_code, 200)
+
+        # Избранное сортируется по аннотации favorited_at, асинхронная лента - тем же классом
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('favorite-advertisements'), {'cursor': cursor(['abc', 1])})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('async-advertisement-list'), {'cursor': cursor(['abc', 1])})
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryPlanMixin:
+    def explain(self, queryset):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # На маленьких таблицах планировщик честно предпочитает seq scan
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def assertNoSeqScan(self, queryset):
+        # Для фильтров с сортировкой по другому полю сортировка диапазона допустима, полный проход - нет
+        plan = self.explain(queryset)
+        table = Advertisement._meta.db_table
+        if connection.vendor == 'postgresql':
+            self.assertNotIn(f'Seq Scan on {table}', plan)
+        else:
+            self.assertNotRegex(plan, rf'SCAN {table}(?! USING)')
+        return plan
+
+    def assertIndexScan(self, queryset):
+        plan = self.explain(queryset)
+        table = Advertisement._meta.db_table
+        if connection.vendor == 'postgresql':
+            self.assertNotIn(f'Seq Scan on {table}', plan)
+            self.assertNotRegex(plan, r'(?<!Incremental )Sort')
+        else:
+            self.assertNotRegex(plan, rf'SCAN {table}(?! USING)')
+            self.assertNotIn('TEMP B-TREE', plan)
+        return plan
+
+
+class AdvertisementIndexTests(QueryPlanMixin, TestCase):
+    def setUp(self):
+        self.user = create_user()
+        create_advertisements(self.user, 20, images=0)
+        create_advertisements(self.user, 5, status=AdvertisementStatus.PENDING, images=0)
+
+    def test_feed_uses_index(self):
+        for sort_by in ('created_at', 'price'):
+            for descending in (True, False):
+                paginator = KeysetPagination(sort_by, descending=descending)
+                queryset = Advertisement.objects.filter(status=AdvertisementStatus.ACTIVE).order_by(
+                    *paginator.ordering
+                )[:21]
+                self.assertIndexScan(queryset)
+
+    def test_moderation_queue_uses_index(self):
+        queryset = Advertisement.objects.filter(status=AdvertisementStatus.PENDING).order_by('-created_at', '-id')
+        self.assertIndexScan(queryset[:21])
+
+    def test_user_advertisements_use_index(self):
+        queryset = Advertisement.objects.filter(author=self.user).order_by('-created_at', '-id')
+        self.assertIndexScan(queryset[:21])
+
+    def test_claim_uses_index(self):
+        now = timezone.now()
+        self.assertIndexScan(Advertisement.objects.filter(claimable(now)).order_by('created_at', 'id')[:10])
+        self.assertIndexScan(Advertisement.objects.filter(lease_expires_at__lte=now).order_by())
+
+    def test_feed_filters_use_indexes(self):
+        now = timezone.now()
+        cases = {
+            'ad_status_price_idx': {'price_min': decimal.Decimal(100), 'price_max': decimal.Decimal(110)},
+            'ad_status_created_idx': {'created_after': now - datetime.timedelta(days=1), 'created_before': now},
+            'ad_author_': {'author_id': self.user.pk},
+            'api_advertisementimage_advertisement_id': {'has_images': True},
+        }
+        active = Advertisement.objects.filter(status=AdvertisementStatus.ACTIVE)
+        for index, filters in cases.items():
+            for ordering in (('-created_at', '-id'), ('price', 'id')):
+                with self.subTest(filters=filters, ordering=ordering):
+                    queryset = filter_advertisements(active, filters).order_by(*ordering)[:21]
+                    plan = self.assertNoSeqScan(queryset)
+                    if connection.vendor != 'postgresql':
+                        self.assertIn(index, plan)
+        # Автор с сортировкой по цене не перебирает цены всех активных объявлений
+        queryset = filter_advertisements(active, {'author_id': self.user.pk}).order_by('price', 'id')[:21]
+        self.assertIndexScan(queryset)
+
+    def test_favorites_use_index(self):
+        paginator = KeysetPagination('favorited_at', pk_field='favorite_advertisement_id')
+        queryset = Advertisement.objects.filter(favorited_by__user=self.user).annotate(
+            favorited_at=F('favorited_by__created_at'),
+            favorite_advertisement_id=F('favorited_by__advertisement_id'),
+        ).order_by(*paginator.ordering)[:21]
+        plan = self.assertIndexScan(queryset)
+        if connection.vendor != 'postgresql':
+            self.assertIn('fav_user_created_idx', plan)
+
+
+class TotalCountTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_user()
+        self.moderator = create_user('moderator@example.com', Role.MODERATOR)
+        create_advertisements(self.author, 5)
+        create_advertisements(self.author, 3, status=AdvertisementStatus.PENDING)
+
+    def assertTotalCount(self, response, count, exact=True):
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response['X-Total-Count'], str(count))
+        self.assertEqual(response['X-Total-Count-Exact'], 'true' if exact else 'false')
+
+    def test_lists(self):
+        page = {'page_size': 2}
+        self.assertTotalCount(self.client.get(reverse('advertisement-list'), page), 5)
+        self.assertTotalCount(self.client.get(reverse('advertisement-list'), {**page, 'search': 'нет такого'}), 0)
+        # Без пагинации число - длина списка, без лишнего запроса
+        self.assertTotalCount(self.client.get(reverse('advertisement-list')), 5)
+        self.client.force_authenticate(self.author)
+        self.assertTotalCount(self.client.get(reverse('user-advertisements'), page), 8)
+        self.client.force_authenticate(self.moderator)
+        self.assertTotalCount(self.client.get(reverse('moderator-advertisements'), page), 3)
+        self.assertTotalCount(self.client.get(reverse('async-advertisement-list'), page), 5)
+
+    def test_feed_count_cached_across_pages(self):
+        url = reverse('advertisement-list')
+        response = self.client.get(url, {'page_size': 2})
+        self.assertTotalCount(response, 5)
+        # Следующая страница: COUNT из кеша, запросы только за страницей и изображениями
+        with self.assertNumQueries(2):
+            self.assertTotalCount(self.client.get(response.json()['next']), 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_advertisements(self.author, 1)
+            bump_advertisements_version()
+        self.assertTotalCount(self.client.get(url, {'page_size': 2}), 6)
+
+    @override_settings(COUNT_EXACT_THRESHOLD=3)
+    def test_estimate_above_threshold(self):
+        queryset = Advertisement.objects.filter(status=AdvertisementStatus.ACTIVE)
+        with mock.patch('api.counting.estimate_count', return_value=2) as estimate:
+            # Оценка ниже порога не может быть правдой: порог уже превышен
+            self.assertEqual(count_advertisements(queryset), (4, False))
+            estimate.return_value = 40
+            self.assertEqual(count_advertisements(queryset), (40, False))
+            # Точный счёт по запросу клиента
+            self.assertEqual(count_advertisements(queryset, exact=True), (5, True))
+            self.assertEqual(count_advertisements(queryset.filter(price__lt=0)), (0, True))
+            response = self.client.get(reverse('advertisement-list'), {'page_size': 2})
+            self.assertTotalCount(response, 40, exact=False)
+            response = self.client.get(reverse('advertisement-list'), {'page_size': 2, 'exact_count': 'true'})
+            self.assertTotalCount(response, 5)
+        # Без оценщика планировщика (SQLite) - обычный точный COUNT
+        self.assertEqual(count_advertisements(queryset), (5, True))
+
+    @override_settings(COUNT_EXACT_THRESHOLD=3)
+    def test_bounded_exact_count_falls_back_to_estimate(self):
+        queryset = Advertisement.objects.filter(status=AdvertisementStatus.ACTIVE)
+        with mock.patch('api.counting.bounded_count', return_value=None), \
+                mock.patch('api.counting.estimate_count', return_value=40):
+            self.assertEqual(count_advertisements(queryset, exact=True), (40, False))
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN и statement_timeout есть только в PostgreSQL')
+    def test_postgresql_estimate(self):
+        from .counting import bounded_count, estimate_count
+        queryset = Advertisement.objects.filter(status=AdvertisementStatus.ACTIVE)
+        self.assertGreaterEqual(estimate_count(queryset), 1)
+        self.assertEqual(bounded_count(queryset, 1000), 5)
+
+
+class FeedFilterTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_user()
+        self.other = create_user('other@example.com')
+        # Цены 100-104 с изображениями у автора, 100-102 без изображений у другого
+        self.with_images = create_advertisements(self.author, 5, images=1)
+        self.without_images = create_advertisements(self.other, 3, images=0)
+        create_advertisements(self.author, 2, status=AdvertisementStatus.PENDING)
+        self.old = self.with_images[0]
+        Advertisement.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - datetime.timedelta(days=30))
+
+    def feed(self, name='advertisement-list', **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return {item['id'] for item in response.json()}
+
+    def ids(self, advertisements):
+        return {advertisement.pk for advertisement in advertisements}
+
+    def test_filters(self):
+        everything = self.ids(self.with_images + self.without_images)
+        self.assertEqual(self.feed(), everything)
+        self.assertEqual(
+            self.feed(price_min='101', price_max='102.00'),
+            self.ids(self.with_images[1:3] + self.without_images[1:3]),
+        )
+        week_ago = (timezone.now() - datetime.timedelta(days=7)).isoformat()
+        self.assertEqual(self.feed(created_before=week_ago), {self.old.pk})
+        self.assertEqual(self.feed(created_after=week_ago), everything - {self.old.pk})
+        self.assertEqual(self.feed(author_id=self.other.pk), self.ids(self.without_images))
+        self.assertEqual(self.feed(has_images='true'), self.ids(self.with_images))
+        self.assertEqual(self.feed(has_images='false'), self.ids(self.without_images))
+        # Фильтры складываются в один queryset
+        self.assertEqual(
+            self.feed(author_id=self.author.pk, price_max='101', has_images='1', created_after=week_ago),
+            {self.with_images[1].pk},
+        )
+        self.assertEqual(self.feed('async-advertisement-list', price_min='104'), {self.with_images[4].pk})
+
+    def test_invalid_filters(self):
+        cases = (
+            ({'price_min': 'дёшево'}, 'price_min'),
+            ({'price_min': '-1'}, 'price_min'),
+            ({'price_min': '200', 'price_max': '100'}, 'price_max'),
+            ({'created_after': 'вчера'}, 'created_after'),
+            ({'created_after': '2024-05-02', 'created_before': '2024-05-01'}, 'created_before'),
+            ({'author_id': '0'}, 'author_id'),
+            ({'has_images': 'может быть'}, 'has_images'),
+        )
+        for params, field in cases:
+            for name in ('advertisement-list', 'async-advertisement-list'):
+                response = self.client.get(reverse(name), params)
+                self.assertEqual(response.status_code, 400, (name, params))
+                self.assertIn(field, response.json())
+
+    def test_filters_are_part_of_cache_key(self):
+        self.assertEqual(len(self.feed(author_id=self.other.pk)), 3)
+        self.assertEqual(len(self.feed()), 8)
+        self.assertEqual(len(self.feed(author_id=self.author.pk)), 5)
+
+
+class FacetsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_user()
+        self.moderator = create_user('moderator@example.com', Role.MODERATOR)
+        for price, advertisement_status in (
+            (500, AdvertisementStatus.ACTIVE),
+            (999.99, AdvertisementStatus.ACTIVE),
+            (1000, AdvertisementStatus.ACTIVE),
+            (7000, AdvertisementStatus.ACTIVE),
+            (200000, AdvertisementStatus.ACTIVE),
+            (800, AdvertisementStatus.PENDING),
+            (900, AdvertisementStatus.REJECTED),
+        ):
+            Advertisement.objects.create(
+                title=f'Товар {price}', description='Описание', price=price, status=advertisement_status, author=self.author
+            )
+        self.url = reverse('advertisement-facets')
+
+    def facets(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_price_histogram(self):
+        with self.assertNumQueries(1):
+            data = self.facets(price_edges='1000,10000')
+        self.assertEqual(data, {
+            'total': 5,
+            'price': [
+                {'min': None, 'max': '1000.00', 'count': 2},
+                {'min': '1000.00', 'max': '10000.00', 'count': 2},
+                {'min': '10000.00', 'max': None, 'count': 1},
+            ],
+        })
+        # Повторный запрос - из кеша под версией ленты
+        with self.assertNumQueries(0):
+            self.assertEqual(self.facets(price_edges='1000,10000'), data)
+
+        default = self.facets()
+        self.assertEqual(len(default['price']), len(settings.FACETS_PRICE_EDGES.split(',')) + 1)
+        self.assertEqual(sum(bucket['count'] for bucket in default['price']), 5)
+
+    def test_same_filters_as_feed(self):
+        data = self.facets(price_edges='1000', price_max='1000', search='Товар')
+        self.assertEqual([bucket['count'] for bucket in data['price']], [2, 1])
+        data = self.facets(price_edges='1000', author_id=self.moderator.pk)
+        self.assertEqual(data['total'], 0)
+
+    def test_status_counts_for_moderators(self):
+        self.assertNotIn('status', self.facets())
+        self.client.force_authenticate(self.author)
+        self.assertNotIn('status', self.facets())
+        self.client.force_authenticate(self.moderator)
+        with self.assertNumQueries(1):
+            data = self.facets(price_edges='1000')
+        self.assertEqual(data['status'], {'active': 5, 'pending': 1, 'rejected': 1})
+        # Гистограмма и total - по активным объявлениям, как и для остальных
+        self.assertEqual(data['total'], 5)
+        self.assertEqual([bucket['count'] for bucket in data['price']], [2, 3])
+
+    def test_invalidated_with_feed(self):
+        self.assertEqual(self.facets()['total'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Advertisement.objects.create(
+                title='Новый', description='Описание', price=1, status=AdvertisementStatus.ACTIVE, author=self.author
+            )
+            bump_advertisements_version()
+        self.assertEqual(self.facets()['total'], 6)
+
+    def test_invalid_parameters(self):
+        for params in (
+            {'price_edges': '1000,500'},
+            {'price_edges': '1000,1000'},
+            {'price_edges': 'дорого'},
+            {'price_edges': '-1'},
+            {'price_edges': ''},
+            {'price_edges': ','.join(str(i) for i in range(settings.FACETS_MAX_PRICE_EDGES + 1))},
+            {'price_min': 'x'},
+        ):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+
+class AdvertisementSearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        author = create_user()
+        for title, description in (
+            ('Велосипед горный', 'Почти новый'),
+            ('Самокат', 'Подходит к велосипеду'),
+            ('Диван', 'Mountain bike included'),
+        ):
+            Advertisement.objects.create(
+                title=title, description=description, price=100, status=AdvertisementStatus.ACTIVE, author=author
+            )
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('advertisement-list'), {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()]
+
+    @override_settings(ADVERTISEMENT_SEARCH_BACKEND='icontains')
+    def test_icontains_backend(self):
+        self.assertEqual(self.search('BIKE'), ['Диван'])
+        self.assertEqual(self.search('Самокат'), ['Самокат'])
+        # Без полнотекстового поиска relevance сводится к сортировке по дате
+        self.assertEqual(self.search('о', sort_by='relevance'), ['Самокат', 'Велосипед горный'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Полнотекстовый поиск работает только в PostgreSQL')
+    @override_settings(ADVERTISEMENT_SEARCH_BACKEND='postgres')
+    def test_postgres_backend_ranks_title_above_description(self):
+        titles = self.search('велосипед', sort_by='relevance')
+        self.assertEqual(titles, ['Велосипед горный', 'Самокат'])
+        # Опечатка находится через триграммы
+        self.assertIn('Велосипед горный', self.search('велосипет'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Полнотекстовый поиск работает только в PostgreSQL')
+    @override_settings(ADVERTISEMENT_SEARCH_BACKEND='postgres')
+    def test_relevance_pages_without_gaps_on_ties(self):
+        author = create_user('other@example.com')
+        # Одинаковые и почти одинаковые ранги на границах страниц
+        for i in range(9):
+            Advertisement.objects.create(
+                title='Велосипед' if i % 3 else f'Велосипед {i}', description='Описание' * (i % 2 + 1),
+                price=100, status=AdvertisementStatus.ACTIVE, author=author,
+            )
+        expected = set(Advertisement.objects.filter(title__icontains='велосипед').values_list('id', flat=True))
+
+        ids, url = [], reverse('advertisement-list')
+        params = {'search': 'велосипед', 'sort_by': 'relevance', 'page_size': 2}
+        while url:
+            body = self.client.get(url, params).json()
+            ids += [item['id'] for item in body['results']]
+            url, params = body['next'], None
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), expected)
+
+
+class AdvertisementCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.moderator = create_user('moderator@example.com', Role.MODERATOR)
+        self.advertisement = create_advertisements(self.user, 3)[0]
+
+    def test_feed_is_served_from_cache(self):
+        url = reverse('advertisement-list')
+        first = self.client.get(url, {'page_size': 2})
+        with self.assertNumQueries(0):
+            second = self.client.get(url, {'page_size': '2'})
+        self.assertEqual(first.json(), second.json())
+
+    def test_favorites_are_overlaid_on_cached_body(self):
+        url = reverse('advertisement-list')
+        self.client.get(url)
+        FavoriteAdvertisement.objects.create(user=self.user, advertisement=self.advertisement)
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        favorites = [item['id'] for item in response.json() if item['is_favorite']]
+        self.assertEqual(favorites, [self.advertisement.id])
+
+    def test_moderation_invalidates_feed(self):
+        url = reverse('advertisement-list')
+        pending = create_advertisements(self.user, 1, status=AdvertisementStatus.PENDING)[0]
+        self.assertEqual(len(self.client.get(url).json()), 3)
+
+        self.client.force_authenticate(self.moderator)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('moderator-advertisement-detail', args=[pending.pk]), {'status': 'active'})
+        self.assertEqual(len(self.client.get(url).json()), 4)
+
+    def test_edit_invalidates_detail(self):
+        url = reverse('advertisement-detail', args=[self.advertisement.pk])
+        self.assertEqual(self.client.get(url).json()['title'], self.advertisement.title)
+
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(url, {'title': 'Новое название'})
+        self.client.force_authenticate(None)
+        # Метаданные для ETag, затем карточка с изображениями
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['title'], 'Новое название')
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.advertisements = create_advertisements(self.user, 20)
+        self.advertisement = self.advertisements[0]
+        self.detail_url = reverse('advertisement-detail', args=[self.advertisement.pk])
+        self.feed_url = reverse('advertisement-list')
+
+    def revalidate(self, url, response, **params):
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # Только запрос метаданных, без сборки карточки
+        with self.assertNumQueries(1):
+            not_modified = self.revalidate(self.detail_url, response)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified.content, b'')
+        saved = len(response.content) - len(not_modified.content)
+        self.assertEqual(saved, len(response.content))
+        self.assertGreater(saved, 500)
+
+        not_modified = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_detail_etag_changes(self):
+        etags = {self.client.get(self.detail_url)['ETag']}
+
+        def changed():
+            response = self.client.get(self.detail_url)
+            self.assertNotIn(response['ETag'], etags)
+            etags.add(response['ETag'])
+            return response
+
+        Advertisement.objects.filter(pk=self.advertisement.pk).update(status=AdvertisementStatus.REJECTED)
+        self.assertEqual(changed().json()['status'], AdvertisementStatus.REJECTED)
+        AdvertisementImage.objects.filter(advertisement=self.advertisement).update(
+            variants={'thumb': {'webp': 'advertisements/variants/0_0_thumb.webp'}}
+        )
+        self.assertTrue(changed().json()['images'][0]['variants'])
+        AdvertisementImage.objects.create(advertisement=self.advertisement, image='advertisements/new.jpg')
+        self.assertEqual(len(changed().json()['images']), 3)
+
+        # is_favorite - часть ответа пользователя
+        self.client.force_authenticate(self.user)
+        self.client.put(reverse('advertisement-favorite', args=[self.advertisement.pk]))
+        self.assertTrue(changed().json()['is_favorite'])
+
+    def test_missing_detail(self):
+        response = self.client.get(reverse('advertisement-detail', args=[0]), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+    def test_feed_not_modified(self):
+        response = self.client.get(self.feed_url, {'page_size': 20})
+        # Ни БД, ни чтения тела из кеша: только версия ленты и валидаторы
+        with self.assertNumQueries(0):
+            not_modified = self.revalidate(self.feed_url, response, page_size=20)
+        self.assertEqual(not_modified.status_code, 304)
+        saved = len(response.content) - len(not_modified.content)
+        self.assertEqual(saved, len(response.content))
+        self.assertGreater(saved, 10000)
+
+        not_modified = self.client.get(
+            self.feed_url, {'page_size': 20}, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(not_modified.status_code, 304)
+        # Другая страница - другое тело
+        self.assertEqual(self.revalidate(self.feed_url, response, page_size=10).status_code, 200)
+
+    def test_feed_etag_follows_version_and_favorites(self):
+        response = self.client.get(self.feed_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Advertisement.objects.filter(pk=self.advertisement.pk).update(title='Новое название')
+            bump_advertisements_version()
+        response = self.revalidate(self.feed_url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Новое название', response.content.decode())
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.feed_url)
+        self.assertEqual(self.revalidate(self.feed_url, response).status_code, 304)
+        self.client.put(reverse('advertisement-favorite', args=[self.advertisement.pk]))
+        response = self.revalidate(self.feed_url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json() if item['is_favorite']], [self.advertisement.pk])
+
+
+class AsyncAdvertisementViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.advertisements = create_advertisements(self.user, 5)
+        create_advertisements(self.user, 2, status=AdvertisementStatus.PENDING)
+        FavoriteAdvertisement.objects.create(user=self.user, advertisement=self.advertisements[1])
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def sync_get(self, name, *args, params=None, headers=None):
+        client = APIClient()
+        return client.get(reverse(name, args=args), params, headers=headers)
+
+    async def test_feed_matches_sync_view(self):
+        for params in (None, {'page_size': 2}, {'sort_by': 'price', 'order': 'asc', 'page_size': 3}):
+            for headers in (None, self.headers):
+                expected = await sync_to_async(self.sync_get)('advertisement-list', params=params, headers=headers)
+                await cache.aclear()
+                response = await self.async_client.get(
+                    reverse('async-advertisement-list'), params or {}, headers=headers
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertEqual(
+                    response.content.replace(b'/api/async/advertisements/', b'/api/advertisements/'),
+                    expected.content,
+                )
+
+    async def test_pages_and_conditional_get(self):
+        url, ids = reverse('async-advertisement-list'), []
+        response = await self.async_client.get(url, {'page_size': 2})
+        while True:
+            data = response.json()
+            ids += [item['id'] for item in data['results']]
+            if not data['next']:
+                break
+            response = await self.async_client.get(data['next'])
+        self.assertEqual(ids, [advertisement.pk for advertisement in reversed(self.advertisements)])
+
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual([item['id'] for item in response.json() if item['is_favorite']], [self.advertisements[1].pk])
+        response = await self.async_client.get(url, headers={**self.headers, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_detail_matches_sync_view(self):
+        advertisement = self.advertisements[1]
+        expected = await sync_to_async(self.sync_get)('advertisement-detail', advertisement.pk, headers=self.headers)
+        await cache.aclear()
+        url = reverse('async-advertisement-detail', args=[advertisement.pk])
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response['ETag'], expected['ETag'])
+        response = await self.async_client.get(url, headers={**self.headers, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_errors_match_sync_view(self):
+        cases = (
+            ('advertisement-detail', [0], None, None),
+            ('advertisement-list', [], {'cursor': '!'}, None),
+            ('advertisement-list', [], None, {'Authorization': 'Bearer invalid'}),
+        )
+        for name, args, params, headers in cases:
+            expected = await sync_to_async(self.sync_get)(name, *args, params=params, headers=headers)
+            response = await self.async_client.get(reverse(f'async-{name}', args=args), params or {}, headers=headers)
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(response.json(), expected.json())
+        response = await self.async_client.post(reverse('async-advertisement-list'))
+        self.assertEqual(response.status_code, 405)
+
+
+class SharedCacheBackendTests(TestCase):
+    def make_cache(self, location, **options):
+        from .cache_backends import FallbackRedisCache
+
+        return FallbackRedisCache(location, {
+            'KEY_PREFIX': 'test',
+            'OPTIONS': {
+                'pool_class': 'api.cache_backends.FakeRedisConnectionPool',
+                'serializer': 'api.cache_backends.CompressedRedisSerializer',
+                **options,
+            },
+        })
+
+    @override_settings(CACHE_COMPRESS_MIN_SIZE=100)
+    def test_large_values_are_compressed(self):
+        shared = self.make_cache('fakeredis://')
+        payload = [{'title': 'Объявление', 'description': 'Описание ' * 50}] * 20
+        shared.set('feed', payload)
+        self.assertEqual(shared.get('feed'), payload)
+        raw = shared._cache.get_client().get(shared.make_key('feed'))
+        self.assertTrue(raw.startswith(b'z'))
+        shared.add('counter', 1)
+        self.assertEqual(shared.incr('counter'), 2)
+
+    def test_fakeredis_is_optional(self):
+        # fakeredis есть только в requirements-dev.txt
+        with mock.patch.dict('sys.modules', {'fakeredis': None}), self.assertRaises(ImproperlyConfigured):
+            FakeRedisConnectionPool.from_url('fakeredis://')
+
+    def test_degrades_to_local_cache_when_unreachable(self):
+        shared = self.make_cache(
+            'redis://127.0.0.1:1/0',
+            pool_class='redis.ConnectionPool',
+            socket_connect_timeout=0.1,
+        )
+        with self.assertLogs('api.cache_backends', 'WARNING'):
+            shared.set('key', 'value')
+        self.assertTrue(shared.is_degraded)
+        self.assertEqual(shared.get('key'), 'value')
+
+
+class FakeSQSClient:
+    # Запоминает пачки SendMessageBatch; fail_ids отклоняются при первой попытке
+    def __init__(self, fail_ids=()):
+        self.batches = []
+        self.fail_ids = {str(event_id) for event_id in fail_ids}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.batches.append(Entries)
+        failed_ids = {entry['Id'] for entry in Entries} & self.fail_ids
+        self.fail_ids -= failed_ids
+        return {
+            'Successful': [{'Id': entry['Id']} for entry in Entries if entry['Id'] not in failed_ids],
+            'Failed': [{'Id': event_id, 'SenderFault': False} for event_id in failed_ids],
+        }
+
+    @property
+    def messages(self):
+        return [json.loads(entry['MessageBody']) for batch in self.batches for entry in batch]
+
+
+@override_settings(USE_YMQ=True, YMQ_ADS_QUEUE_URL='https://queue.example.com/ads')
+class MessagePublisherTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.sqs = FakeSQSClient()
+        self.publisher = MessagePublisher(client_factory=lambda: self.sqs, autostart=False)
+        patcher = mock.patch('api.publisher.publisher', self.publisher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_created_advertisement_is_sent_after_commit(self):
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(
+                reverse('advertisement-create'), {'title': 'Велосипед', 'description': 'Новый', 'price': '10.00'}
+            )
+            self.assertEqual(self.publisher.buffer.qsize(), 0)
+        for callback in callbacks:
+            callback()
+
+        self.publisher.flush()
+        self.assertEqual(self.sqs.messages, [{
+            'id': response.json()['id'],
+            'title': 'Велосипед',
+            'author': self.user.email,
+            'status': AdvertisementStatus.PENDING,
+        }])
+        self.assertFalse(OutboxEvent.objects.filter(sent_at__isnull=True).exists())
+
+    def test_buffer_does_not_overtake_unsent_events(self):
+        advertisement = create_advertisements(self.user, 1, images=0)[0]
+        other = create_advertisements(self.user, 1, images=0)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            publish_event('advertisement.updated', advertisement, {'n': 1})
+        # Первое событие выпало из буфера (переполнение или перезапуск), осталась только запись outbox
+        self.publisher.buffer.get_nowait()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            publish_events([
+                ('advertisement.moderated', advertisement, {'n': 2}),
+                ('advertisement.moderated', other, {'n': 3}),
+            ])
+        self.publisher.flush()
+        # Следующее событие того же объявления ждёт первое, другое объявление не задерживается
+        self.assertEqual(self.sqs.messages, [{'n': 3}])
+
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (1, 0))
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (1, 0))
+        self.assertEqual([message['n'] for message in self.sqs.messages], [3, 1, 2])
+
+    def test_batches_and_retries_failed_entries(self):
+        messages = [(event_id, 'advertisement.created', {'id': event_id}) for event_id in range(1, 24)]
+        self.sqs.fail_ids = {'3', '15'}
+        delays = []
+
+        sent, failed = send_with_retry(self.sqs, messages, sleep=delays.append)
+
+        self.assertEqual(sorted(sent), list(range(1, 24)))
+        self.assertEqual(failed, [])
+        self.assertTrue(all(len(batch) <= 10 for batch in self.sqs.batches))
+        # Три пачки по 10/10/3 и по одному повтору для двух отклонённых сообщений
+        self.assertEqual([len(batch) for batch in self.sqs.batches], [10, 1, 10, 1, 3])
+        self.assertEqual(len(delays), 2)
+
+    @override_settings(YMQ_MAX_RETRIES=2)
+    def test_gives_up_after_max_retries(self):
+        class BrokenClient:
+            def send_message_batch(self, **kwargs):
+                raise ConnectionError('queue is down')
+
+        delays = []
+        with self.assertLogs('api.publisher', 'WARNING'):
+            sent, failed = send_with_retry(BrokenClient(), [(1, 'advertisement.created', {})], sleep=delays.append)
+        self.assertEqual((sent, failed), ([], [1]))
+        self.assertEqual(len(delays), 2)
+        self.assertLessEqual(delays[0], delays[1])
+
+
+@override_settings(USE_YMQ=True, YMQ_ADS_QUEUE_URL='https://queue.example.com/ads')
+class OutboxRelayTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.moderator = create_user('moderator@example.com', Role.MODERATOR)
+        self.advertisement = create_advertisements(self.user, 1, status=AdvertisementStatus.PENDING, images=0)[0]
+        self.sqs = FakeSQSClient()
+
+    def test_lifecycle_changes_write_events(self):
+        self.client.force_authenticate(self.user)
+        self.client.put(reverse('advertisement-detail', args=[self.advertisement.pk]), {'title': 'Другое'})
+        self.client.force_authenticate(self.moderator)
+        self.client.post(
+            reverse('moderator-advertisement-detail', args=[self.advertisement.pk]), {'status': 'rejected'}
+        )
+        events = OutboxEvent.objects.filter(advertisement_id=self.advertisement.pk)
+        self.assertEqual(
+            [(event.event_type, event.payload['status']) for event in events],
+            [('advertisement.updated', 'pending'), ('advertisement.moderated', 'rejected')],
+        )
+
+    def test_relay_keeps_per_advertisement_order(self):
+        other = create_advertisements(self.user, 1, images=0)[0]
+        for n, advertisement in enumerate([self.advertisement, self.advertisement, other]):
+            OutboxEvent.objects.create(event_type='advertisement.created', advertisement_id=advertisement.id, payload={'n': n})
+
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (2, 0))
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (1, 0))
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (0, 0))
+        self.assertEqual([message['n'] for message in self.sqs.messages], [0, 2, 1])
+
+    def test_benchmark_events_never_reach_the_queue(self):
+        OutboxEvent.objects.create(event_type=BENCHMARK_EVENT_TYPE, advertisement_id=-1, payload={})
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (0, 0))
+        self.assertEqual(self.sqs.messages, [])
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_outbox', events=10, stdout=io.StringIO())
+        with override_settings(USE_YMQ=False):
+            out = io.StringIO()
+            call_command('benchmark_outbox', events=10, advertisements=3, batch_size=4, stdout=out)
+            # Релей действительно отправил все события бенчмарка, включая созданное выше
+            self.assertRegex(out.getvalue(), r'^Релеев: 1, событий: 11, время: [\d.]+ с, \d+ событий/с$')
+            # Падение посреди замера тоже не оставляет событий в outbox
+            with mock.patch('api.management.commands.benchmark_outbox.Command.run', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    call_command('benchmark_outbox', events=10, stdout=io.StringIO())
+        self.assertFalse(OutboxEvent.objects.filter(event_type=BENCHMARK_EVENT_TYPE).exists())
+
+    def test_relay_sends_claimed_events_without_holding_locks(self):
+        event = OutboxEvent.objects.create(
+            event_type='advertisement.created', advertisement_id=self.advertisement.pk, payload={}
+        )
+        test = self
+
+        class ClaimCheckingClient(FakeSQSClient):
+            def send_message_batch(self, QueueUrl, Entries):
+                # Во время отправки событие помечено взятым, другой релей его не берёт
+                test.assertIsNotNone(OutboxEvent.objects.get(pk=event.pk).locked_until)
+                test.assertEqual(claim_events(OutboxEvent.objects.all()), [])
+                return super().send_message_batch(QueueUrl, Entries)
+
+        self.assertEqual(relay_outbox_batch(ClaimCheckingClient(), batch_size=10, grace=0), (1, 0))
+        event.refresh_from_db()
+        self.assertIsNotNone(event.sent_at)
+        self.assertIsNone(event.locked_until)
+
+        # Релей упал посреди отправки: после срока аренды событие берут снова
+        stuck = OutboxEvent.objects.create(
+            event_type='advertisement.created', advertisement_id=self.advertisement.pk, payload={},
+            locked_until=timezone.now() - datetime.timedelta(seconds=1),
+        )
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (1, 0))
+        self.assertIsNotNone(OutboxEvent.objects.get(pk=stuck.pk).sent_at)
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2, YMQ_MAX_RETRIES=0)
+    def test_undeliverable_event_is_set_aside(self):
+        events = [
+            OutboxEvent.objects.create(
+                event_type='advertisement.updated', advertisement_id=self.advertisement.pk, payload={'n': n}
+            )
+            for n in range(2)
+        ]
+        self.sqs.fail_ids = {str(events[0].pk)}
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (0, 1))
+        self.sqs.fail_ids = {str(events[0].pk)}
+        with self.assertLogs('api.publisher', 'ERROR'):
+            self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (0, 1))
+        events[0].refresh_from_db()
+        self.assertIsNotNone(events[0].failed_at)
+
+        # Отложенное событие больше не держит следующее
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (1, 0))
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=0), (0, 0))
+
+        out = io.StringIO()
+        with mock.patch('api.management.commands.relay_outbox.get_sqs_client', return_value=self.sqs):
+            call_command('relay_outbox', requeue_failed=True, grace=0, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['Возвращено в отправку: 1', 'Отправлено: 1, ошибок: 0'])
+        # Две отклонённые попытки, следующее событие, затем возвращённое
+        self.assertEqual([message['n'] for message in self.sqs.messages], [0, 0, 1, 0])
+
+    def test_relay_skips_fresh_events(self):
+        OutboxEvent.objects.create(event_type='advertisement.created', advertisement_id=1, payload={})
+        self.assertEqual(relay_outbox_batch(self.sqs, batch_size=10, grace=60), (0, 0))
+
+
+class ImageIngestionTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def create(self, count):
+        return self.client.post(reverse('advertisement-create'), {
+            'title': 'Фотоаппарат',
+            'description': 'С объективом',
+            'price': '500.00',
+            'images': [make_image(f'photo{i}.jpg') for i in range(count)],
+        })
+
+    def test_images_are_uploaded_and_inserted_in_bulk(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.create(5)
+        self.assertEqual(response.status_code, 201, response.content)
+        inserts = [q for q in context.captured_queries if 'INSERT INTO "api_advertisementimage"' in q['sql']]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(len(response.json()['images']), 5)
+        self.assertEqual(len(self.stored_files()), 5)
+
+    def test_failed_upload_rolls_back(self):
+        save = default_storage.save
+        calls = []
+
+        def flaky_save(name, content, max_length=None):
+            calls.append(name)
+            if len(calls) == 3:
+                raise OSError('storage is down')
+            return save(name, content, max_length=max_length)
+
+        with mock.patch.object(default_storage, 'save', flaky_save):
+            with self.assertRaises(OSError):
+                self.create(4)
+        self.assertFalse(Advertisement.objects.exists())
+        self.assertFalse(AdvertisementImage.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+@override_settings(IMAGE_VARIANTS={'thumb': 20, 'card': 40}, IMAGE_MAX_DIMENSION=100)
+class ImageVariantTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.advertisement = create_advertisements(create_user(), 1, images=0)[0]
+
+    def add_image(self, size, exif=None):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'blue').save(buffer, 'JPEG', exif=exif or Image.Exif())
+        name = default_storage.save('advertisements/photo.jpg', SimpleUploadedFile('photo.jpg', buffer.getvalue()))
+        return AdvertisementImage.objects.create(advertisement=self.advertisement, image=name)
+
+    def test_variants_are_generated_and_exposed(self):
+        image = self.add_image((80, 60))
+        process_image(image.id)
+        image.refresh_from_db()
+
+        self.assertEqual(set(image.variants), {'thumb', 'card'})
+        for name, side in (('thumb', 20), ('card', 40)):
+            for extension in ('webp', 'jpeg'):
+                with default_storage.open(image.variants[name][extension]) as file:
+                    self.assertEqual(max(Image.open(file).size), side)
+
+        response = self.client.get(reverse('advertisement-detail', args=[self.advertisement.pk]))
+        variants = response.json()['images'][0]['variants']
+        self.assertTrue(variants['thumb']['webp'].startswith('http://testserver/media/advertisements/variants/'))
+
+    def test_original_is_capped_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # поворот на 90°
+        exif[0x010F] = 'Camera'
+        image = self.add_image((300, 150), exif=exif)
+        old_name = image.image.name
+
+        process_image(image.id)
+        image.refresh_from_db()
+
+        with default_storage.open(image.image.name) as file:
+            original = Image.open(file)
+            self.assertEqual(original.size, (50, 100))
+            self.assertFalse(original.getexif())
+        self.assertFalse(default_storage.exists(old_name))
+
+
+    def test_upload_bumps_feed_version_once(self):
+        images = [self.add_image((80, 60)) for _ in range(3)]
+        images.append(AdvertisementImage.objects.create(
+            advertisement=self.advertisement,
+            image=default_storage.save('advertisements/broken.jpg', SimpleUploadedFile('broken.jpg', b'not an image')),
+        ))
+        class InlineExecutor:
+            # Потоки пула не видят данные транзакции теста
+            def submit(self, fn, *args):
+                fn(*args)
+
+        with mock.patch('api.images.get_executor', return_value=InlineExecutor()), \
+                mock.patch('api.images.bump_advertisements_version') as bump, \
+                mock.patch('api.images.close_old_connections'), \
+                self.assertLogs('api.images', 'WARNING'):
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_image_processing(images)
+        # Четыре изображения, одно из них битое - один сброс кеша после последнего
+        bump.assert_called_once_with()
+        self.assertEqual(AdvertisementImage.objects.exclude(variants={}).count(), 3)
+
+    def test_sweeper_processes_images_left_without_variants(self):
+        processed = self.add_image((80, 60))
+        process_image(processed.id)
+        # Обработка в пуле упала или потерялась при перезапуске воркера
+        lost = self.add_image((80, 60))
+        broken = AdvertisementImage.objects.create(
+            advertisement=self.advertisement,
+            image=default_storage.save('advertisements/broken.jpg', SimpleUploadedFile('broken.jpg', b'not an image')),
+        )
+        fresh = self.add_image((80, 60))
+        AdvertisementImage.objects.exclude(pk=fresh.pk).update(
+            created_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+
+        out = io.StringIO()
+        with self.assertLogs('api.images', 'WARNING'):
+            call_command('process_images', batch_size=1, min_age=60, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Обработано: 1, ошибок: 1')
+        lost.refresh_from_db()
+        self.assertEqual(set(lost.variants), {'thumb', 'card'})
+        self.assertEqual(
+            set(AdvertisementImage.objects.filter(variants={}).values_list('id', flat=True)), {broken.id, fresh.id}
+        )
+
+
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        author = create_user()
+        author.middle_name = 'Петрович'
+        author.save()
+        create_user('other@example.com')
+        self.advertisements = create_advertisements(author, 3) + create_advertisements(
+            CustomUser.objects.get(email='other@example.com'), 2, status=AdvertisementStatus.PENDING, images=0
+        )
+        Advertisement.objects.filter(pk=self.advertisements[0].pk).update(price='1234567.5')
+        AdvertisementImage.objects.filter(advertisement=self.advertisements[0]).update(image='advertisements/фото 1.jpg')
+        AdvertisementImage.objects.filter(advertisement=self.advertisements[1]).update(variants={
+            'thumb': {'webp': 'advertisements/variants/a_thumb.webp', 'jpeg': 'advertisements/variants/a_thumb.jpeg'},
+        })
+
+    def assertSameJSON(self, request):
+        favorite_ids = {self.advertisements[1].id}
+        queryset = Advertisement.objects.order_by('-created_at', '-id')
+        expected = AdvertisementSerializer(
+            queryset.with_related(), many=True, context={'request': request, 'favorite_ids': favorite_ids}
+        ).data
+        actual = AdvertisementRowSerializer(request, favorite_ids).serialize(advertisement_rows(queryset))
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+    def test_matches_drf_serializer(self):
+        self.assertSameJSON(APIRequestFactory().get('/api/advertisements/', HTTP_HOST='example.com'))
+
+    def test_matches_drf_serializer_without_request(self):
+        self.assertSameJSON(None)
+
+    @override_settings(TIME_ZONE='Europe/Moscow')
+    def test_matches_drf_serializer_in_local_timezone(self):
+        self.assertSameJSON(None)
+
+
+class FastJSONTests(TestCase):
+    payload = {
+        'price': decimal.Decimal('1234.50'),
+        'created_at': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+        'local': datetime.datetime(2024, 5, 1, 15, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=3))),
+        'date': datetime.date(2024, 5, 1),
+        'time': datetime.time(12, 30),
+        'duration': datetime.timedelta(hours=1),
+        'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'lazy': gettext_lazy('Объявление'),
+        'separators': 'строка\u2028с\u2029разделителями',
+        'keys': {1: 'один', 2.5: 'два с половиной'},
+        'big': 2 ** 70,
+        'nested': [{'title': 'Объявление', 'tags': ('a', 'b'), 'empty': None, 'flag': True, 'ratio': 0.1}],
+    }
+
+    def test_renders_like_drf(self):
+        self.assertEqual(FastJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+
+    def test_indent_and_empty(self):
+        for media_type in ('application/json; indent=4', None):
+            self.assertEqual(
+                FastJSONRenderer().render(self.payload, media_type),
+                JSONRenderer().render(self.payload, media_type),
+            )
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_renders_without_orjson(self):
+        with mock.patch('api.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(b'{"a": [1]}')), {'a': [1]})
+
+    def test_parses_like_drf(self):
+        body = json.dumps({'title': 'Объявление', 'price': 10.5, 'images': [1, 2], 'empty': None}).encode()
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"title": '))
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"price": NaN}'))
+
+    def test_api_uses_fast_renderer(self):
+        create_advertisements(create_user(), 2)
+        response = APIClient().get(reverse('advertisement-list'))
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+
+class StreamingExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.moderator = create_user('moderator@example.com', Role.MODERATOR)
+        self.client.force_authenticate(self.moderator)
+
+    def stream(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    @override_settings(ADVERTISEMENTS_STREAM_CHUNK_SIZE=2)
+    def test_json_matches_list(self):
+        advertisements = create_advertisements(self.user, 5, status=AdvertisementStatus.PENDING)
+        FavoriteAdvertisement.objects.create(user=self.moderator, advertisement=advertisements[3])
+        url = reverse('moderator-advertisements')
+
+        response, content = self.stream(url, stream=1)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(content), self.client.get(url).json())
+        self.assertEqual(sum(item['is_favorite'] for item in json.loads(content)), 1)
+
+    @override_settings(ADVERTISEMENTS_STREAM_CHUNK_SIZE=2)
+    def test_ndjson(self):
+        create_advertisements(self.user, 3)
+        self.client.force_authenticate(self.user)
+        response, content = self.stream(reverse('user-advertisements'), stream='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = content.decode().splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines], ['Объявление 2', 'Объявление 1', 'Объявление 0'])
+
+    def test_empty(self):
+        _, content = self.stream(reverse('moderator-advertisements'), stream='json')
+        self.assertEqual(content, b'[]')
+
+    @override_settings(ADVERTISEMENTS_STREAM_CHUNK_SIZE=1000)
+    def test_memory_is_bounded(self):
+        count = 100000
+        # Одним INSERT ... SELECT: bulk_create на 100 тысяч строк заметно медленнее
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                INSERT INTO {Advertisement._meta.db_table}
+                    (title, description, price, status, created_at, updated_at, author_id, favorites_count)
+                WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < %s)
+                SELECT 'Объявление ' || i, 'Описание', i, %s, %s, %s, %s, 0 FROM seq
+                ''',
+                [count, AdvertisementStatus.PENDING, timezone.now(), timezone.now(), self.user.id],
+            )
+        response = self.client.get(reverse('moderator-advertisements'), {'stream': 'ndjson'})
+
+        lines = size = 0
+        tracemalloc.start()
+        try:
+            for part in response.streaming_content:
+                lines += part.count(b'\n')
+                size += len(part)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(lines, count)
+        # Выгрузка весит десятки мегабайт, а в памяти одновременно только одна пачка
+        self.assertGreater(size, 20 * 1024 * 1024)
+        self.assertLess(peak, 10 * 1024 * 1024)
+
+
+class BulkModerationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.moderator = create_user('moderator@example.com', Role.MODERATOR)
+        self.client.force_authenticate(self.moderator)
+        self.url = reverse('moderator-advertisements-bulk')
+
+    def moderate(self, decisions):
+        return self.client.post(self.url, {'decisions': decisions}, format='json')
+
+    def test_applies_decisions(self):
+        advertisements = create_advertisements(self.user, 3, status=AdvertisementStatus.PENDING, images=0)
+        updated_at = advertisements[0].updated_at
+        missing = advertisements[-1].id + 100
+
+        response = self.moderate([
+            {'id': advertisements[0].id, 'status': 'active'},
+            {'id': advertisements[1].id, 'status': 'rejected'},
+            {'id': missing, 'status': 'active'},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'results': [
+            {'id': advertisements[0].id, 'status': 'active'},
+            {'id': advertisements[1].id, 'status': 'rejected'},
+            {'id': missing, 'error': 'not_found'},
+        ]})
+        statuses = dict(Advertisement.objects.values_list('id', 'status'))
+        self.assertEqual(
+            [statuses[advertisement.id] for advertisement in advertisements],
+            ['active', 'rejected', 'pending'],
+        )
+        self.assertGreater(Advertisement.objects.get(id=advertisements[0].id).updated_at, updated_at)
+
+    def test_queries_do_not_depend_on_size(self):
+        for count in (2, 40):
+            advertisements = create_advertisements(self.user, count, status=AdvertisementStatus.PENDING, images=0)
+            decisions = [
+                {'id': advertisement.id, 'status': 'active' if i % 2 else 'rejected'}
+                for i, advertisement in enumerate(advertisements)
+            ]
+            # Один SELECT и по одному UPDATE на каждый из двух статусов при любом числе решений
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.moderate(decisions).status_code, 200)
+            if count == 2:
+                expected = len(queries)
+            self.assertEqual(len(queries), expected)
+
+    @override_settings(USE_YMQ=True)
+    def test_events_and_cache_in_batch(self):
+        advertisements = create_advertisements(self.user, 3, status=AdvertisementStatus.PENDING, images=0)
+        with mock.patch('api.publisher.publisher') as publisher, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.moderate([{'id': advertisement.id, 'status': 'active'} for advertisement in advertisements])
+
+        # Одна запись в outbox на объявление, один колбэк публикации и один сброс версии кеша
+        self.assertEqual(len(callbacks), 2)
+        events = list(OutboxEvent.objects.order_by('id'))
+        self.assertEqual([event.event_type for event in events], ['advertisement.moderated'] * 3)
+        self.assertEqual([event.payload['status'] for event in events], ['active'] * 3)
+        self.assertEqual(events[0].payload['author'], self.user.email)
+        self.assertEqual(publisher.enqueue.call_count, 3)
+
+    def test_validation(self):
+        advertisement = create_advertisements(self.user, 1, status=AdvertisementStatus.PENDING, images=0)[0]
+        for decisions in (
+            [],
+            [{'id': advertisement.id, 'status': 'pending'}],
+            [{'id': advertisement.id, 'status': 'active'}, {'id': advertisement.id, 'status': 'rejected'}],
+        ):
+            self.assertEqual(self.moderate(decisions).status_code, 400)
+        self.assertEqual(Advertisement.objects.get(id=advertisement.id).status, AdvertisementStatus.PENDING)
+
+    def test_requires_moderator(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.moderate([{'id': 1, 'status': 'active'}]).status_code, 403)
+
+
+class ModerationLeaseTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.first = create_user('first@example.com', Role.MODERATOR)
+        self.second = create_user('second@example.com', Role.MODERATOR)
+        self.advertisements = create_advertisements(self.user, 5, status=AdvertisementStatus.PENDING, images=0)
+        self.url = reverse('moderator-advertisements-claim')
+
+    def claim(self, moderator, count):
+        self.client.force_authenticate(moderator)
+        response = self.client.post(self.url, {'count': count}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_moderators_get_disjoint_oldest_first(self):
+        first = self.claim(self.first, 2)
+        second = self.claim(self.second, 2)
+        self.assertEqual(first + second, [advertisement.id for advertisement in self.advertisements[:4]])
+        self.assertEqual(self.claim(self.first, 10), [self.advertisements[4].id])
+        self.assertEqual(self.claim(self.second, 10), [])
+
+    def test_expired_leases_are_claimable_and_released(self):
+        ids = self.claim(self.first, 2)
+        Advertisement.objects.filter(id__in=ids).update(lease_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.claim(self.second, 2), ids)
+
+        Advertisement.objects.filter(id__in=ids).update(lease_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(release_expired_leases(), 2)
+        self.assertFalse(Advertisement.objects.filter(lease_owner__isnull=False).exists())
+
+    def test_leased_advertisement_is_protected(self):
+        leased = self.claim(self.first, 1)[0]
+
+        self.client.force_authenticate(self.second)
+        url = reverse('moderator-advertisement-detail', args=[leased])
+        self.assertEqual(self.client.post(url, {'status': 'active'}, format='json').status_code, 409)
+        response = self.client.post(
+            reverse('moderator-advertisements-bulk'), {'decisions': [{'id': leased, 'status': 'active'}]}, format='json'
+        )
+        self.assertEqual(response.json()['results'], [{'id': leased, 'error': 'leased'}])
+
+        self.client.force_authenticate(self.first)
+        self.assertEqual(self.client.post(url, {'status': 'active'}, format='json').status_code, 200)
+        advertisement = Advertisement.objects.get(id=leased)
+        self.assertEqual(advertisement.status, AdvertisementStatus.ACTIVE)
+        self.assertIsNone(advertisement.lease_owner_id)
+
+    def test_release(self):
+        ids = self.claim(self.first, 3)
+        self.client.force_authenticate(self.second)
+        self.assertEqual(self.client.delete(self.url, {'ids': ids}, format='json').json(), {'released': 0})
+        self.client.force_authenticate(self.first)
+        self.assertEqual(self.client.delete(self.url, {'ids': ids[:2]}, format='json').json(), {'released': 2})
+        self.assertEqual(self.claim(self.second, 2), ids[:2])
+
+
+class CounterTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.moderator = create_user('moderator@example.com', Role.MODERATOR)
+
+    def counters(self, user):
+        user.refresh_from_db()
+        return (user.pending_advertisements_count, user.active_advertisements_count, user.rejected_advertisements_count)
+
+    def test_status_counters_follow_lifecycle(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            reverse('advertisement-create'), {'title': 'Велосипед', 'description': 'Новый', 'price': '10.00'}
+        )
+        pk = response.json()['id']
+        self.assertEqual(self.counters(self.user), (1, 0, 0))
+
+        self.client.force_authenticate(self.moderator)
+        self.client.post(reverse('moderator-advertisement-detail', args=[pk]), {'status': 'active'}, format='json')
+        self.assertEqual(self.counters(self.user), (0, 1, 0))
+
+        self.client.force_authenticate(self.user)
+        self.client.put(reverse('advertisement-detail', args=[pk]), {'title': 'Самокат'})
+        self.assertEqual(self.counters(self.user), (1, 0, 0))
+        self.assertEqual(self.client.get(reverse('user-profile')).json()['pending_advertisements_count'], 1)
+
+        self.client.delete(reverse('advertisement-detail', args=[pk]))
+        self.assertEqual(self.counters(self.user), (0, 0, 0))
+
+    def test_bulk_moderation_updates_all_authors(self):
+        other = create_user('other@example.com')
+        advertisements = []
+        for author in (self.user, other):
+            self.client.force_authenticate(author)
+            for title in ('Первое', 'Второе'):
+                response = self.client.post(
+                    reverse('advertisement-create'), {'title': title, 'description': 'Описание', 'price': '1.00'}
+                )
+                advertisements.append(response.json()['id'])
+
+        self.client.force_authenticate(self.moderator)
+        self.client.post(reverse('moderator-advertisements-bulk'), {'decisions': [
+            {'id': advertisements[0], 'status': 'active'},
+            {'id': advertisements[1], 'status': 'rejected'},
+            {'id': advertisements[2], 'status': 'active'},
+        ]}, format='json')
+        self.assertEqual(self.counters(self.user), (0, 1, 1))
+        self.assertEqual(self.counters(other), (1, 1, 0))
+
+    def test_favorites_count(self):
+        advertisement = create_advertisements(self.user, 1)[0]
+        url = reverse('favorite-advertisement-detail', args=[advertisement.pk])
+        for user in (self.user, self.moderator):
+            self.client.force_authenticate(user)
+            response = self.client.post(url)
+        self.assertEqual(response.json()['favorites_count'], 2)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.json()['favorites_count'], 1)
+        advertisement.refresh_from_db()
+        self.assertEqual(advertisement.favorites_count, 1)
+        feed = self.client.get(reverse('advertisement-list')).json()
+        self.assertEqual(feed[0]['favorites_count'], 1)
+
+    def test_stale_reads_do_not_repeat_transitions(self):
+        advertisement = create_advertisements(self.user, 1, status=AdvertisementStatus.PENDING, images=0)[0]
+        adjust_status_counters([(self.user.id, None, AdvertisementStatus.PENDING)])
+        url = reverse('moderator-advertisement-detail', args=[advertisement.pk])
+
+        def stale_read(stale):
+            # Запрос прочитал объявление до того, как параллельный запрос его изменил
+            return mock.patch('api.views.get_object_or_404', return_value=stale)
+
+        # Два модератора одобряют одно объявление: второй видит устаревший pending
+        stale = Advertisement.objects.get(pk=advertisement.pk)
+        self.client.force_authenticate(self.moderator)
+        self.client.post(url, {'status': 'active'}, format='json')
+        with stale_read(stale):
+            self.client.post(url, {'status': 'active'}, format='json')
+        self.assertEqual(self.counters(self.user), (0, 1, 0))
+
+        # Модератор отклоняет, пока автор редактирует: правка переносит из rejected, а не из active
+        stale = Advertisement.objects.get(pk=advertisement.pk)
+        self.client.post(url, {'status': 'rejected'}, format='json')
+        self.client.force_authenticate(self.user)
+        with stale_read(stale):
+            self.client.put(reverse('advertisement-detail', args=[advertisement.pk]), {'title': 'Самокат'})
+        self.assertEqual(self.counters(self.user), (1, 0, 0))
+
+        # Модератор одобряет, пока автор удаляет
+        stale = Advertisement.objects.get(pk=advertisement.pk)
+        self.client.force_authenticate(self.moderator)
+        self.client.post(url, {'status': 'active'}, format='json')
+        self.client.force_authenticate(self.user)
+        with stale_read(stale):
+            response = self.client.delete(reverse('advertisement-detail', args=[advertisement.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counters(self.user), (0, 0, 0))
+
+        # Объявление удалено, пока шла модерация
+        with stale_read(stale):
+            self.client.force_authenticate(self.moderator)
+            response = self.client.post(url, {'status': 'active'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.counters(self.user), (0, 0, 0))
+
+    def test_edit_and_moderation_keep_concurrent_favorites(self):
+        advertisement = create_advertisements(self.user, 1, status=AdvertisementStatus.PENDING, images=0)[0]
+        stale = Advertisement.objects.get(pk=advertisement.pk)
+        # Избранное добавлено, пока правка и модерация шли с объектом без него
+        add_favorite(self.moderator.id, advertisement.pk)
+
+        self.client.force_authenticate(self.user)
+        with mock.patch('api.views.get_object_or_404', return_value=stale):
+            response = self.client.put(reverse('advertisement-detail', args=[advertisement.pk]), {'title': 'Самокат'})
+        self.assertEqual(response.json()['favorites_count'], 1)
+        stale.refresh_from_db()
+        stale.favorites_count = 0
+        self.client.force_authenticate(self.moderator)
+        with mock.patch('api.views.get_object_or_404', return_value=stale):
+            self.client.post(
+                reverse('moderator-advertisement-detail', args=[advertisement.pk]), {'status': 'active'}, format='json'
+            )
+
+        advertisement.refresh_from_db()
+        self.assertEqual((advertisement.title, advertisement.status), ('Самокат', AdvertisementStatus.ACTIVE))
+        self.assertEqual(advertisement.favorites_count, 1)
+
+    def test_profile_update_keeps_status_counters(self):
+        self.client.force_authenticate(self.user)
+        with mock.patch('api.views.get_db_user', return_value=CustomUser.objects.get(pk=self.user.pk)):
+            # Объявление создано, пока профиль шёл со старыми счётчиками
+            adjust_status_counters([(self.user.id, None, AdvertisementStatus.PENDING)])
+            self.client.put(reverse('user-profile'), {'first_name': 'Пётр'})
+        self.assertEqual(self.counters(self.user), (1, 0, 0))
+        self.assertEqual(self.user.first_name, 'Пётр')
+
+    def test_counters_do_not_go_negative(self):
+        adjust_status_counters([(self.user.id, AdvertisementStatus.ACTIVE, None)])
+        self.assertEqual(self.counters(self.user), (0, 0, 0))
+
+    def test_reconcile(self):
+        advertisements = create_advertisements(self.user, 3, images=0)
+        create_advertisements(self.user, 2, status=AdvertisementStatus.PENDING, images=0)
+        FavoriteAdvertisement.objects.create(user=self.moderator, advertisement=advertisements[0])
+        Advertisement.objects.filter(pk=advertisements[1].pk).update(favorites_count=7)
+
+        out = io.StringIO()
+        call_command('reconcile_counters', batch_size=2, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Исправлено объявлений: 2, пользователей: 1')
+        self.assertEqual(
+            dict(Advertisement.objects.filter(favorites_count__gt=0).values_list('id', 'favorites_count')),
+            {advertisements[0].id: 1},
+        )
+        self.assertEqual(self.counters(self.user), (2, 3, 0))
+        self.assertEqual(self.counters(self.moderator), (0, 0, 0))
+
+
+class FavoriteToggleTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.advertisement = create_advertisements(self.user, 1)[0]
+        self.url = reverse('advertisement-favorite', args=[self.advertisement.pk])
+        self.client.force_authenticate(self.user)
+
+    def statements(self, queries):
+        return [q['sql'] for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+
+    def favorites_count(self):
+        self.advertisement.refresh_from_db()
+        return self.advertisement.favorites_count
+
+    def test_put_is_idempotent(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(self.url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'id': self.advertisement.pk, 'is_favorite': True})
+        # Без предварительных SELECT: вставка и счётчик
+        statements = self.statements(queries)
+        self.assertTrue(statements[0].lstrip().startswith('INSERT'))
+        self.assertLessEqual(len(statements), 2)
+
+        response = self.client.put(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(FavoriteAdvertisement.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.favorites_count(), 1)
+
+    def test_delete_is_idempotent(self):
+        self.client.put(self.url)
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete(self.url)
+            self.assertEqual(response.json(), {'id': self.advertisement.pk, 'is_favorite': False})
+            self.assertTrue(self.statements(queries)[0].startswith('DELETE'))
+        self.assertFalse(FavoriteAdvertisement.objects.exists())
+        self.assertEqual(self.favorites_count(), 0)
+
+    def test_missing_advertisement(self):
+        url = reverse('advertisement-favorite', args=[self.advertisement.pk + 1])
+        self.assertEqual(self.client.put(url).status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 200)
+
+    def test_legacy_endpoints(self):
+        url = reverse('favorite-advertisement-detail', args=[self.advertisement.pk])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['is_favorite'])
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.client.post(reverse('favorite-advertisement-detail', args=[0])).status_code, 404)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['favorites_count'], 0)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+
+class FavoriteListTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        author = create_user('author@example.com')
+        active = create_advertisements(author, 3, images=1)
+        pending = create_advertisements(author, 2, status=AdvertisementStatus.PENDING, images=0)
+        create_advertisements(author, 2, images=0)
+        # Добавлены в избранное в порядке, обратном созданию объявлений
+        self.favorites = [*reversed(active), *pending]
+        added_at = timezone.now()
+        for i, advertisement in enumerate(self.favorites):
+            favorite = FavoriteAdvertisement.objects.create(user=self.user, advertisement=advertisement)
+            # Одинаковое время у соседних записей проверяет разрешение равенств в курсоре
+            FavoriteAdvertisement.objects.filter(pk=favorite.pk).update(
+                created_at=added_at + datetime.timedelta(seconds=i // 2)
+            )
+        self.url = reverse('favorite-advertisements')
+        self.client.force_authenticate(self.user)
+
+    def test_pages_ordered_by_favorite_date(self):
+        expected = [advertisement.pk for advertisement in sorted(
+            self.favorites, key=lambda a: (self.favorites.index(a) // 2, a.pk), reverse=True
+        )]
+        ids, url, params = [], self.url, {'page_size': 2}
+        while url:
+            # Страница, изображения и COUNT для X-Total-Count
+            with self.assertNumQueries(3):
+                response = self.client.get(url, params)
+            data = response.json()
+            self.assertEqual(response['X-Total-Count'], str(len(expected)))
+            self.assertTrue(all(item['is_favorite'] for item in data['results']))
+            ids += [item['id'] for item in data['results']]
+            url, params = data['next'], None
+        self.assertEqual(ids, expected)
+        # Без параметров пагинации - полный список, как раньше
+        self.assertEqual([item['id'] for item in self.client.get(self.url).json()], expected)
+
+    def test_status_filter(self):
+        response = self.client.get(self.url, {'status': AdvertisementStatus.ACTIVE})
+        self.assertEqual(
+            {item['id'] for item in response.json()},
+            {advertisement.pk for advertisement in self.favorites[:3]},
+        )
+        self.assertEqual(self.client.get(self.url, {'status': 'unknown'}).status_code, 400)
+
+    def test_only_own_favorites(self):
+        self.client.force_authenticate(create_user('other@example.com'))
+        self.assertEqual(self.client.get(self.url).json(), [])
+
+
+class FavoriteStatusTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.advertisements = create_advertisements(self.user, 4)
+        for advertisement in self.advertisements[:2]:
+            FavoriteAdvertisement.objects.create(user=self.user, advertisement=advertisement)
+        self.url = reverse('favorite-advertisements-status')
+        self.client.force_authenticate(self.user)
+
+    def status(self, ids):
+        response = self.client.post(self.url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['ids']
+
+    def test_returns_favorited_subset(self):
+        ids = [advertisement.pk for advertisement in reversed(self.advertisements)]
+        with self.assertNumQueries(1):
+            self.assertEqual(self.status(ids + [ids[0] + 1]), ids[2:])
+        # Повторный запрос обслуживается из кеша
+        with self.assertNumQueries(0):
+            self.assertEqual(self.status(ids[:3]), ids[2:3])
+        self.assertEqual(self.status([]), [])
+
+    def test_validation(self):
+        for ids in (None, ['x'], [0], list(range(1, settings.FAVORITES_STATUS_MAX_IDS + 2))):
+            response = self.client.post(self.url, {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(self.url, {'ids': [1]}, format='json').status_code, 401)
+
+    def test_invalidated_on_change(self):
+        first, second, third, _ = (advertisement.pk for advertisement in self.advertisements)
+        self.assertEqual(self.status([first, second, third]), [first, second])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse('advertisement-favorite', args=[third]))
+        self.assertEqual(self.status([first, second, third]), [first, second, third])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('favorite-advertisement-detail', args=[first]))
+        self.assertEqual(self.status([first, second, third]), [second, third])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('advertisement-detail', args=[second]))
+        self.assertEqual(self.status([first, second, third]), [third])
+
+    def test_feed_uses_cached_set(self):
+        self.status([self.advertisements[0].pk])
+        response = self.client.get(reverse('advertisement-detail', args=[self.advertisements[0].pk]))
+        self.assertTrue(response.json()['is_favorite'])
+        # Карточка уже в кеше, множество избранного тоже: остаётся только запрос метаданных для ETag
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('advertisement-detail', args=[self.advertisements[0].pk]))
+        self.assertTrue(response.json()['is_favorite'])
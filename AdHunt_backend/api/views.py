@@ -1,3 +1,8 @@
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 
 from rest_framework import status, permissions
@@ -13,12 +18,28 @@ from rest_framework import serializers
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-import boto3
-import os
-import json
+from .pagination import KeysetPagination
+from .search import search_advertisements, supports_relevance
+from .cache import (
+    bump_advertisements_version, feed_cache_key, detail_cache_key, get_or_build, get_or_build_with_validators,
+    get_validators,
+)
+from .conditional import advertisement_metadata, make_etag, not_modified, set_validators
+from .publisher import notify_queue, notify_queue_many
+from .authentication import get_db_user
+from .images import uploaded_images, create_advertisement_images, schedule_image_processing
+from .fast_serializers import AdvertisementRowSerializer, advertisement_rows
+from .renderers import FastJSONRenderer
+from .moderation import claim_advertisements, is_leased_by_other, release_leases
+from .counters import adjust_status_counters, lock_current
+from .facets import facet_counts
+from .counting import count_advertisements
+from .favorites import add_favorite, get_user_favorite_ids, invalidate_favorite_ids, remove_favorite
 
 class RegisterSerializer(ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, style={'input_type': 'password'})
@@ -52,10 +73,21 @@ class RegisterSerializer(ModelSerializer):
         return user
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = [
+            'id', 'email', 'last_name', 'first_name', 'middle_name', 'phone_number', 'role',
+            'pending_advertisements_count', 'active_advertisements_count', 'rejected_advertisements_count'
+        ]
+        read_only_fields = [
+            'role', 'pending_advertisements_count', 'active_advertisements_count', 'rejected_advertisements_count'
+        ]
+
+class AuthorSerializer(serializers.ModelSerializer):
+    # Автор в объявлении, без счётчиков профиля
     class Meta:
         model = CustomUser
         fields = ['id', 'email', 'last_name', 'first_name', 'middle_name', 'phone_number', 'role']
-        read_only_fields = ['role']
 
 class UserProfileUpdateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -72,6 +104,13 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Пользователь с таким номером телефона уже существует")
         return value
 
+    def update(self, instance, validated_data):
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        # Счётчики объявлений меняются UPDATE-ами из других запросов, полный save() вернул бы старые значения
+        instance.save(update_fields=list(validated_data))
+        return instance
+
 class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -82,7 +121,8 @@ class UserProfileView(APIView):
         operation_description="Получение профиля пользователя"
     )
     def get(self, request):
-        serializer = UserProfileSerializer(request.user)
+        # Профиль целиком из БД: claims токена могли устареть после изменения профиля
+        serializer = UserProfileSerializer(get_db_user(request.user))
         return Response(serializer.data)
 
     @swagger_auto_schema(
@@ -94,10 +134,11 @@ class UserProfileView(APIView):
         operation_description="Обновление профиля пользователя"
     )
     def put(self, request):
-        serializer = UserProfileUpdateSerializer(request.user, data=request.data, partial=True)
+        user = get_db_user(request.user)
+        serializer = UserProfileUpdateSerializer(user, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
-            return Response(UserProfileSerializer(request.user).data)
+            return Response(UserProfileSerializer(user).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -108,6 +149,8 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         token = super().get_token(user)
         # Добавляем роль пользователя в токен
         token['role'] = user.role
+        # email - для клиента; сервер читает его из БД, т.к. он меняется в профиле
+        token['email'] = user.email
         return token
 
     def validate(self, attrs):
@@ -181,25 +224,325 @@ class CustomTokenObtainPairView(TokenObtainPairView):
         return super().post(request, *args, **kwargs)
 
 class AdvertisementImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = AdvertisementImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants']
+
+    def get_variants(self, obj):
+        storage = obj.image.storage
+        request = self.context.get('request')
+        variants = {}
+        for name, files in obj.variants.items():
+            variants[name] = {}
+            for extension, path in files.items():
+                url = storage.url(path)
+                variants[name][extension] = request.build_absolute_uri(url) if request else url
+        return variants
 
 class AdvertisementSerializer(serializers.ModelSerializer):
     images = AdvertisementImageSerializer(many=True, read_only=True)
-    author = UserProfileSerializer(read_only=True)
+    author = AuthorSerializer(read_only=True)
     is_favorite = serializers.SerializerMethodField()
 
     class Meta:
         model = Advertisement
-        fields = ['id', 'title', 'description', 'price', 'status', 'created_at', 'updated_at', 'author', 'images', 'is_favorite']
+        fields = [
+            'id', 'title', 'description', 'price', 'status', 'created_at', 'updated_at', 'author', 'images',
+            'is_favorite', 'favorites_count'
+        ]
 
     def get_is_favorite(self, obj):
+        # Для списков избранное загружается одним запросом и передаётся через контекст
+        favorite_ids = self.context.get('favorite_ids')
+        if favorite_ids is not None:
+            return obj.id in favorite_ids
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return FavoriteAdvertisement.objects.filter(user=request.user, advertisement=obj).exists()
+            return FavoriteAdvertisement.objects.filter(user_id=request.user.id, advertisement=obj).exists()
         return False
 
+def get_favorite_ids(request, ids):
+    if not request.user.is_authenticated:
+        return set()
+    if not ids:
+        return set()
+    return get_user_favorite_ids(request.user.id).intersection(ids)
+
+PAGINATION_PARAMETERS = [
+    openapi.Parameter(
+        'cursor',
+        openapi.IN_QUERY,
+        description='Курсор следующей страницы (из поля next)',
+        type=openapi.TYPE_STRING,
+        required=False
+    ),
+    openapi.Parameter(
+        'page_size',
+        openapi.IN_QUERY,
+        description='Размер страницы. Без cursor и page_size возвращается полный список',
+        type=openapi.TYPE_INTEGER,
+        required=False
+    ),
+]
+
+FILTER_PARAMETERS = [
+    openapi.Parameter(
+        'price_min',
+        openapi.IN_QUERY,
+        description='Цена от (включительно)',
+        type=openapi.TYPE_NUMBER,
+        required=False
+    ),
+    openapi.Parameter(
+        'price_max',
+        openapi.IN_QUERY,
+        description='Цена до (включительно)',
+        type=openapi.TYPE_NUMBER,
+        required=False
+    ),
+    openapi.Parameter(
+        'created_after',
+        openapi.IN_QUERY,
+        description='Создано не раньше (ISO 8601)',
+        type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATETIME,
+        required=False
+    ),
+    openapi.Parameter(
+        'created_before',
+        openapi.IN_QUERY,
+        description='Создано раньше (ISO 8601, не включительно)',
+        type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATETIME,
+        required=False
+    ),
+    openapi.Parameter(
+        'author_id',
+        openapi.IN_QUERY,
+        description='id автора',
+        type=openapi.TYPE_INTEGER,
+        required=False
+    ),
+    openapi.Parameter(
+        'has_images',
+        openapi.IN_QUERY,
+        description='true - только с изображениями, false - только без',
+        type=openapi.TYPE_BOOLEAN,
+        required=False
+    ),
+]
+
+class AdvertisementFilterSerializer(serializers.Serializer):
+    price_min = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal(0), required=False)
+    price_max = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal(0), required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    author_id = serializers.IntegerField(min_value=1, required=False)
+    has_images = serializers.BooleanField(required=False)
+
+    def validate(self, data):
+        if 'price_min' in data and 'price_max' in data and data['price_min'] > data['price_max']:
+            raise serializers.ValidationError({'price_max': 'Должна быть не меньше price_min'})
+        if 'created_after' in data and 'created_before' in data and data['created_after'] >= data['created_before']:
+            raise serializers.ValidationError({'created_before': 'Должна быть позже created_after'})
+        return data
+
+def filter_advertisements(queryset, filters):
+    # Каждому фильтру соответствует индекс: цена - ad_status_price_idx, дата - ad_status_created_idx,
+    # автор - ad_author_created_idx и ad_author_price_idx, изображения - индекс внешнего ключа
+    lookups = {
+        'price_min': 'price__gte',
+        'price_max': 'price__lte',
+        'created_after': 'created_at__gte',
+        'created_before': 'created_at__lt',
+        'author_id': 'author_id',
+    }
+    queryset = queryset.filter(**{lookups[name]: value for name, value in filters.items() if name in lookups})
+    if 'has_images' in filters:
+        has_images = Exists(AdvertisementImage.objects.filter(advertisement=OuterRef('pk')))
+        queryset = queryset.filter(has_images if filters['has_images'] else ~has_images)
+    return queryset
+
+def parse_advertisement_filters(request):
+    # dict(), а не QueryDict: иначе отсутствующий has_images читается как false
+    serializer = AdvertisementFilterSerializer(data=request.query_params.dict())
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+class AllFavorites:
+    # Для списка избранного: каждое объявление в нём по определению избранное, проверять нечего
+    def __contains__(self, advertisement_id):
+        return True
+
+def serialize_advertisements(request, advertisements, favorite_ids=None):
+    advertisements = list(advertisements)
+    if favorite_ids is None:
+        favorite_ids = get_favorite_ids(request, [advertisement.id for advertisement in advertisements])
+    serializer = AdvertisementSerializer(
+        advertisements, many=True, context={'request': request, 'favorite_ids': favorite_ids}
+    )
+    return serializer.data
+
+def serialize_advertisement_rows(request, rows, favorite_ids=None):
+    rows = list(rows)
+    if favorite_ids is None:
+        favorite_ids = get_favorite_ids(request, [row['id'] for row in rows])
+    return AdvertisementRowSerializer(request, favorite_ids).serialize(rows)
+
+def build_advertisements_data(request, advertisements, paginator=None, favorite_ids=None):
+    # Списки идут через быстрый сериализатор по .values(), поле сортировки нужно курсору
+    paginator = paginator or KeysetPagination()
+    rows = advertisement_rows(advertisements, paginator.field, paginator.pk_field)
+    page = paginator.paginate_queryset(rows, request)
+    if page is not None:
+        return paginator.get_paginated_data(serialize_advertisement_rows(request, page, favorite_ids))
+    return serialize_advertisement_rows(request, rows, favorite_ids)
+
+COUNT_PARAMETER = openapi.Parameter(
+    'exact_count',
+    openapi.IN_QUERY,
+    description='true - точное число в X-Total-Count (с ограничением по времени) вместо оценки для больших списков',
+    type=openapi.TYPE_BOOLEAN,
+    required=False
+)
+
+def wants_exact_count(request):
+    return request.query_params.get('exact_count', '').lower() in ('1', 'true')
+
+def list_total_count(request, advertisements, data):
+    # Полный список уже загружен, для страницы число считается отдельно
+    if isinstance(data, dict):
+        return count_advertisements(advertisements, exact=wants_exact_count(request))
+    return len(data), True
+
+def set_total_count(response, count, exact):
+    response['X-Total-Count'] = count
+    response['X-Total-Count-Exact'] = 'true' if exact else 'false'
+    return response
+
+STREAM_PARAMETER = openapi.Parameter(
+    'stream',
+    openapi.IN_QUERY,
+    description='Потоковая выгрузка всего списка: 1 или json - JSON-массив, ndjson - по объекту на строку',
+    type=openapi.TYPE_STRING,
+    required=False
+)
+
+STREAM_FORMATS = {
+    '1': 'application/json',
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+def iter_advertisement_chunks(request, advertisements, chunk_size):
+    # Строки читаются курсором, изображения и избранное подгружаются на каждую пачку
+    rows = advertisement_rows(advertisements).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield serialize_advertisement_rows(request, chunk)
+
+def stream_advertisements(request, advertisements, ndjson=False):
+    renderer = FastJSONRenderer()
+    chunks = iter_advertisement_chunks(request, advertisements, settings.ADVERTISEMENTS_STREAM_CHUNK_SIZE)
+    if ndjson:
+        for chunk in chunks:
+            yield b''.join(renderer.render(item) + b'\n' for item in chunk)
+        return
+    # Пачка рендерится как массив целиком, от неё берётся содержимое без скобок
+    separator = b'['
+    for chunk in chunks:
+        yield separator + renderer.render(chunk)[1:-1]
+        separator = b','
+    yield b'[]' if separator == b'[' else b']'
+
+def advertisements_response(request, advertisements, paginator=None):
+    stream = request.query_params.get('stream')
+    if stream in STREAM_FORMATS:
+        # Без пагинации и кеша: память не растёт с размером выгрузки
+        content_type = STREAM_FORMATS[stream]
+        advertisements = advertisements.order_by('-created_at', '-id')
+        return StreamingHttpResponse(
+            stream_advertisements(request, advertisements, ndjson=content_type == 'application/x-ndjson'),
+            content_type=content_type,
+        )
+    data = build_advertisements_data(request, advertisements, paginator)
+    return set_total_count(Response(data), *list_total_count(request, advertisements, data))
+
+def search_and_filter(request, advertisements):
+    """Поиск и фильтры ленты: (queryset, строка поиска, проверенные фильтры)."""
+    filters = parse_advertisement_filters(request)
+    advertisements = filter_advertisements(advertisements, filters)
+
+    # Поиск по названию и описанию
+    search_query = request.query_params.get('search', '')
+    if search_query:
+        advertisements = search_advertisements(advertisements, search_query)
+    return advertisements, search_query, filters
+
+def feed_query(request):
+    """
+    Разбирает параметры ленты: (queryset, пагинатор, параметры для ключа кеша).
+    Неверные фильтры - ValidationError (400).
+    """
+    advertisements, search_query, filters = search_and_filter(
+        request, Advertisement.objects.filter(status=AdvertisementStatus.ACTIVE)
+    )
+
+    # Сортировка
+    sort_by = request.query_params.get('sort_by', 'created_at')
+    order = request.query_params.get('order', 'desc')
+
+    if sort_by not in ['created_at', 'price', 'relevance']:
+        sort_by = 'created_at'
+    if order not in ['asc', 'desc']:
+        order = 'desc'
+    # Релевантность есть только у полнотекстового поиска
+    if sort_by == 'relevance':
+        sort_by = 'rank' if search_query and supports_relevance() else 'created_at'
+
+    paginator = KeysetPagination(sort_by, descending=order == 'desc')
+    advertisements = advertisements.order_by(*paginator.ordering).with_related()
+    params = {
+        # Ссылка next в ответе ведёт на тот же путь, синхронный или асинхронный
+        'path': request.path,
+        'search': search_query,
+        'sort_by': sort_by,
+        'order': order,
+        'filters': filters,
+        'paginated': paginator.is_enabled(request),
+        'page_size': paginator.get_page_size(request),
+        'cursor': request.query_params.get(paginator.cursor_query_param),
+    }
+    return advertisements, paginator, params
+
+def feed_count_params(request, params):
+    # Число не зависит от сортировки и страницы, одно значение на все страницы выдачи
+    return {
+        'path': params['path'],
+        'search': params['search'],
+        'filters': params['filters'],
+        'count': 'exact' if wants_exact_count(request) else 'approximate',
+    }
+
+def feed_item_ids(data):
+    return [item['id'] for item in (data['results'] if isinstance(data, dict) else data)]
+
+def feed_validators(request, validators):
+    # Тело в кеше общее, в ETag добавляется избранное пользователя среди объявлений ответа.
+    # Last-Modified - время сборки тела: изменения is_favorite видит только If-None-Match
+    digest, built_at, ids = validators
+    return make_etag(digest, sorted(get_favorite_ids(request, ids))), built_at
+
+def overlay_favorites(request, items):
+    # Закешированный ответ общий для всех, is_favorite проставляется уже для конкретного пользователя
+    favorite_ids = get_favorite_ids(request, [item['id'] for item in items])
+    for item in items:
+        item['is_favorite'] = item['id'] in favorite_ids
+
 class AdvertisementUpdateSerializer(serializers.ModelSerializer):
     images = serializers.ListField(
         child=serializers.ImageField(),
@@ -220,27 +563,30 @@ class AdvertisementUpdateSerializer(serializers.ModelSerializer):
         images = validated_data.pop('images', [])
         deleted_images = validated_data.pop('deleted_images', [])
         
-        # Обновляем основные поля
-        instance.title = validated_data.get('title', instance.title)
-        instance.description = validated_data.get('description', instance.description)
-        instance.price = validated_data.get('price', instance.price)
-        instance.status = AdvertisementStatus.PENDING
-        instance.save()
-
-        # Удаляем указанные изображения
-        if deleted_images:
-            AdvertisementImage.objects.filter(
-                id__in=deleted_images,
-                advertisement=instance
-            ).delete()
-
-        # Добавляем новые изображения
-        if images:
-            for image in images:
-                AdvertisementImage.objects.create(
-                    advertisement=instance,
-                    image=image
-                )
+        # Файлы загружаются до транзакции; если она не прошла, загруженное удаляется
+        with uploaded_images(images) as image_names, transaction.atomic():
+            if not lock_current(instance):
+                raise Http404
+            # Обновляем основные поля
+            instance.title = validated_data.get('title', instance.title)
+            instance.description = validated_data.get('description', instance.description)
+            instance.price = validated_data.get('price', instance.price)
+            adjust_status_counters([(instance.author_id, instance.status, AdvertisementStatus.PENDING)])
+            instance.status = AdvertisementStatus.PENDING
+            # Только изменённые поля: favorites_count меняется через F() в параллельных запросах
+            instance.save(update_fields=['title', 'description', 'price', 'status', 'updated_at'])
+            notify_queue(instance, 'advertisement.updated')
+            bump_advertisements_version()
+
+            # Удаляем указанные изображения
+            if deleted_images:
+                AdvertisementImage.objects.filter(
+                    id__in=deleted_images,
+                    advertisement=instance
+                ).delete()
+
+            # Добавляем новые изображения
+            schedule_image_processing(create_advertisement_images(instance, image_names))
 
         return instance
 
@@ -257,69 +603,20 @@ class AdvertisementCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         images = validated_data.pop('images', [])
-        advertisement = Advertisement.objects.create(
-            **validated_data,
-            author=self.context['request'].user,
-            status=AdvertisementStatus.PENDING
-        )
-        
-        for image in images:
-            AdvertisementImage.objects.create(
-                advertisement=advertisement,
-                image=image
+        with uploaded_images(images) as image_names, transaction.atomic():
+            advertisement = Advertisement.objects.create(
+                **validated_data,
+                author_id=self.context['request'].user.id,
+                status=AdvertisementStatus.PENDING
             )
+            adjust_status_counters([(advertisement.author_id, None, advertisement.status)])
+            schedule_image_processing(create_advertisement_images(advertisement, image_names))
 
-        notify_queue(advertisement)
+            notify_queue(advertisement)
+            bump_advertisements_version()
         
         return advertisement
 
-def notify_queue(advertisement):
-    if os.getenv("USE_YMQ") != "True":
-        print("YMQ отключен (USE_YMQ != True)")
-        return
-
-    try:
-        aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
-        aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-        queue_url = os.getenv("YMQ_ADS_QUEUE_URL")
-
-        if not all([aws_access_key, aws_secret_key, queue_url]):
-            print("Отсутствуют необходимые переменные окружения:")
-            print(f"AWS_ACCESS_KEY_ID: {'установлен' if aws_access_key else 'отсутствует'}")
-            print(f"AWS_SECRET_ACCESS_KEY: {'установлен' if aws_secret_key else 'отсутствует'}")
-            print(f"YMQ_ADS_QUEUE_URL: {'установлен' if queue_url else 'отсутствует'}")
-            return
-
-        print(f"Подключение к YMQ с URL очереди: {queue_url}")
-        
-        client = boto3.client(
-            'sqs',
-            region_name='ru-central1',
-            endpoint_url='https://message-queue.api.cloud.yandex.net',
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key
-        )
-
-        message = {
-            "id": advertisement.id,
-            "title": advertisement.title,
-            "author": advertisement.author.email,
-            "status": advertisement.status
-        }
-
-        print(f"Отправка сообщения: {json.dumps(message)}")
-        
-        response = client.send_message(
-            QueueUrl=queue_url,
-            MessageBody=json.dumps(message)
-        )
-        print(f"Сообщение успешно отправлено. Response: {response}")
-        
-    except Exception as e:
-        print(f"Ошибка при отправке сообщения в очередь: {str(e)}")
-        print(f"Тип ошибки: {type(e).__name__}")
-        # Продолжаем выполнение, так как ошибка очереди не должна блокировать создание объявления
-
 class IsModerator(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.role == 'moderator'
@@ -339,7 +636,7 @@ class AdvertisementListView(APIView):
             openapi.Parameter(
                 'sort_by',
                 openapi.IN_QUERY,
-                description='Сортировка (created_at, price)',
+                description='Сортировка (created_at, price, relevance)',
                 type=openapi.TYPE_STRING,
                 required=False
             ),
@@ -350,6 +647,9 @@ class AdvertisementListView(APIView):
                 type=openapi.TYPE_STRING,
                 required=False
             ),
+            *FILTER_PARAMETERS,
+            *PAGINATION_PARAMETERS,
+            COUNT_PARAMETER,
         ],
         responses={
             200: AdvertisementSerializer(many=True),
@@ -357,29 +657,109 @@ class AdvertisementListView(APIView):
         operation_description="Получение списка объявлений с возможностью фильтрации и сортировки"
     )
     def get(self, request):
-        advertisements = Advertisement.objects.filter(status=AdvertisementStatus.ACTIVE)
-        
-        # Поиск по названию и описанию
-        search_query = request.query_params.get('search', '')
-        if search_query:
-            advertisements = advertisements.filter(
-                Q(title__icontains=search_query) | Q(description__icontains=search_query)
+        advertisements, paginator, params = feed_query(request)
+        paginated = params['paginated']
+        cache_key = feed_cache_key(request, params)
+        validators = get_validators(cache_key)
+        if validators is not None:
+            response = not_modified(request, *feed_validators(request, validators))
+            if response is not None:
+                return response
+
+        data, validators = get_or_build_with_validators(
+            cache_key,
+            lambda: build_advertisements_data(request, advertisements, paginator, favorite_ids=set()),
+            feed_item_ids,
+        )
+        overlay_favorites(request, data['results'] if paginated else data)
+        response = set_validators(Response(data), *feed_validators(request, validators))
+        if paginated:
+            count, exact = get_or_build(
+                feed_cache_key(request, feed_count_params(request, params)),
+                lambda: count_advertisements(advertisements, exact=wants_exact_count(request)),
             )
-        
-        # Сортировка
-        sort_by = request.query_params.get('sort_by', 'created_at')
-        order = request.query_params.get('order', 'desc')
-        
-        if sort_by not in ['created_at', 'price']:
-            sort_by = 'created_at'
-        if order not in ['asc', 'desc']:
-            order = 'desc'
-            
-        order_prefix = '' if order == 'asc' else '-'
-        advertisements = advertisements.order_by(f'{order_prefix}{sort_by}')
-        
-        serializer = AdvertisementSerializer(advertisements, many=True, context={'request': request})
-        return Response(serializer.data)
+        else:
+            count, exact = len(data), True
+        return set_total_count(response, count, exact)
+
+class FacetsSerializer(serializers.Serializer):
+    price_edges = serializers.ListField(
+        child=serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal(0)),
+        min_length=1,
+        max_length=settings.FACETS_MAX_PRICE_EDGES,
+    )
+
+    def validate_price_edges(self, edges):
+        if any(high <= low for low, high in zip(edges, edges[1:])):
+            raise serializers.ValidationError('Границы должны строго возрастать')
+        return edges
+
+class AdvertisementFacetsView(APIView):
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'price_edges',
+                openapi.IN_QUERY,
+                description='Границы корзин цен через запятую, по возрастанию (по умолчанию FACETS_PRICE_EDGES)',
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'search',
+                openapi.IN_QUERY,
+                description='Поиск по названию и описанию',
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            *FILTER_PARAMETERS,
+        ],
+        responses={
+            200: openapi.Response(
+                description="total - число активных объявлений; price - корзины [min, max) с числом "
+                            "активных объявлений; status - число объявлений по статусам (только модераторам)"
+            ),
+            400: "Ошибка валидации параметров"
+        },
+        operation_description="Счётчики для фильтров ленты: гистограмма цен и, для модераторов, число по статусам"
+    )
+    def get(self, request):
+        serializer = FacetsSerializer(data={
+            'price_edges': request.query_params.get('price_edges', settings.FACETS_PRICE_EDGES).split(','),
+        })
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        edges = serializer.validated_data['price_edges']
+        with_status = request.user.is_authenticated and IsModerator().has_permission(request, self)
+
+        advertisements = Advertisement.objects.all()
+        if not with_status:
+            advertisements = advertisements.filter(status=AdvertisementStatus.ACTIVE)
+        advertisements, search_query, filters = search_and_filter(request, advertisements)
+
+        def build():
+            counts = facet_counts(advertisements, edges, with_status)
+            price = serializer.fields['price_edges'].child
+            counts['price'] = [
+                {
+                    'min': None if low is None else price.to_representation(low),
+                    'max': None if high is None else price.to_representation(high),
+                    'count': count,
+                }
+                for low, high, count in counts['price']
+            ]
+            return counts
+
+        # Под версией ленты: любое изменение объявлений сбрасывает и счётчики
+        cache_key = feed_cache_key(request, {
+            'path': request.path,
+            'search': search_query,
+            'filters': filters,
+            'price_edges': edges,
+            'with_status': with_status,
+        })
+        return Response(get_or_build(cache_key, build))
 
 class AdvertisementCreateView(APIView):
     permission_classes = [IsAuthenticated]
@@ -441,9 +821,21 @@ class AdvertisementDetailView(APIView):
         operation_description="Получение детальной информации об объявлении"
     )
     def get(self, request, pk):
-        advertisement = get_object_or_404(Advertisement, pk=pk)
-        serializer = AdvertisementSerializer(advertisement, context={'request': request})
-        return Response(serializer.data) 
+        # На 304 хватает одного запроса метаданных: карточка не собирается и не читается из кеша
+        metadata_etag, last_modified = advertisement_metadata(pk)
+        # Ссылки на изображения абсолютные, поэтому ETag зависит и от хоста
+        etag = make_etag(metadata_etag, request.build_absolute_uri('/'), bool(get_favorite_ids(request, [pk])))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        def build():
+            advertisement = get_object_or_404(Advertisement.objects.with_related(), pk=pk)
+            return AdvertisementSerializer(advertisement, context={'request': request, 'favorite_ids': set()}).data
+
+        data = get_or_build(detail_cache_key(request, pk, metadata_etag), build)
+        overlay_favorites(request, [data])
+        return set_validators(Response(data), etag, last_modified)
 
     @swagger_auto_schema(
         request_body=AdvertisementUpdateSerializer,
@@ -457,7 +849,7 @@ class AdvertisementDetailView(APIView):
     )
     def put(self, request, pk):
         advertisement = get_object_or_404(Advertisement, pk=pk)
-        if advertisement.author != request.user:
+        if advertisement.author_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
         
         serializer = AdvertisementUpdateSerializer(advertisement, data=request.data, partial=True)
@@ -476,38 +868,49 @@ class AdvertisementDetailView(APIView):
     )
     def delete(self, request, pk):
         advertisement = get_object_or_404(Advertisement, pk=pk)
-        if advertisement.author != request.user:
+        if advertisement.author_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        advertisement.delete()
+        with transaction.atomic():
+            if not lock_current(advertisement):
+                raise Http404
+            # Событие пишется до удаления, пока у объекта есть id
+            notify_queue(advertisement, 'advertisement.deleted')
+            adjust_status_counters([(advertisement.author_id, advertisement.status, None)])
+            # Записи избранного удалятся каскадом, закешированные множества id устаревают
+            invalidate_favorite_ids(
+                FavoriteAdvertisement.objects.filter(advertisement=advertisement).values_list('user_id', flat=True)
+            )
+            advertisement.delete()
+            bump_advertisements_version()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 class UserAdvertisementsView(APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
+        manual_parameters=[*PAGINATION_PARAMETERS, COUNT_PARAMETER, STREAM_PARAMETER],
         responses={
             200: AdvertisementSerializer(many=True),
         },
         operation_description="Получение списка объявлений пользователя"
     )
     def get(self, request):
-        advertisements = Advertisement.objects.filter(author=request.user)
-        serializer = AdvertisementSerializer(advertisements, many=True, context={'request': request})
-        return Response(serializer.data)
+        advertisements = Advertisement.objects.filter(author_id=request.user.id).with_related()
+        return advertisements_response(request, advertisements)
 
 class ModeratorAdvertisementsView(APIView):
     permission_classes = [IsAuthenticated, IsModerator]
 
     @swagger_auto_schema(
+        manual_parameters=[*PAGINATION_PARAMETERS, COUNT_PARAMETER, STREAM_PARAMETER],
         responses={
             200: AdvertisementSerializer(many=True),
         },
         operation_description="Получение списка объявлений на модерацию"
     )
     def get(self, request):
-        advertisements = Advertisement.objects.filter(status=AdvertisementStatus.PENDING)
-        serializer = AdvertisementSerializer(advertisements, many=True, context={'request': request})
-        return Response(serializer.data)
+        advertisements = Advertisement.objects.filter(status=AdvertisementStatus.PENDING).with_related()
+        return advertisements_response(request, advertisements)
 
     @swagger_auto_schema(
         request_body=openapi.Schema(
@@ -519,7 +922,8 @@ class ModeratorAdvertisementsView(APIView):
         responses={
             200: AdvertisementSerializer,
             400: "Ошибка валидации данных",
-            403: "Нет прав на модерацию"
+            403: "Нет прав на модерацию",
+            409: "Объявление взято на модерацию другим модератором"
         },
         operation_description="Изменение статуса объявления"
     )
@@ -529,27 +933,221 @@ class ModeratorAdvertisementsView(APIView):
         
         if new_status not in ['active', 'rejected']:
             return Response({'error': 'Неверный статус'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        advertisement.status = new_status
-        advertisement.save()
+        with transaction.atomic():
+            # Статус и аренда - из заблокированной строки, а не из прочитанной до транзакции
+            if not lock_current(advertisement, 'lease_owner_id', 'lease_expires_at'):
+                raise Http404
+            if is_leased_by_other(advertisement, request.user.id):
+                return Response({'error': 'Объявление взято на модерацию другим модератором'},
+                                status=status.HTTP_409_CONFLICT)
+            adjust_status_counters([(advertisement.author_id, advertisement.status, new_status)])
+            advertisement.status = new_status
+            advertisement.lease_owner = None
+            advertisement.lease_expires_at = None
+            advertisement.save(update_fields=['status', 'lease_owner', 'lease_expires_at', 'updated_at'])
+            notify_queue(advertisement, 'advertisement.moderated')
+            bump_advertisements_version()
         
         serializer = AdvertisementSerializer(advertisement, context={'request': request})
         return Response(serializer.data)
 
+class ModerationDecisionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=[AdvertisementStatus.ACTIVE, AdvertisementStatus.REJECTED])
+
+class BulkModerationSerializer(serializers.Serializer):
+    decisions = serializers.ListField(
+        child=ModerationDecisionSerializer(),
+        allow_empty=False,
+        max_length=settings.MODERATION_BULK_MAX_SIZE
+    )
+
+    def validate_decisions(self, value):
+        ids = [decision['id'] for decision in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Повторяющиеся id объявлений")
+        return value
+
+class BulkModerationView(APIView):
+    permission_classes = [IsAuthenticated, IsModerator]
+
+    @swagger_auto_schema(
+        request_body=BulkModerationSerializer,
+        responses={
+            200: openapi.Response(
+                description="Результат по каждому объявлению",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'results': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(
+                                type=openapi.TYPE_OBJECT,
+                                properties={
+                                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                    'status': openapi.Schema(type=openapi.TYPE_STRING, description='Новый статус'),
+                                    'error': openapi.Schema(
+                                        type=openapi.TYPE_STRING,
+                                        description='not_found - объявления нет, leased - его модерирует другой модератор'
+                                    ),
+                                }
+                            )
+                        )
+                    }
+                )
+            ),
+            400: "Ошибка валидации данных",
+            403: "Нет прав на модерацию"
+        },
+        operation_description="Изменение статуса нескольких объявлений за один запрос"
+    )
+    def post(self, request):
+        serializer = BulkModerationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        decisions = {decision['id']: decision['status'] for decision in serializer.validated_data['decisions']}
+
+        with transaction.atomic():
+            # Строки блокируются и читаются один раз: по ним видно, каких объявлений нет, и собираются события
+            rows = (
+                Advertisement.objects.select_for_update(of=('self',))
+                .filter(id__in=decisions)
+                .select_related('author')
+                .only('id', 'title', 'status', 'lease_owner_id', 'lease_expires_at', 'author__email')
+            )
+            now = timezone.now()
+            errors = {}
+            advertisements = []
+            by_status = {}
+            changes = []
+            for advertisement in rows:
+                # Объявления, взятые в аренду другим модератором, не трогаем
+                if is_leased_by_other(advertisement, request.user.id, now):
+                    errors[advertisement.id] = 'leased'
+                    continue
+                changes.append((advertisement.author_id, advertisement.status, decisions[advertisement.id]))
+                advertisement.status = decisions[advertisement.id]
+                advertisements.append(advertisement)
+                by_status.setdefault(advertisement.status, []).append(advertisement.id)
+
+            # Один UPDATE на статус; update() не трогает auto_now, поэтому updated_at задаётся явно
+            for new_status, ids in by_status.items():
+                Advertisement.objects.filter(id__in=ids).update(
+                    status=new_status, updated_at=now, lease_owner=None, lease_expires_at=None
+                )
+            adjust_status_counters(changes)
+            if advertisements:
+                notify_queue_many(advertisements, 'advertisement.moderated')
+                bump_advertisements_version()
+
+        updated = {advertisement.id for advertisement in advertisements}
+        results = [
+            {'id': pk, 'status': new_status} if pk in updated
+            else {'id': pk, 'error': errors.get(pk, 'not_found')}
+            for pk, new_status in decisions.items()
+        ]
+        return Response({'results': results})
+
+class ClaimSerializer(serializers.Serializer):
+    count = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.MODERATION_CLAIM_MAX_SIZE,
+        default=settings.MODERATION_CLAIM_SIZE
+    )
+
+class ReleaseSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+class ModeratorClaimView(APIView):
+    permission_classes = [IsAuthenticated, IsModerator]
+
+    @swagger_auto_schema(
+        request_body=ClaimSerializer,
+        responses={
+            200: openapi.Response(
+                description="Объявления, взятые в аренду",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'lease_expires_at': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+                        'results': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                    }
+                )
+            ),
+            400: "Ошибка валидации данных",
+            403: "Нет прав на модерацию"
+        },
+        operation_description="Взять на модерацию следующие объявления из очереди, их не получат другие модераторы до конца аренды"
+    )
+    def post(self, request):
+        serializer = ClaimSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        ids, expires_at = claim_advertisements(request.user.id, serializer.validated_data['count'])
+        rows = advertisement_rows(Advertisement.objects.filter(id__in=ids).order_by('created_at', 'id'))
+        return Response({
+            'lease_expires_at': serializers.DateTimeField().to_representation(expires_at),
+            'results': serialize_advertisement_rows(request, rows),
+        })
+
+    @swagger_auto_schema(
+        request_body=ReleaseSerializer,
+        responses={
+            200: openapi.Response(
+                description="Число возвращённых в очередь объявлений",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={'released': openapi.Schema(type=openapi.TYPE_INTEGER)}
+                )
+            ),
+            400: "Ошибка валидации данных",
+            403: "Нет прав на модерацию"
+        },
+        operation_description="Вернуть в очередь взятые объявления"
+    )
+    def delete(self, request):
+        serializer = ReleaseSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'released': release_leases(request.user.id, serializer.validated_data['ids'])})
+
 class FavoriteAdvertisementView(APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'status',
+                openapi.IN_QUERY,
+                description='Статус объявления (active, pending, rejected)',
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            *PAGINATION_PARAMETERS,
+            COUNT_PARAMETER,
+        ],
         responses={
             200: AdvertisementSerializer(many=True),
+            400: "Неизвестный статус"
         },
-        operation_description="Получение списка избранных объявлений"
+        operation_description="Получение списка избранных объявлений, недавно добавленные сверху"
     )
     def get(self, request):
-        favorites = FavoriteAdvertisement.objects.filter(user=request.user)
-        advertisements = [fav.advertisement for fav in favorites]
-        serializer = AdvertisementSerializer(advertisements, many=True, context={'request': request})
-        return Response(serializer.data)
+        # Одна выборка объявлений с JOIN на избранное; сортировка и курсор по полям избранного
+        advertisements = Advertisement.objects.filter(favorited_by__user_id=request.user.id).annotate(
+            favorited_at=F('favorited_by__created_at'),
+            favorite_advertisement_id=F('favorited_by__advertisement_id'),
+        )
+        advertisement_status = request.query_params.get('status')
+        if advertisement_status:
+            if advertisement_status not in AdvertisementStatus.values:
+                return Response({'status': ['Неизвестный статус']}, status=status.HTTP_400_BAD_REQUEST)
+            advertisements = advertisements.filter(status=advertisement_status)
+
+        paginator = KeysetPagination('favorited_at', pk_field='favorite_advertisement_id')
+        advertisements = advertisements.order_by(*paginator.ordering)
+        data = build_advertisements_data(request, advertisements, paginator, favorite_ids=AllFavorites())
+        return set_total_count(Response(data), *list_total_count(request, advertisements, data))
 
     @swagger_auto_schema(
         responses={
@@ -560,12 +1158,14 @@ class FavoriteAdvertisementView(APIView):
         operation_description="Добавление объявления в избранное"
     )
     def post(self, request, pk):
-        advertisement = get_object_or_404(Advertisement, pk=pk)
-        
-        if FavoriteAdvertisement.objects.filter(user=request.user, advertisement=advertisement).exists():
+        # Версия кеша не меняется: favorites_count в закешированных ответах отстаёт не больше чем на ADVERTISEMENTS_CACHE_TIMEOUT
+        added = add_favorite(request.user.id, pk)
+        if added is None:
+            raise Http404
+        if not added:
             return Response({'error': 'Объявление уже в избранном'}, status=status.HTTP_400_BAD_REQUEST)
         
-        FavoriteAdvertisement.objects.create(user=request.user, advertisement=advertisement)
+        advertisement = get_object_or_404(Advertisement.objects.with_related(), pk=pk)
         serializer = AdvertisementSerializer(advertisement, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -577,12 +1177,86 @@ class FavoriteAdvertisementView(APIView):
         operation_description="Удаление объявления из избранного"
     )
     def delete(self, request, pk):
-        favorite = get_object_or_404(FavoriteAdvertisement, user=request.user, advertisement_id=pk)
-        advertisement = favorite.advertisement
-        favorite.delete()
+        if not remove_favorite(request.user.id, pk):
+            raise Http404
+        advertisement = get_object_or_404(Advertisement.objects.with_related(), pk=pk)
         serializer = AdvertisementSerializer(advertisement, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+FAVORITE_STATE_SCHEMA = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'id': openapi.Schema(type=openapi.TYPE_INTEGER, description='id объявления'),
+        'is_favorite': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+    }
+)
+
+class FavoriteView(APIView):
+    # Идемпотентные PUT/DELETE: повторный запрос не ошибка, в ответе только новое состояние
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        responses={
+            201: openapi.Response(description="Объявление добавлено в избранное", schema=FAVORITE_STATE_SCHEMA),
+            200: openapi.Response(description="Объявление уже было в избранном", schema=FAVORITE_STATE_SCHEMA),
+            404: "Объявление не найдено"
+        },
+        operation_description="Добавление объявления в избранное"
+    )
+    def put(self, request, pk):
+        added = add_favorite(request.user.id, pk)
+        if added is None:
+            raise Http404
+        return Response(
+            {'id': pk, 'is_favorite': True},
+            status=status.HTTP_201_CREATED if added else status.HTTP_200_OK
+        )
+
+    @swagger_auto_schema(
+        responses={
+            200: openapi.Response(description="Объявления нет в избранном", schema=FAVORITE_STATE_SCHEMA),
+        },
+        operation_description="Удаление объявления из избранного"
+    )
+    def delete(self, request, pk):
+        remove_favorite(request.user.id, pk)
+        return Response({'id': pk, 'is_favorite': False})
+
+class FavoriteStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=True,
+        max_length=settings.FAVORITES_STATUS_MAX_IDS,
+    )
+
+class FavoriteStatusView(APIView):
+    # Клиент получает ленту из общего кеша и одним запросом узнаёт, какие из объявлений в избранном
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        request_body=FavoriteStatusSerializer,
+        responses={
+            200: openapi.Response(
+                description="id из запроса, которые есть в избранном, в исходном порядке",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                    }
+                )
+            ),
+            400: "Ошибка валидации данных"
+        },
+        operation_description="Какие из переданных объявлений в избранном у пользователя"
+    )
+    def post(self, request):
+        serializer = FavoriteStatusSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        ids = serializer.validated_data['ids']
+        favorite_ids = get_user_favorite_ids(request.user.id) if ids else frozenset()
+        return Response({'ids': list(dict.fromkeys(i for i in ids if i in favorite_ids))})
+
 class ChangePasswordSerializer(serializers.Serializer):
     old_password = serializers.CharField(required=True, write_only=True)
     new_password = serializers.CharField(required=True, write_only=True)
@@ -609,7 +1283,7 @@ class ChangePasswordSerializer(serializers.Serializer):
     def save(self, **kwargs):
         user = self.context['request'].user
         user.set_password(self.validated_data['new_password'])
-        user.save()
+        user.save(update_fields=['password'])
         return user
 
 class ChangePasswordView(APIView):
@@ -75,6 +75,10 @@ resource "yandex_mdb_postgresql_database" "db" {
   cluster_id = yandex_mdb_postgresql_cluster.pg.id
   name       = "adhunt"
   owner      = yandex_mdb_postgresql_user.user.name
+
+  extension {
+    name = "pg_trgm"
+  }
 }
 
 resource "yandex_storage_bucket" "bucket" {